@@ -0,0 +1,179 @@
+"""
+Times each pipeline stage on synthetic datasets and writes the results as JSON for comparison across commits.
+
+    python -m benchmarks.bench_pipeline --sizes 1K:10 100K:10 1M:50 10K:2000 --out bench/$(git rev-parse --short HEAD).json
+
+Each size is ROWS:COLUMNS (see benchmarks.datagen). Stages timed per dataset:
+
+    load      CREATE TABLE ... FROM read_csv_auto through the dataset store, including type normalization
+    profile   schema and column statistics extraction
+    prompt    system prompt construction from the profile, with the full schema and pruned for PRUNE_QUESTION
+    index     building the column relevance index
+    llm       query_llm against the local mock OpenAI-compatible server (cache bypassed), with the full and the
+              pruned prompt; --prefill-tokens-per-second makes the mock's latency grow with prompt size
+    queries   a fixed query set, each read as the first result page like the app does
+    charts    chart data for the full result of CHART_QUERIES, aggregated and downsampled in DuckDB
+
+Generated files are kept in --data-dir and reused; generation time is reported but is not a pipeline stage.
+"""
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import duckdb
+
+from benchmarks.datagen import ensure_dataset, parse_count
+from charts import chart_data
+from benchmarks.mock_llm_server import MockLLMServer, use_mock_provider
+from config import settings
+from dataset_store import TABLE_NAME, DatasetStore
+from ingestion import ingest_path
+from llm_engine import query_llm
+from profiling import profile_table
+from query_results import fetch_page
+from schema_index import ColumnIndex
+from text_to_sql import SQLQuery, build_question_prompt, build_system_prompt
+
+PRUNE_QUESTION = "What is the average amount and the total qty per category?"
+
+QUERIES = {
+    "count": f"SELECT COUNT(*) AS row_count FROM {TABLE_NAME}",
+    "sum_numeric": f"SELECT SUM(amount_0) AS total FROM {TABLE_NAME}",
+    # price_N is comma-decimal text in the file; with normalize_types off it is still VARCHAR and needs the cast
+    "sum_comma_decimal": f"SELECT SUM(price_1) AS total FROM {TABLE_NAME}" if settings.normalize_types else
+                         f"SELECT SUM(TRY_CAST(TRIM(REPLACE(price_1, ',', '.')) AS DOUBLE)) AS total FROM {TABLE_NAME}",
+    "filter_count": f"SELECT COUNT(*) AS row_count FROM {TABLE_NAME} WHERE qty_2 > 50",
+    "group_by": f"SELECT category, COUNT(*) AS row_count, AVG(amount_0) AS avg_amount FROM {TABLE_NAME} "
+                f"GROUP BY category ORDER BY row_count DESC",
+    "distinct_labels": f"SELECT COUNT(DISTINCT label_3) AS labels FROM {TABLE_NAME}",
+    "top_n": f"SELECT * FROM {TABLE_NAME} ORDER BY amount_0 DESC LIMIT 10",
+    "first_page": f"SELECT * FROM {TABLE_NAME}",
+}
+
+# The full scan (first_page), a series over id and a grouped result
+CHART_QUERIES = ["first_page", "top_n", "group_by"]
+
+def _timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def _summary(seconds: list[float]) -> dict:
+    return {"median_seconds": statistics.median(seconds), "min_seconds": min(seconds), "max_seconds": max(seconds)}
+
+def parse_size(value: str) -> tuple[int, int]:
+    rows, _, columns = value.partition(":")
+    return parse_count(rows), int(columns or 10)
+
+def run_size(rows: int, columns: int, data_dir: str, seed: int, repeats: int, llm_rounds: int) -> dict:
+    path, generate_seconds = _timed(ensure_dataset, data_dir, rows, columns, seed)
+    result = {"rows": rows, "columns": columns, "file_bytes": path.stat().st_size,
+              "generate_seconds": generate_seconds}
+
+    # A throwaway store, so every run measures a cold load
+    with tempfile.TemporaryDirectory(dir=settings.cache_dir) as root:
+        store = DatasetStore(root, max_bytes=2**63, max_open=1)
+        _, load_seconds = _timed(ingest_path, store, "bench", str(path))
+        result["load_seconds"] = load_seconds
+        result["load_rows_per_second"] = rows / load_seconds if load_seconds else None
+
+        con = store.connect("bench")
+        profile, result["profile_seconds"] = _timed(profile_table, con)
+        system_prompt, result["prompt_seconds"] = _timed(build_system_prompt, profile["columns"])
+        result["prompt_chars"] = len(system_prompt)
+        index, result["index_seconds"] = _timed(ColumnIndex.from_profile, profile)
+        pruned_prompt, result["pruned_prompt_seconds"] = _timed(
+            build_question_prompt, profile["columns"], PRUNE_QUESTION, index
+        )
+        result["pruned_prompt_chars"] = len(pruned_prompt)
+
+        for key, prompt in (("llm", system_prompt), ("llm_pruned", pruned_prompt)):
+            llm_seconds = []
+            for i in range(llm_rounds):
+                response, seconds = _timed(query_llm, prompt, f"{PRUNE_QUESTION} ({i})", SQLQuery, use_cache=False)
+                if response is None:
+                    raise RuntimeError("query_llm failed against the mock server")
+                llm_seconds.append(seconds)
+            result[key] = _summary(llm_seconds)
+
+        result["queries"] = {}
+        for name, sql_query in QUERIES.items():
+            seconds = [_timed(fetch_page, con, sql_query)[1] for _ in range(repeats)]
+            result["queries"][name] = _summary(seconds)
+        result["charts"] = {}
+        for name in CHART_QUERIES:
+            seconds = [_timed(chart_data, con, QUERIES[name])[1] for _ in range(repeats)]
+            result["charts"][name] = _summary(seconds)
+        # drop() leaves datasets alone while their cursors are referenced
+        con.close()
+        del con
+        store.drop("bench")
+    return result
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=Path(__file__).parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(sizes: list[tuple[int, int]], data_dir: str, seed: int, repeats: int, llm_rounds: int,
+        first_token_seconds: float, tokens_per_second: float, prefill_tokens_per_second: float = 0.0) -> dict:
+    Path(settings.cache_dir).mkdir(parents=True, exist_ok=True)
+    report = {
+        "commit": _git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "duckdb": duckdb.__version__,
+        "platform": platform.platform(),
+        "settings": {
+            "duckdb_memory_limit": settings.duckdb_memory_limit,
+            "duckdb_threads": settings.duckdb_threads,
+            "csv_sample_size": settings.csv_sample_size,
+            "normalize_types": settings.normalize_types,
+            "result_page_size": settings.result_page_size,
+            "chart_max_points": settings.chart_max_points,
+            "schema_prune_min_columns": settings.schema_prune_min_columns,
+            "schema_prune_top_n": settings.schema_prune_top_n,
+        },
+        "parameters": {"seed": seed, "repeats": repeats, "llm_rounds": llm_rounds,
+                       "mock_first_token_seconds": first_token_seconds,
+                       "mock_tokens_per_second": tokens_per_second,
+                       "mock_prefill_tokens_per_second": prefill_tokens_per_second},
+        "results": [],
+    }
+    with MockLLMServer(first_token_seconds=first_token_seconds, tokens_per_second=tokens_per_second,
+                       prefill_tokens_per_second=prefill_tokens_per_second) as mock, \
+            use_mock_provider(mock):
+        for rows, columns in sizes:
+            report["results"].append(run_size(rows, columns, data_dir, seed, repeats, llm_rounds))
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", type=parse_size, default=[parse_size("1K:10"), parse_size("100K:10")],
+                        help="ROWS:COLUMNS pairs, e.g. 1K:10 100M:10 10K:2000")
+    parser.add_argument("--data-dir", default=".pipeline_cache/bench_data")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeats", type=int, default=3, help="Runs per query; the median is reported")
+    parser.add_argument("--llm-rounds", type=int, default=5)
+    parser.add_argument("--first-token-seconds", type=float, default=0.0)
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="0 disables simulated generation time")
+    parser.add_argument("--prefill-tokens-per-second", type=float, default=0.0,
+                        help="Simulated prompt processing rate; 0 makes latency independent of prompt size")
+    parser.add_argument("--out", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = run(args.sizes, args.data_dir, args.seed, args.repeats, args.llm_rounds, args.first_token_seconds,
+                 args.tokens_per_second, args.prefill_tokens_per_second)
+    text = json.dumps(report, indent=2)
+    if args.out:
+        Path(args.out).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.out).write_text(text)
+    print(text)
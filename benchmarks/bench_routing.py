@@ -0,0 +1,121 @@
+"""
+Drives the LLM router against two mock providers, one misbehaving and one healthy, and reports latency
+percentiles, how requests were spread over the routes and the primary's circuit state.
+
+    python -m benchmarks.bench_routing --scenario tail --requests 200
+    python -m benchmarks.bench_routing --scenario rate_limited --mode sync
+
+Scenarios, for the primary (openai) route; the backup (groq) route always answers in --first-token-seconds:
+    tail           3% of requests take --tail-seconds longer; hedging should cut the tail to about the p95
+    rate_limited   half the requests are answered with 429 and a Retry-After header
+    outage         every request fails with a 500; the circuit should open and keep traffic off the primary
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+
+import llm_router
+from benchmarks.mock_llm_server import MockLLMServer, use_mock_provider
+from config import settings
+from llm_engine import aquery_llm, close_async_clients, query_llm
+from text_to_sql import SQLQuery
+
+SCENARIOS = {
+    "tail": lambda tail_seconds: {"tail_rate": 0.03, "tail_seconds": tail_seconds},
+    "rate_limited": lambda tail_seconds: {"error_rate": 0.5, "retry_after": 1.0},
+    "outage": lambda tail_seconds: {"server_error_rate": 1.0},
+}
+
+@contextmanager
+def use_settings(**fields):
+    saved = {field: getattr(settings, field) for field in fields}
+    for field, value in fields.items():
+        setattr(settings, field, value)
+    try:
+        yield
+    finally:
+        for field, value in saved.items():
+            setattr(settings, field, value)
+
+def _percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+async def _run_async(requests: int, concurrency: int) -> list:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def ask(i):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await aquery_llm("You are a benchmark.", f"question {i}", SQLQuery, use_cache=False)
+            except Exception as e:
+                return None, type(e).__name__
+            return time.perf_counter() - start, None
+
+    try:
+        return await asyncio.gather(*(ask(i) for i in range(requests)))
+    finally:
+        await close_async_clients()
+
+def _run_sync(requests: int, concurrency: int) -> list:
+    def ask(i):
+        start = time.perf_counter()
+        response = query_llm("You are a benchmark.", f"question {i}", SQLQuery, use_cache=False)
+        return (time.perf_counter() - start, None) if response else (None, "error")
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(ask, range(requests)))
+
+def run(scenario: str, mode: str, requests: int, concurrency: int, first_token_seconds: float,
+        tail_seconds: float, hedge: bool) -> dict:
+    faults = SCENARIOS[scenario](tail_seconds)
+    with ExitStack() as stack:
+        primary = stack.enter_context(MockLLMServer(first_token_seconds=first_token_seconds, **faults))
+        backup = stack.enter_context(MockLLMServer(first_token_seconds=first_token_seconds))
+        stack.enter_context(use_mock_provider(primary, "openai"))
+        stack.enter_context(use_mock_provider(backup, "groq"))
+        stack.enter_context(use_settings(llm_routes="openai:gpt-4o,groq:llama-3.3-70b-versatile",
+                                         llm_hedge_enabled=hedge, llm_backoff_base_seconds=0.1))
+        # Fresh circuit breakers, latency history and rate limits for this run
+        llm_router._router = None
+
+        start = time.perf_counter()
+        outcomes = asyncio.run(_run_async(requests, concurrency)) if mode == "async" \
+            else _run_sync(requests, concurrency)
+        elapsed = time.perf_counter() - start
+
+        latencies = [latency for latency, error in outcomes if error is None]
+        errors = [error for latency, error in outcomes if error is not None]
+        return {
+            "scenario": scenario,
+            "mode": mode,
+            "hedging": hedge,
+            "requests": requests,
+            "failed": len(errors),
+            "elapsed_seconds": elapsed,
+            "latency_seconds": {
+                "p50": statistics.median(latencies), "p95": _percentile(latencies, 0.95),
+                "p99": _percentile(latencies, 0.99), "max": max(latencies),
+            } if latencies else None,
+            "primary": {"requests": primary.requests, "errors": primary.errors},
+            "backup": {"requests": backup.requests, "errors": backup.errors},
+            "routes": llm_router.get_router().status(),
+        }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="tail")
+    parser.add_argument("--mode", choices=["async", "sync"], default="async")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--first-token-seconds", type=float, default=0.1)
+    parser.add_argument("--tail-seconds", type=float, default=2.0)
+    parser.add_argument("--no-hedge", action="store_true", help="Fail over on errors only, without hedging")
+    args = parser.parse_args()
+    print(json.dumps(run(args.scenario, args.mode, args.requests, args.concurrency, args.first_token_seconds,
+                         args.tail_seconds, not args.no_hedge), indent=2, default=str))
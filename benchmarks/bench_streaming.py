@@ -0,0 +1,47 @@
+"""
+Compares time-to-SQL for blocking and streamed completions against the mock LLM server.
+
+    python -m benchmarks.bench_streaming --first-token-seconds 0.5 --tokens-per-second 40
+"""
+import argparse
+import json
+import statistics
+import time
+
+from benchmarks.mock_llm_server import MockLLMServer, use_mock_provider
+from llm_engine import query_llm
+from text_to_sql import SQLQuery
+
+def run(first_token_seconds: float, tokens_per_second: float, rounds: int) -> dict:
+    results = {}
+    with MockLLMServer(first_token_seconds=first_token_seconds, tokens_per_second=tokens_per_second) as mock, \
+            use_mock_provider(mock):
+        for mode in ("blocking", "streaming"):
+            sql_ready, total = [], []
+            for i in range(rounds):
+                start = time.perf_counter()
+                ready = {}
+                on_field = (lambda name, value: ready.setdefault(name, time.perf_counter() - start)) \
+                    if mode == "streaming" else None
+                response = query_llm("You are a benchmark.", f"question {i}", SQLQuery, use_cache=False,
+                                     on_field=on_field)
+                if response is None:
+                    raise RuntimeError("query_llm failed against the mock server")
+                total.append(time.perf_counter() - start)
+                sql_ready.append(ready.get("sql_query", total[-1]))
+            results[mode] = {
+                "time_to_sql_seconds": statistics.median(sql_ready),
+                "time_to_full_response_seconds": statistics.median(total),
+            }
+    results["time_to_sql_speedup"] = (
+        results["blocking"]["time_to_sql_seconds"] / results["streaming"]["time_to_sql_seconds"]
+    )
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--first-token-seconds", type=float, default=0.5)
+    parser.add_argument("--tokens-per-second", type=float, default=40.0)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+    print(json.dumps(run(args.first_token_seconds, args.tokens_per_second, args.rounds), indent=2))
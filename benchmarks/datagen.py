@@ -0,0 +1,87 @@
+"""
+Generates reproducible synthetic CSV datasets for benchmarks.
+
+    python -m benchmarks.datagen --rows 1M --columns 50 --out data/
+
+Values are hashes of (row, column, seed), so the same arguments always produce the same file. Besides `id` and
+`category`, columns cycle through five kinds:
+
+    amount_N  DOUBLE
+    price_N   numeric VARCHAR with a comma decimal separator ("735,10"), converted to DOUBLE by type normalization
+    qty_N     INTEGER
+    label_N   low-cardinality VARCHAR, every 50th value NULL
+    day_N     DATE
+"""
+import argparse
+from pathlib import Path
+
+import duckdb
+
+COLUMN_KINDS = {
+    "amount": "round((hash(i, {k}, {seed}) % 1000000) / 100.0, 2)",
+    "price": "replace(printf('%.2f', (hash(i, {k}, {seed}) % 100000) / 100.0), '.', ',')",
+    "qty": "(hash(i, {k}, {seed}) % 100)::INTEGER",
+    "label": "CASE WHEN hash(i, {k}, {seed}) % 50 = 0 THEN NULL ELSE 'L' || (hash(i, {k}, {seed}) % 200) END",
+    "day": "DATE '2020-01-01' + (hash(i, {k}, {seed}) % 1500)::INTEGER",
+}
+CATEGORIES = ["north", "south", "east", "west", "central"]
+MIN_COLUMNS = 2 + len(COLUMN_KINDS)
+
+def parse_count(value: str) -> int:
+    """
+    Parses counts like "1000", "10K" or "100M".
+    """
+    value = value.strip().upper()
+    scale = {"K": 1_000, "M": 1_000_000, "B": 1_000_000_000}.get(value[-1:], 1)
+    return int(float(value.rstrip("KMB")) * scale)
+
+def column_names(columns: int) -> list[str]:
+    kinds = list(COLUMN_KINDS)
+    return ["id", "category"] + [f"{kinds[k % len(kinds)]}_{k}" for k in range(columns - 2)]
+
+def generate_csv(path: str, rows: int, columns: int, seed: int = 0) -> Path:
+    """
+    Writes a synthetic CSV with DuckDB's COPY, which streams rows straight to disk, so 100M-row files need no more
+    memory than small ones.
+    """
+    if columns < MIN_COLUMNS:
+        raise ValueError(f"Need at least {MIN_COLUMNS} columns so every column kind is present")
+    kinds = list(COLUMN_KINDS)
+    categories = ", ".join(f"'{c}'" for c in CATEGORIES)
+    select = ["i AS id", f"[{categories}][(hash(i, {seed}) % {len(CATEGORIES)})::INTEGER + 1] AS category"]
+    for k, name in enumerate(column_names(columns)[2:]):
+        select.append(f"{COLUMN_KINDS[kinds[k % len(kinds)]].format(k=k, seed=seed)} AS {name}")
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    con = duckdb.connect()
+    try:
+        con.execute(
+            f"COPY (SELECT {', '.join(select)} FROM range({rows}) AS t(i)) TO '{tmp_path}' (FORMAT CSV, HEADER)"
+        )
+    finally:
+        con.close()
+    tmp_path.replace(path)
+    return path
+
+def dataset_path(data_dir: str, rows: int, columns: int, seed: int = 0) -> Path:
+    return Path(data_dir) / f"synthetic-{rows}x{columns}-s{seed}.csv"
+
+def ensure_dataset(data_dir: str, rows: int, columns: int, seed: int = 0) -> Path:
+    """
+    Returns the path of the synthetic dataset, generating it only if it is not already on disk.
+    """
+    path = dataset_path(data_dir, rows, columns, seed)
+    if not path.exists():
+        generate_csv(path, rows, columns, seed)
+    return path
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=parse_count, default=parse_count("100K"))
+    parser.add_argument("--columns", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=".pipeline_cache/bench_data", help="Directory for generated files")
+    args = parser.parse_args()
+    print(ensure_dataset(args.out, args.rows, args.columns, args.seed))
@@ -0,0 +1,215 @@
+import json
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_CONTENT = {
+    "sql_query": "SELECT COUNT(*) AS row_count FROM analysis_staging",
+    "explanation": (
+        "Counts every row in the analysis_staging table. The question asks for the overall size of the dataset, "
+        "so no filtering or grouping is needed; a single COUNT(*) aggregate, aliased as row_count as the rules "
+        "require, answers it directly and runs as one sequential scan over the table."
+    ),
+}
+
+# --- Mock OpenAI-Compatible Server ---
+class _QuietHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 drops connections from concurrent clients, which then retry a second later
+    request_queue_size = 128
+
+    def handle_error(self, request, client_address):
+        # Clients dropping pooled keep-alive connections is expected, not an error
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+class MockLLMServer:
+    """
+    Local OpenAI-compatible chat completions server for benchmarks.
+
+    Latency is simulated as a time to first token (`first_token_seconds`, plus the prompt's tokens at
+    `prefill_tokens_per_second` when set) followed by `tokens_per_second`, for both plain and streamed (SSE)
+    responses, with `tail_rate` of requests waiting another `tail_seconds` first. `error_rate` returns that
+    fraction of requests as 429s with a Retry-After header, and `server_error_rate` as 500s.
+    Counters record requests, errors and accepted TCP connections.
+    """
+
+    def __init__(self, content: dict = None, first_token_seconds: float = 0.0, tokens_per_second: float = 0.0,
+                 error_rate: float = 0.0, retry_after: float = 1.0, port: int = 0, prefill_tokens_per_second: float = 0.0,
+                 server_error_rate: float = 0.0, tail_rate: float = 0.0, tail_seconds: float = 0.0):
+        self.content = content or DEFAULT_CONTENT
+        self.first_token_seconds = first_token_seconds
+        self.tokens_per_second = tokens_per_second
+        self.prefill_tokens_per_second = prefill_tokens_per_second
+        self.tail_rate = tail_rate
+        self.tail_seconds = tail_seconds
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.server_error_rate = server_error_rate
+        self.requests = 0
+        self.errors = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._server = _QuietHTTPServer(("127.0.0.1", port), self._handler())
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}/v1"
+
+    def start(self) -> "MockLLMServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _count(self, name: str) -> int:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+            return getattr(self, name)
+
+    def _tokens(self) -> list[str]:
+        # Roughly four characters per token, which is close enough for latency simulation
+        text = json.dumps(self.content)
+        return [text[i:i + 4] for i in range(0, len(text), 4)]
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                server._count("connections")
+                super().setup()
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                server._count("requests")
+
+                if server.error_rate and random.random() < server.error_rate:
+                    server._count("errors")
+                    return self._send_json(429, {"error": {"message": "Rate limit reached", "type": "rate_limit"}},
+                                           {"Retry-After": str(server.retry_after)})
+                if server.server_error_rate and random.random() < server.server_error_rate:
+                    server._count("errors")
+                    return self._send_json(500, {"error": {"message": "Internal server error", "type": "server_error"}})
+
+                tokens = server._tokens()
+                prefill = self._usage(request, tokens)["prompt_tokens"] / server.prefill_tokens_per_second \
+                    if server.prefill_tokens_per_second else 0
+                tail = server.tail_seconds if server.tail_rate and random.random() < server.tail_rate else 0
+                time.sleep(server.first_token_seconds + prefill + tail)
+                delay = 1 / server.tokens_per_second if server.tokens_per_second else 0
+                if request.get("stream"):
+                    usage = (request.get("stream_options") or {}).get("include_usage")
+                    self._stream(request["model"], tokens, delay, self._usage(request, tokens) if usage else None)
+                else:
+                    time.sleep(delay * len(tokens))
+                    self._send_json(200, {
+                        "id": "chatcmpl-mock", "object": "chat.completion", "created": int(time.time()),
+                        "model": request["model"],
+                        "choices": [{"index": 0, "finish_reason": "stop",
+                                     "message": {"role": "assistant", "content": "".join(tokens)}}],
+                        "usage": self._usage(request, tokens),
+                    })
+
+            def _usage(self, request, tokens):
+                prompt_tokens = sum(len(m.get("content", "")) for m in request.get("messages", [])) // 4
+                return {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                        "total_tokens": prompt_tokens + len(tokens)}
+
+            def _send_json(self, status, body, headers=None):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _stream(self, model, tokens, delay, usage=None):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for i, token in enumerate(tokens):
+                    event = {
+                        "id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": int(time.time()),
+                        "model": model,
+                        "choices": [{"index": 0, "delta": {"content": token},
+                                     "finish_reason": "stop" if i == len(tokens) - 1 else None}],
+                    }
+                    self._chunk(f"data: {json.dumps(event)}\n\n")
+                    time.sleep(delay)
+                if usage:
+                    # Sent last with no choices, as the OpenAI API does for stream_options.include_usage
+                    event = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": int(time.time()),
+                             "model": model, "choices": [], "usage": usage}
+                    self._chunk(f"data: {json.dumps(event)}\n\n")
+                self._chunk("data: [DONE]\n\n")
+                self.wfile.write(b"0\r\n\r\n")
+
+            def _chunk(self, text):
+                data = text.encode()
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+        return Handler
+
+@contextmanager
+def use_mock_provider(mock: MockLLMServer, provider: str = "openai"):
+    """
+    Points llm_engine at the mock server for the duration of the block, through the same settings a deployment
+    would use.
+    """
+    from config import settings
+
+    fields = ["llm_provider", f"{provider}_api_key", f"{provider}_base_url"]
+    saved = {field: getattr(settings, field) for field in fields}
+    settings.llm_provider = provider
+    setattr(settings, f"{provider}_api_key", "mock-key")
+    setattr(settings, f"{provider}_base_url", mock.base_url)
+    try:
+        yield
+    finally:
+        for field, value in saved.items():
+            setattr(settings, field, value)
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run a mock OpenAI-compatible chat completions server.")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--first-token-seconds", type=float, default=0.5)
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--prefill-tokens-per-second", type=float, default=0.0)
+    parser.add_argument("--server-error-rate", type=float, default=0.0)
+    parser.add_argument("--tail-rate", type=float, default=0.0)
+    parser.add_argument("--tail-seconds", type=float, default=0.0)
+    args = parser.parse_args()
+
+    with MockLLMServer(first_token_seconds=args.first_token_seconds, tokens_per_second=args.tokens_per_second,
+                       error_rate=args.error_rate, port=args.port,
+                       prefill_tokens_per_second=args.prefill_tokens_per_second,
+                       server_error_rate=args.server_error_rate, tail_rate=args.tail_rate,
+                       tail_seconds=args.tail_seconds) as mock:
+        print(f"Mock LLM server listening on {mock.base_url}")
+        threading.Event().wait()
@@ -0,0 +1,181 @@
+from dataclasses import dataclass
+from datetime import timedelta
+
+import duckdb
+import numpy as np
+import pandas as pd
+
+from config import settings
+from profiling import quote_identifier
+from sql_guard import QueryHandle, guarded, subquery
+
+NUMERIC_TYPES = {
+    "TINYINT", "SMALLINT", "INTEGER", "BIGINT", "HUGEINT", "UTINYINT", "USMALLINT", "UINTEGER", "UBIGINT",
+    "UHUGEINT", "FLOAT", "DOUBLE", "DECIMAL",
+}
+TEMPORAL_TYPES = {
+    "DATE", "TIMESTAMP", "TIMESTAMP WITH TIME ZONE", "TIMESTAMP_S", "TIMESTAMP_MS", "TIMESTAMP_NS",
+}
+# Calendar units for counting rows over time, finest first
+TIME_UNITS = [
+    ("second", timedelta(seconds=1)), ("minute", timedelta(minutes=1)), ("hour", timedelta(hours=1)),
+    ("day", timedelta(days=1)), ("week", timedelta(weeks=1)), ("month", timedelta(days=31)),
+    ("quarter", timedelta(days=92)), ("year", timedelta(days=366)),
+]
+
+@dataclass
+class ChartData:
+    kind: str             # "bar", "line" or "histogram"
+    data: pd.DataFrame    # Indexed by the x values, with the y values in one column
+    note: str = None      # How the result was reduced, for a caption
+
+# --- Downsampling ---
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets: indices of `threshold` points that keep the visual shape of the series, always
+    including the first and last point. x must be sorted.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    every = (n - 2) / (threshold - 2)
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0], indices[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = int(i * every) + 1, int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        # The point in this bucket forming the largest triangle with the last kept point and the next bucket's mean
+        avg_x, avg_y = x[end:next_end].mean(), y[end:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        indices[i + 1] = a
+    return indices
+
+# --- Chart Queries ---
+def _base_type(column_type: str) -> str:
+    return column_type.split("(")[0].upper()
+
+def _labelled(df: pd.DataFrame, x: str, y: str) -> pd.DataFrame:
+    return df[["x", "y"]].rename(columns={"y": y}).set_index("x").rename_axis(x)
+
+def _series(con, source: str, x_name: str, y_name: str, temporal: bool, max_points: int) -> ChartData:
+    """
+    Line chart of y over x. Past max_points rows, DuckDB keeps the first, last, lowest and highest point of each of
+    max_points equal-width x bins (M4), and LTTB picks max_points of those, so only about 4 * max_points rows
+    ever leave the database.
+    """
+    x, y = quote_identifier(x_name), quote_identifier(y_name)
+    position = f"epoch_ms(CAST({x} AS TIMESTAMP))" if temporal else f"CAST({x} AS DOUBLE)"
+    points = f"SELECT {x} AS x, CAST({y} AS DOUBLE) AS y, {position} AS pos FROM {source} " \
+             f"WHERE {x} IS NOT NULL AND {y} IS NOT NULL"
+    rows, low, high = con.execute(f"SELECT COUNT(*), MIN(pos), MAX(pos) FROM ({points})").fetchone()
+    if not rows:
+        return None
+    if rows <= max_points or low == high:
+        df = con.execute(f"SELECT x, y, pos FROM ({points}) ORDER BY pos LIMIT {max_points}").fetchdf()
+        note = None if rows <= max_points else f"First {max_points:,} of {rows:,} points"
+    else:
+        bins = con.execute(
+            f"SELECT arg_min(x, pos), arg_min(y, pos), MIN(pos), arg_max(x, pos), arg_max(y, pos), MAX(pos), "
+            f"arg_min(x, y), MIN(y), arg_min(pos, y), arg_max(x, y), MAX(y), arg_max(pos, y) "
+            f"FROM (SELECT *, LEAST(FLOOR((pos - ?) / (? - ?) * {max_points}), {max_points - 1}) AS bin "
+            f"FROM ({points})) GROUP BY bin",
+            [low, high, low],
+        ).fetchall()
+        candidates = {(row[i + 2], row[i + 1]): row[i] for row in bins for i in (0, 3, 6, 9)}
+        df = pd.DataFrame([(x_value, y_value, pos) for (pos, y_value), x_value in sorted(candidates.items())],
+                          columns=["x", "y", "pos"])
+        keep = lttb(df["pos"].to_numpy(dtype=float), df["y"].to_numpy(dtype=float), max_points)
+        df = df.iloc[keep]
+        note = f"{len(df):,} of {rows:,} points, downsampled in the database (M4 + LTTB)"
+    return ChartData("line", _labelled(df, x_name, y_name), note)
+
+def _histogram(con, source: str, name: str, bins: int) -> ChartData:
+    """
+    Row counts over `bins` equal-width bins of a numeric column, computed in the database.
+    """
+    column = quote_identifier(name)
+    rows = con.execute(
+        f"WITH v AS MATERIALIZED (SELECT CAST({column} AS DOUBLE) AS v FROM {source} WHERE {column} IS NOT NULL), "
+        f"b AS (SELECT MIN(v) AS low, MAX(v) AS high FROM v) "
+        f"SELECT COALESCE(LEAST(FLOOR((v - low) / NULLIF(high - low, 0) * {bins}), {bins - 1}), 0) AS bin, "
+        f"COUNT(*), ANY_VALUE(low), ANY_VALUE(high) FROM v, b GROUP BY bin ORDER BY bin"
+    ).fetchall()
+    if not rows:
+        return None
+    low, high = rows[0][2], rows[0][3]
+    width = (high - low) / bins
+    df = pd.DataFrame({"x": [low + int(row[0]) * width for row in rows], "y": [row[1] for row in rows]})
+    return ChartData("histogram", _labelled(df, name, "rows"), f"{bins} bins of {name}, each {width:.4g} wide")
+
+def _top_k(con, source: str, x_name: str, y_name: str, top_k: int) -> ChartData:
+    """
+    The top_k x values by the sum of y (or by row count without y), computed in the database.
+    """
+    x = quote_identifier(x_name)
+    value = f"SUM({quote_identifier(y_name)})" if y_name else "COUNT(*)"
+    df = con.execute(
+        f"SELECT CAST({x} AS VARCHAR) AS x, {value} AS y, COUNT(*) OVER () AS groups FROM {source} "
+        f"GROUP BY {x} ORDER BY y DESC NULLS LAST LIMIT {top_k}"
+    ).fetchdf()
+    if df.empty:
+        return None
+    groups = int(df["groups"].iloc[0])
+    note = f"Top {top_k} of {groups:,} {x_name} values" if groups > top_k else None
+    return ChartData("bar", _labelled(df, x_name, y_name or "rows"), note)
+
+def _time_buckets(con, source: str, x_name: str, max_points: int) -> ChartData:
+    """
+    Row counts per calendar bucket, with the finest unit that yields at most max_points buckets.
+    """
+    x = quote_identifier(x_name)
+    low, high = con.execute(f"SELECT MIN({x}), MAX({x}) FROM {source}").fetchone()
+    if low is None:
+        return None
+    span = pd.Timestamp(high) - pd.Timestamp(low)
+    unit = next((unit for unit, length in TIME_UNITS if span / length <= max_points), "year")
+    df = con.execute(
+        f"SELECT date_trunc('{unit}', {x}) AS x, COUNT(*) AS y FROM {source} WHERE {x} IS NOT NULL "
+        f"GROUP BY 1 ORDER BY 1"
+    ).fetchdf()
+    return ChartData("bar", _labelled(df, x_name, "rows"), f"Rows per {unit}")
+
+def chart_data(con: duckdb.DuckDBPyConnection, sql_query: str, handle: QueryHandle = None,
+               max_points: int = None, top_k: int = None, bins: int = None) -> ChartData:
+    """
+    Picks a chart for the query's result from its column types and computes its data in DuckDB, so a result of
+    millions of rows is reduced to at most a few thousand points before it reaches pandas:
+
+        date/time column with a number    line chart, downsampled past max_points
+        date/time column alone            rows per calendar bucket
+        text column (with a number)       top_k bars by the number's sum (or by row count)
+        two numbers                       line chart of the second over the first
+        one number                        histogram in `bins` equal-width bins
+
+    Returns None when nothing fits. Runs under the execution budget and can be stopped through `handle`.
+    """
+    max_points = max_points or settings.chart_max_points
+    top_k = top_k or settings.chart_top_k
+    bins = bins or settings.chart_bins
+    source = subquery(sql_query)
+
+    with guarded(con, handle):
+        columns = [(name, _base_type(column_type))
+                   for name, column_type, *_ in con.execute(f"DESCRIBE SELECT * FROM {source}").fetchall()]
+        temporal = [name for name, column_type in columns if column_type in TEMPORAL_TYPES]
+        numeric = [name for name, column_type in columns if column_type in NUMERIC_TYPES]
+        first = columns[0][0] if columns else None
+
+        if temporal:
+            values = [name for name in numeric if name != temporal[0]]
+            if values:
+                return _series(con, source, temporal[0], values[0], True, max_points)
+            return _time_buckets(con, source, temporal[0], max_points)
+        if first and first not in numeric:
+            return _top_k(con, source, first, numeric[0] if numeric else None, top_k)
+        if len(numeric) >= 2:
+            return _series(con, source, numeric[0], numeric[1], False, max_points)
+        if numeric:
+            return _histogram(con, source, numeric[0], bins)
+    return None
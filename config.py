@@ -0,0 +1,103 @@
+from pydantic import AliasChoices, Field
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+class Settings(BaseSettings):
+    """
+    Runtime settings, read from environment variables (prefixed with DATA_PIPELINE_) or a local .env file.
+    """
+    model_config = SettingsConfigDict(env_prefix="DATA_PIPELINE_", env_file=".env", extra="ignore")
+
+    app_name: str = "Consumer Data Pipeline"
+
+    # --- Dataset Store ---
+    cache_dir: str = ".pipeline_cache"
+    dataset_store_max_bytes: int = 20 * 1024**3   # Disk budget for persisted .duckdb files
+    dataset_store_max_open: int = 4               # Memory budget: datasets kept attached at once
+
+    # --- DuckDB Resources / Large-File Ingestion ---
+    duckdb_memory_limit: str | None = None        # e.g. "4GB"; DuckDB's default is 80% of RAM
+    duckdb_threads: int | None = None
+    duckdb_temp_directory: str | None = None      # Spill location; defaults to <cache_dir>/spill
+    csv_sample_size: int = 20480                  # Rows sniffed for CSV dialect and types (-1 reads the whole file)
+    large_file_threshold_bytes: int = 1024**3     # Sources above this load without preserving insertion order
+    server_data_dir: str | None = None            # Directory of server-side files that may be loaded by path
+    progress_interval_seconds: float = 0.25
+
+    # --- Type Normalization ---
+    normalize_types: bool = True                  # Convert numbers, dates and booleans loaded as text at ingestion
+    normalize_sample_rows: int = 10_000           # Rows sampled to detect them; every row is checked before converting
+
+    # --- LLM Provider ---
+    # Used when set; otherwise .streamlit/secrets.toml is read, as before
+    llm_provider: str | None = None               # "openai" or "groq"
+    openai_api_key: str | None = Field(None, validation_alias=AliasChoices("DATA_PIPELINE_OPENAI_API_KEY", "OPENAI_API_KEY"))
+    groq_api_key: str | None = Field(None, validation_alias=AliasChoices("DATA_PIPELINE_GROQ_API_KEY", "GROQ_API_KEY"))
+    openai_base_url: str | None = None
+    groq_base_url: str | None = None
+
+    # --- LLM Clients ---
+    llm_timeout_seconds: float = 60.0
+    llm_connect_timeout_seconds: float = 5.0
+    llm_max_connections: int = 32
+    llm_max_keepalive_connections: int = 16
+    llm_keepalive_expiry_seconds: float = 60.0
+
+    # --- Async / Batch Text-to-SQL ---
+    llm_batch_concurrency: int = 8
+    llm_max_attempts: int = 5
+    llm_backoff_base_seconds: float = 1.0
+    llm_backoff_max_seconds: float = 30.0
+
+    # --- LLM Routing ---
+    # Ordered "provider:model" routes, e.g. "groq:llama-3.3-70b-versatile,openai:gpt-4o"; unset uses llm_provider alone
+    llm_routes: str | None = None
+    llm_hedge_enabled: bool = True                # Send a backup on the next route when the first is slower than usual
+    llm_hedge_quantile: float = 0.95              # "Slower than usual": this latency quantile of the route
+    llm_hedge_default_seconds: float = 5.0        # Hedge delay until a route has enough latency samples
+    llm_hedge_min_seconds: float = 0.5
+    llm_breaker_failures: int = 5                 # Consecutive transient errors that open a route's circuit
+    llm_breaker_reset_seconds: float = 30.0       # How long an open circuit skips its route before a trial request
+    # Client-side budget per API key, kept below the provider's limits; None is unlimited
+    openai_requests_per_minute: int | None = None
+    openai_tokens_per_minute: int | None = None
+    groq_requests_per_minute: int | None = None
+    groq_tokens_per_minute: int | None = None
+
+    # --- LLM Response Cache ---
+    llm_cache_enabled: bool = True
+    llm_cache_ttl_seconds: int = 7 * 24 * 3600
+    llm_cache_max_bytes: int = 64 * 1024**2
+
+    # --- Query Results ---
+    result_page_size: int = 1000
+    result_max_bytes: int = 64 * 1024**2          # Memory cap for a single rendered page
+    result_batch_rows: int = 65536
+    export_ttl_seconds: int = 24 * 3600
+    result_cache_max_bytes: int = 2 * 1024**3
+
+    # --- Charts ---
+    chart_max_points: int = 2000                  # Points per line chart; larger results are downsampled in DuckDB
+    chart_top_k: int = 50                         # Bars per bar chart
+    chart_bins: int = 50                          # Histogram bins
+    chart_session_max_entries: int = 20           # Charts kept per session; the least recently shown go first
+
+    # --- Schema Pruning ---
+    schema_prune_min_columns: int = 100           # Narrower tables always get the full schema in the prompt
+    schema_prune_top_n: int = 40                  # Columns kept per question on wider tables
+
+    # --- SQL Execution Budget ---
+    sql_timeout_seconds: float = 60.0             # Wall-clock limit per query; 0 disables it
+    sql_max_rows: int = 10_000_000                # Row cap injected into full-result exports and profiled queries
+    sql_warn_estimated_rows: int = 100_000_000    # Pre-flight warns when the plan expects more intermediate rows
+    sql_reject_estimated_rows: int = 10_000_000_000  # ...and refuses to run the query above this
+
+    # --- Tracing / Metrics ---
+    metrics_log_path: str | None = None           # JSON-lines span log; defaults to <cache_dir>/metrics/spans.jsonl
+    metrics_log_max_bytes: int = 64 * 1024**2     # The span log is rotated once it would grow past this
+    metrics_log_backups: int = 2                  # Rotated span logs kept, as spans.jsonl.1, spans.jsonl.2, ...
+    metrics_prometheus_path: str | None = None    # Prometheus text file; defaults to <cache_dir>/metrics/metrics.prom
+    metrics_port: int | None = None               # Serve /metrics over HTTP on this port when set
+    metrics_host: str = "127.0.0.1"               # Interface /metrics listens on; "0.0.0.0" exposes it to the network
+    explain_analyze: bool = False                 # Profile every generated query with EXPLAIN ANALYZE
+
+settings = Settings()
@@ -0,0 +1,236 @@
+import hashlib
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable
+
+import duckdb
+
+from config import settings
+from result_cache import get_result_cache
+
+TABLE_NAME = "analysis_staging"
+
+# --- Dataset Identity ---
+def content_hash(data) -> str:
+    """
+    Returns a stable identifier for the content of an upload buffer (bytes, bytearray or memoryview).
+    """
+    return hashlib.blake2b(memoryview(data), digest_size=16).hexdigest()
+
+def file_fingerprint(path: str) -> str:
+    """
+    Returns an identifier for a local file from its resolved path, size and modification time.
+    Used for server-side files too large to hash on every load.
+    """
+    stat = os.stat(path)
+    key = f"{os.path.realpath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+    return hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+
+# --- DuckDB Configuration ---
+def duckdb_config() -> dict:
+    """
+    Resource limits applied to every dataset database. Anything past the memory limit spills to the temp directory,
+    so datasets larger than memory can be loaded and queried.
+    """
+    temp_directory = settings.duckdb_temp_directory or str(Path(settings.cache_dir) / "spill")
+    config = {"temp_directory": temp_directory}
+    if settings.duckdb_memory_limit:
+        config["memory_limit"] = settings.duckdb_memory_limit
+    if settings.duckdb_threads:
+        config["threads"] = settings.duckdb_threads
+    return config
+
+def _run_with_progress(con: duckdb.DuckDBPyConnection, build, on_progress: Callable[[float, float], None]):
+    """
+    Runs build(con) on a worker thread, calling on_progress(fraction, elapsed) from this thread while it runs.
+    fraction is None while DuckDB has no estimate yet.
+    """
+    con.execute("SET enable_progress_bar = true")
+    con.execute("SET enable_progress_bar_print = false")
+    errors = []
+
+    def run():
+        try:
+            build(con)
+        except Exception as e:
+            errors.append(e)
+
+    start = time.perf_counter()
+    worker = threading.Thread(target=run, daemon=True)
+    worker.start()
+    while worker.is_alive():
+        worker.join(settings.progress_interval_seconds)
+        percent = con.query_progress()
+        on_progress(percent / 100 if percent >= 0 else None, time.perf_counter() - start)
+    if errors:
+        raise errors[0]
+
+# --- Dataset Store ---
+class DatasetStore:
+    """
+    Keeps one on-disk DuckDB database per dataset, keyed by content hash.
+
+    Databases are reused across reruns and sessions. Open connections are held in an LRU of at most
+    `max_open` entries, and the files on disk are evicted least-recently-used first once they exceed
+    `max_bytes`. Datasets with cursors still in use are never evicted.
+    """
+
+    def __init__(self, root: str, max_bytes: int, max_open: int):
+        self.root = Path(root) / "datasets"
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_open = max(1, max_open)
+        self._lock = threading.RLock()
+        self._connections: OrderedDict[str, duckdb.DuckDBPyConnection] = OrderedDict()
+        # Cursors handed out per dataset; an entry goes away when its cursor is garbage collected
+        self._cursors: dict[str, weakref.WeakSet] = {}
+        self._load_locks: dict[str, threading.Lock] = {}
+
+    def path(self, dataset_id: str) -> Path:
+        return self.root / f"{dataset_id}.duckdb"
+
+    def exists(self, dataset_id: str) -> bool:
+        return self.path(dataset_id).exists()
+
+    def create(self, dataset_id: str, build: Callable[[duckdb.DuckDBPyConnection], None], on_progress=None) -> bool:
+        """
+        Creates a dataset database by calling build(con) on a fresh connection.
+        Returns False if the dataset was already stored. on_progress(fraction, elapsed) is called periodically
+        while the build runs.
+        """
+        with self._load_lock(dataset_id):
+            if self.exists(dataset_id):
+                self._touch(dataset_id)
+                return False
+
+            # Build under a temporary name so a failed or interrupted load never looks like a stored dataset
+            tmp_path = self.path(dataset_id).with_suffix(".duckdb.tmp")
+            tmp_path.unlink(missing_ok=True)
+            con = duckdb.connect(str(tmp_path), config=duckdb_config())
+            try:
+                if on_progress:
+                    _run_with_progress(con, build, on_progress)
+                else:
+                    build(con)
+            except Exception:
+                con.close()
+                tmp_path.unlink(missing_ok=True)
+                raise
+            con.close()
+            os.replace(tmp_path, self.path(dataset_id))
+            # Results cached for an earlier copy of this dataset must not outlive it
+            get_result_cache().invalidate(dataset_id)
+
+        self.evict(keep=dataset_id)
+        return True
+
+    def update(self, dataset_id: str, apply: Callable[[duckdb.DuckDBPyConnection], object]):
+        """
+        Changes a stored dataset in place by calling apply(con) in a single transaction, so a failed change leaves
+        the dataset as it was and readers never see it half done. Returns what apply returned.
+        Cached results are not invalidated here; the caller knows whether the change affects them.
+        """
+        with self._load_lock(dataset_id):
+            con = self.connect(dataset_id)
+            con.execute("BEGIN TRANSACTION")
+            try:
+                result = apply(con)
+            except BaseException:
+                con.execute("ROLLBACK")
+                raise
+            con.execute("COMMIT")
+        self.evict(keep=dataset_id)
+        return result
+
+    def connect(self, dataset_id: str) -> duckdb.DuckDBPyConnection:
+        """
+        Returns a cursor on the long-lived connection for a stored dataset.
+        Cursors are cheap and safe to use from the calling thread only.
+        """
+        with self._lock:
+            con = self._connections.get(dataset_id)
+            if con is None:
+                if not self.exists(dataset_id):
+                    raise KeyError(f"Dataset {dataset_id} is not in the store")
+                con = duckdb.connect(str(self.path(dataset_id)), config=duckdb_config())
+                self._connections[dataset_id] = con
+                while len(self._connections) > self.max_open:
+                    # Drop the reference rather than closing: cursors handed out to other sessions keep
+                    # the database alive until they are released
+                    self._connections.popitem(last=False)
+            self._connections.move_to_end(dataset_id)
+            self._touch(dataset_id)
+            cursor = con.cursor()
+            self._cursors.setdefault(dataset_id, weakref.WeakSet()).add(cursor)
+            return cursor
+
+    def in_use(self, dataset_id: str) -> bool:
+        """
+        Whether a cursor returned by connect() for the dataset is still referenced somewhere.
+        """
+        with self._lock:
+            return bool(self._cursors.get(dataset_id))
+
+    def drop(self, dataset_id: str) -> bool:
+        """
+        Removes a stored dataset. A dataset with cursors still in use is left in place and False is returned:
+        closing the connection or deleting the files under a running query would fail it.
+        """
+        with self._lock:
+            if self.in_use(dataset_id):
+                return False
+            # Drop the reference rather than closing, as the LRU does; nothing else holds the connection now
+            self._connections.pop(dataset_id, None)
+            self._cursors.pop(dataset_id, None)
+            self.path(dataset_id).unlink(missing_ok=True)
+            Path(f"{self.path(dataset_id)}.wal").unlink(missing_ok=True)
+        get_result_cache().invalidate(dataset_id)
+        return True
+
+    def evict(self, keep: str = None):
+        """
+        Removes least-recently-used datasets until the store fits in its disk budget. Datasets in use are skipped
+        and left for a later eviction.
+        """
+        with self._lock:
+            files = sorted(self.root.glob("*.duckdb"), key=lambda p: p.stat().st_mtime)
+            total = sum(p.stat().st_size for p in files)
+            for path in files:
+                if total <= self.max_bytes:
+                    break
+                if path.stem == keep:
+                    continue
+                size = path.stat().st_size
+                if self.drop(path.stem):
+                    total -= size
+
+    def _touch(self, dataset_id: str):
+        try:
+            os.utime(self.path(dataset_id))
+        except FileNotFoundError:
+            pass
+
+    def _load_lock(self, dataset_id: str) -> threading.Lock:
+        with self._lock:
+            return self._load_locks.setdefault(dataset_id, threading.Lock())
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_dataset_store() -> DatasetStore:
+    """
+    Returns the process-wide dataset store, shared by every Streamlit session.
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = DatasetStore(
+                settings.cache_dir,
+                max_bytes=settings.dataset_store_max_bytes,
+                max_open=settings.dataset_store_max_open,
+            )
+        return _store
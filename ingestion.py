@@ -0,0 +1,343 @@
+import os
+import tempfile
+import time
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+
+import duckdb
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from config import settings
+from dataset_store import TABLE_NAME, DatasetStore, content_hash, file_fingerprint
+from normalization import load_conversions, normalize_types
+from profiling import get_meta, quote_identifier, set_meta, update_profile
+from result_cache import get_result_cache
+
+DELTA_TABLE = "analysis_delta"
+APPENDS_META_KEY = "appends"
+
+UPLOAD_TYPES = ["csv", "tsv", "txt", "parquet", "pq", "json", "ndjson", "jsonl", "gz", "zst"]
+
+COMPRESSION_SUFFIXES = {".gz": "gzip", ".gzip": "gzip", ".zst": "zstd", ".zstd": "zstd"}
+FORMAT_SUFFIXES = {
+    ".parquet": "parquet", ".pq": "parquet",
+    ".json": "json", ".ndjson": "json", ".jsonl": "json",
+    ".csv": "csv", ".tsv": "csv", ".txt": "csv",
+}
+
+# --- Format Detection ---
+@dataclass(frozen=True)
+class SourceFormat:
+    kind: str                 # "csv", "json" or "parquet"
+    compression: str = None   # "gzip" or "zstd" for compressed text formats
+
+    @property
+    def suffix(self) -> str:
+        return f".{self.kind}" + {"gzip": ".gz", "zstd": ".zst", None: ""}[self.compression]
+
+def detect_format(name: str, head: bytes) -> SourceFormat:
+    """
+    Works out the format of a source from its first bytes, falling back to its file name.
+    Magic numbers win over extensions, so a mislabelled upload is still read correctly.
+    """
+    suffixes = [suffix.lower() for suffix in Path(name or "").suffixes]
+
+    compression = None
+    if head.startswith(b"\x1f\x8b"):
+        compression = "gzip"
+        # Peek at the decompressed start to tell compressed JSON from compressed CSV
+        try:
+            head = zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(head, 4096)
+        except zlib.error:
+            head = b""
+    elif head.startswith(b"\x28\xb5\x2f\xfd"):
+        compression = "zstd"
+        head = b""
+    elif suffixes and suffixes[-1] in COMPRESSION_SUFFIXES:
+        compression = COMPRESSION_SUFFIXES[suffixes[-1]]
+    if suffixes and suffixes[-1] in COMPRESSION_SUFFIXES:
+        suffixes = suffixes[:-1]
+
+    if head.startswith(b"PAR1"):
+        return SourceFormat("parquet")
+    if head.lstrip()[:1] in (b"{", b"["):
+        return SourceFormat("json", compression)
+    kind = FORMAT_SUFFIXES.get(suffixes[-1], "csv") if suffixes else "csv"
+    return SourceFormat(kind, compression)
+
+# --- Progress ---
+@dataclass
+class LoadProgress:
+    fraction: float = None     # 0-1, None until DuckDB has an estimate
+    bytes_read: int = None
+    rows_loaded: int = None    # Estimated from the average row size while loading, exact once done
+    elapsed: float = 0.0
+    done: bool = False
+
+def _bytes_per_row(head: bytes, fmt: SourceFormat) -> float:
+    """
+    Average row size of an uncompressed line-based source, from its first bytes.
+    """
+    if fmt.compression or fmt.kind == "parquet":
+        return None
+    lines = head.count(b"\n")
+    return len(head) / lines if lines else None
+
+def _reporter(on_progress, total_bytes: int, bytes_per_row: float):
+    def report(fraction, elapsed):
+        bytes_read = int(fraction * total_bytes) if fraction is not None else None
+        rows_loaded = int(bytes_read / bytes_per_row) if bytes_read is not None and bytes_per_row else None
+        on_progress(LoadProgress(fraction, bytes_read, rows_loaded, elapsed))
+    return report
+
+# --- Loading ---
+def _escape(path) -> str:
+    return str(path).replace("'", "''")
+
+def load_path(con: duckdb.DuckDBPyConnection, path: str, fmt: SourceFormat, table: str = TABLE_NAME,
+              keep_order: bool = False, text_columns: list[str] = None):
+    """
+    Creates the table from a file with DuckDB's native reader for the format.
+    Large files are loaded without preserving row order unless `keep_order` is set. CSV columns named in
+    `text_columns` are read as VARCHAR rather than sniffed, for columns that get their own conversion.
+    """
+    compression = f", compression = '{fmt.compression}'" if fmt.compression else ""
+    if fmt.kind == "parquet":
+        source = f"read_parquet('{_escape(path)}')"
+    elif fmt.kind == "json":
+        source = f"read_json_auto('{_escape(path)}', format = 'auto'{compression})"
+    else:
+        options = f"sample_size = {settings.csv_sample_size}{compression}"
+        source = f"read_csv_auto('{_escape(path)}', {options})"
+        if text_columns:
+            # The reader rejects types for columns the file lacks; those are reported later as a schema mismatch
+            names = {name for name, *_ in con.execute(f"DESCRIBE SELECT * FROM {source}").fetchall()}
+            types = ", ".join(f"'{_escape(name)}': 'VARCHAR'" for name in text_columns if name in names)
+            if types:
+                source = f"read_csv_auto('{_escape(path)}', {options}, types = {{{types}}})"
+
+    if keep_order or os.path.getsize(path) < settings.large_file_threshold_bytes:
+        con.execute(f"CREATE TABLE {table} AS SELECT * FROM {source}")
+        return
+    # Large-file mode: letting DuckDB reorder rows keeps the load streaming and within the memory limit. The
+    # setting is global to the database, so it is restored for the other sessions sharing it
+    preserve = con.execute("SELECT current_setting('preserve_insertion_order')").fetchone()[0]
+    con.execute("SET preserve_insertion_order = false")
+    try:
+        con.execute(f"CREATE TABLE {table} AS SELECT * FROM {source}")
+    finally:
+        con.execute(f"SET preserve_insertion_order = {str(preserve).lower()}")
+
+def load_buffer(con: duckdb.DuckDBPyConnection, data, fmt: SourceFormat, table: str = TABLE_NAME,
+                keep_order: bool = False, text_columns: list[str] = None):
+    """
+    Creates the table from an in-memory upload buffer.
+
+    Parquet is streamed to DuckDB as Arrow record batches straight from the buffer. Text formats go through a
+    private temporary file so DuckDB's parallel readers and decompression can be used; the file name is unique
+    per call, so concurrent uploads never collide.
+    """
+    if fmt.kind == "parquet":
+        parquet_file = pq.ParquetFile(pa.BufferReader(data))
+        batches = pa.RecordBatchReader.from_batches(
+            parquet_file.schema_arrow, parquet_file.iter_batches(batch_size=settings.result_batch_rows)
+        )
+        con.register("upload_batches", batches)
+        try:
+            con.execute(f"CREATE TABLE {table} AS SELECT * FROM upload_batches")
+        finally:
+            con.unregister("upload_batches")
+        return
+
+    ingest_dir = Path(settings.cache_dir) / "ingest"
+    ingest_dir.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=ingest_dir, suffix=fmt.suffix, delete=False) as f:
+        f.write(data)
+    try:
+        load_path(con, f.name, fmt, table, keep_order, text_columns)
+    finally:
+        os.unlink(f.name)
+
+# --- Ingestion Entry Points ---
+def _create(store: DatasetStore, dataset_id: str, load, fmt: SourceFormat, head: bytes, total_bytes: int,
+            on_progress) -> bool:
+    start = time.perf_counter()
+    report = _reporter(on_progress, total_bytes, _bytes_per_row(head, fmt)) if on_progress else None
+
+    def build(con):
+        load(con)
+        # Parquet and JSON carry their own types, but text columns holding numbers can come from any source
+        if settings.normalize_types:
+            normalize_types(con)
+
+    created = store.create(dataset_id, build, report)
+    if created and on_progress:
+        rows = store.connect(dataset_id).execute(f"SELECT COUNT(*) FROM {TABLE_NAME}").fetchone()[0]
+        on_progress(LoadProgress(1.0, total_bytes, rows, time.perf_counter() - start, done=True))
+    return created
+
+def ingest_buffer(store: DatasetStore, dataset_id: str, data, name: str, on_progress=None) -> bool:
+    """
+    Stores an uploaded buffer as a dataset. Returns False if it was already stored.
+    on_progress receives a LoadProgress periodically while loading and once when done.
+    """
+    head = bytes(memoryview(data)[:1024**2])
+    fmt = detect_format(name, head)
+    return _create(store, dataset_id, lambda con: load_buffer(con, data, fmt), fmt, head, memoryview(data).nbytes,
+                   on_progress)
+
+def ingest_path(store: DatasetStore, dataset_id: str, path: str, on_progress=None) -> bool:
+    """
+    Stores a local file as a dataset, read in place. Returns False if it was already stored.
+    on_progress receives a LoadProgress periodically while loading and once when done.
+    """
+    with open(path, "rb") as f:
+        head = f.read(1024**2)
+    fmt = detect_format(path, head)
+    return _create(store, dataset_id, lambda con: load_path(con, path, fmt), fmt, head, os.path.getsize(path),
+                   on_progress)
+
+# --- Incremental Append ---
+class SchemaMismatch(ValueError):
+    """
+    The appended file's columns do not fit the stored dataset.
+    """
+
+@dataclass
+class AppendResult:
+    inserted: int = 0       # Rows added: every row without keys, rows with new keys otherwise
+    updated: int = 0        # Rows that replaced stored rows with the same key
+    duplicates: int = 0     # Rows dropped because a later row in the file had the same key
+    skipped: bool = False   # The file had already been appended
+
+def _typed_delta(con: duckdb.DuckDBPyConnection, keys: list[str]) -> list[str]:
+    """
+    SQL expressions reading the delta table's columns as the stored table's types, in stored column order.
+    Text columns that were normalized at load time get the same conversion. Raises SchemaMismatch when a column
+    is missing or unknown, or when a value would not survive the conversion.
+    """
+    stored = con.execute(f"DESCRIBE {TABLE_NAME}").fetchall()
+    delta = {name: column_type for name, column_type, *_ in con.execute(f"DESCRIBE {DELTA_TABLE}").fetchall()}
+    stored_names = [name for name, *_ in stored]
+    missing = [name for name in stored_names if name not in delta]
+    unknown = [name for name in delta if name not in stored_names]
+    if missing or unknown:
+        raise SchemaMismatch(
+            "Columns differ from the stored dataset"
+            + (f"; missing: {', '.join(missing)}" if missing else "")
+            + (f"; not in the dataset: {', '.join(unknown)}" if unknown else "")
+        )
+    unknown_keys = [key for key in keys if key not in delta]
+    if unknown_keys:
+        raise SchemaMismatch(f"Key columns not in the dataset: {', '.join(unknown_keys)}")
+
+    conversions = {conversion.column: conversion for conversion in load_conversions(con)}
+    expressions, checks, checked = [], [], []
+    for name, column_type, *_ in stored:
+        col = quote_identifier(name)
+        conversion = conversions.get(name)
+        if delta[name] == column_type:
+            expressions.append(col)
+            continue
+        if conversion and delta[name] == "VARCHAR":
+            expressions.append(conversion.expression())
+            checks.append(conversion.failures())
+        else:
+            expressions.append(f"TRY_CAST({col} AS {column_type})")
+            checks.append(f"COUNT(*) FILTER (WHERE {col} IS NOT NULL AND TRY_CAST({col} AS {column_type}) IS NULL)")
+        checked.append((name, delta[name], column_type))
+    if checks:
+        failures = con.execute(f"SELECT {', '.join(checks)} FROM {DELTA_TABLE}").fetchone()
+        incompatible = [f"{name} ({source} to {target}: {failed:,} values)"
+                        for (name, source, target), failed in zip(checked, failures) if failed]
+        if incompatible:
+            raise SchemaMismatch(f"Values do not fit the stored column types: {', '.join(incompatible)}")
+    return [f"{expression} AS {quote_identifier(name)}" for expression, (name, *_) in zip(expressions, stored)]
+
+def merge_delta(con: duckdb.DuckDBPyConnection, keys: list[str] = None) -> AppendResult:
+    """
+    Merges the rows loaded into the delta table into the dataset and updates its stored profile.
+
+    Without keys every row is appended. With keys the file is an upsert: within the file the last row per key
+    wins, and it replaces every stored row with that key. Only the delta and the rows it replaces are scanned
+    for the profile; the delete is a join against the delta's keys.
+    """
+    keys = keys or []
+    select = _typed_delta(con, keys)
+    result = AppendResult()
+    delta_rows = con.execute(f"SELECT COUNT(*) FROM {DELTA_TABLE}").fetchone()[0]
+    key_columns = [quote_identifier(key) for key in keys]
+
+    if keys:
+        null_keys = con.execute(
+            f"SELECT COUNT(*) FROM (SELECT {', '.join(select)} FROM {DELTA_TABLE}) "
+            f"WHERE {' OR '.join(f'{key} IS NULL' for key in key_columns)}"
+        ).fetchone()[0]
+        if null_keys:
+            raise ValueError(f"{null_keys:,} rows have no value in the key column(s) {', '.join(keys)}")
+        # Last row per key wins, in file order
+        con.execute(
+            f"CREATE TABLE {DELTA_TABLE}_typed AS SELECT * EXCLUDE (_row) FROM ("
+            f"SELECT {', '.join(select)}, rowid AS _row FROM {DELTA_TABLE}) "
+            f"QUALIFY row_number() OVER (PARTITION BY {', '.join(key_columns)} ORDER BY _row DESC) = 1"
+        )
+        join = " AND ".join(f"stored.{key} = delta.{key}" for key in key_columns)
+        con.execute(
+            f"CREATE TABLE {DELTA_TABLE}_replaced AS SELECT stored.* FROM {TABLE_NAME} AS stored "
+            f"SEMI JOIN {DELTA_TABLE}_typed AS delta ON {join}"
+        )
+        result.updated = con.execute(
+            f"SELECT COUNT(*) FROM {DELTA_TABLE}_typed AS delta SEMI JOIN {TABLE_NAME} AS stored ON {join}"
+        ).fetchone()[0]
+        con.execute(f"DELETE FROM {TABLE_NAME} AS stored USING {DELTA_TABLE}_typed AS delta WHERE {join}")
+    else:
+        con.execute(f"CREATE TABLE {DELTA_TABLE}_typed AS SELECT {', '.join(select)} FROM {DELTA_TABLE}")
+
+    typed_rows = con.execute(f"SELECT COUNT(*) FROM {DELTA_TABLE}_typed").fetchone()[0]
+    result.duplicates = delta_rows - typed_rows
+    result.inserted = typed_rows - result.updated
+    con.execute(f"INSERT INTO {TABLE_NAME} SELECT * FROM {DELTA_TABLE}_typed")
+    update_profile(con, f"{DELTA_TABLE}_typed", f"{DELTA_TABLE}_replaced" if keys else None)
+    for table in (DELTA_TABLE, f"{DELTA_TABLE}_typed", f"{DELTA_TABLE}_replaced"):
+        con.execute(f"DROP TABLE IF EXISTS {table}")
+    return result
+
+def _append(store: DatasetStore, dataset_id: str, delta_id: str, load, keys: list[str]) -> AppendResult:
+    def apply(con):
+        appends = get_meta(con, APPENDS_META_KEY) or []
+        if any(entry["delta_id"] == delta_id for entry in appends):
+            return AppendResult(skipped=True)
+        # Normalized columns are read as text, as they were at load time: sniffed as numbers, a comma-decimal
+        # value such as 1.234 would arrive as 1.234 rather than 1234 and skip its conversion
+        load(con, [conversion.column for conversion in load_conversions(con)])
+        result = merge_delta(con, keys)
+        set_meta(con, APPENDS_META_KEY, appends + [{"delta_id": delta_id, "keys": keys or [], **result.__dict__}])
+        return result
+
+    result = store.update(dataset_id, apply)
+    # Only cached results depend on the rows; the column index, normalization and the samples in prompts (and so
+    # the LLM response cache) stay valid because the schema cannot change
+    if result.inserted or result.updated:
+        get_result_cache().invalidate(dataset_id)
+    return result
+
+def append_buffer(store: DatasetStore, dataset_id: str, data, name: str, keys: list[str] = None) -> AppendResult:
+    """
+    Appends an uploaded buffer to a stored dataset, or upserts it by `keys` (see merge_delta). The columns must
+    match the dataset's. A buffer that was already appended is skipped.
+    """
+    fmt = detect_format(name, bytes(memoryview(data)[:1024**2]))
+    return _append(store, dataset_id, content_hash(data),
+                   lambda con, text_columns: load_buffer(con, data, fmt, DELTA_TABLE, True, text_columns), keys)
+
+def append_path(store: DatasetStore, dataset_id: str, path: str, keys: list[str] = None) -> AppendResult:
+    """
+    Appends a local file to a stored dataset, or upserts it by `keys` (see merge_delta). The columns must match
+    the dataset's. A file that was already appended, unchanged, is skipped.
+    """
+    with open(path, "rb") as f:
+        fmt = detect_format(path, f.read(1024**2))
+    return _append(store, dataset_id, file_fingerprint(path),
+                   lambda con, text_columns: load_path(con, path, fmt, DELTA_TABLE, True, text_columns), keys)
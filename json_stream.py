@@ -0,0 +1,98 @@
+import json
+
+# --- Incremental JSON Parsing ---
+class JSONObjectStream:
+    """
+    Incrementally parses a JSON object as its text streams in.
+
+    Each top-level field is decoded and added to `fields` as soon as its value is complete, so a caller can act
+    on early fields while later ones are still being generated. Text before the opening brace or after the
+    closing one (e.g. markdown fences) is ignored; `object_text` holds the object itself once it has closed.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.fields = {}
+        self.object_text = None
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._object_start = None
+        self._expect = "key"
+        self._key = None
+        self._token_start = None
+
+    @property
+    def done(self) -> bool:
+        return self.object_text is not None
+
+    def feed(self, chunk: str) -> list[str]:
+        """
+        Adds a chunk of text and returns the names of the fields it completed, in order.
+        """
+        self.buffer += chunk
+        completed = []
+        buffer = self.buffer
+
+        for i in range(self._pos, len(buffer)):
+            if self.done:
+                break
+            c = buffer[i]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        if self._expect == "key":
+                            self._key = json.loads(buffer[self._token_start:i + 1])
+                            self._token_start = None
+                        else:
+                            self._finish(buffer[self._token_start:i + 1], completed)
+                continue
+
+            if self._depth == 0:
+                if c == "{":
+                    self._depth = 1
+                    self._object_start = i
+                continue
+
+            if c == '"':
+                self._in_string = True
+                if self._depth == 1:
+                    self._token_start = i
+            elif c in "{[":
+                if self._depth == 1:
+                    self._token_start = i
+                self._depth += 1
+            elif c in "}]":
+                self._depth -= 1
+                if self._depth == 1:
+                    self._finish(buffer[self._token_start:i + 1], completed)
+                elif self._depth == 0:
+                    if self._token_start is not None:
+                        self._finish(buffer[self._token_start:i], completed)
+                    self.object_text = buffer[self._object_start:i + 1]
+            elif self._depth == 1:
+                if c == ":":
+                    self._expect = "value"
+                elif c == ",":
+                    if self._token_start is not None:
+                        self._finish(buffer[self._token_start:i], completed)
+                    self._expect = "key"
+                elif not c.isspace() and self._token_start is None:
+                    # Start of a number, true, false or null
+                    self._token_start = i
+
+        self._pos = len(buffer)
+        return completed
+
+    def _finish(self, value_text: str, completed: list[str]):
+        self.fields[self._key] = json.loads(value_text)
+        completed.append(self._key)
+        self._token_start = None
+        self._expect = "key"
@@ -0,0 +1,102 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from config import settings
+
+# --- Response Cache ---
+class LLMCache:
+    """
+    Persistent cache of raw LLM completions, stored in a local SQLite file.
+
+    Entries expire after `ttl_seconds` and the least recently used ones are evicted once the stored
+    completions exceed `max_bytes`. Hit and miss counters are kept per process.
+    """
+
+    def __init__(self, path: str, ttl_seconds: int, max_bytes: int):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, content TEXT, size INTEGER, created REAL, accessed REAL)"
+            )
+
+    @staticmethod
+    def make_key(provider: str, model: str, system_prompt: str, user_prompt: str, response_model=None) -> str:
+        schema = response_model.model_json_schema() if response_model else None
+        payload = json.dumps([provider, model, system_prompt, user_prompt, schema], sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock, self._connect() as db:
+            row = db.execute("SELECT content, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                if row is not None:
+                    db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.misses += 1
+                return None
+            db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, content: str):
+        now = time.time()
+        with self._lock, self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, content, len(content.encode()), now, now),
+            )
+            db.execute("DELETE FROM responses WHERE ? - created > ?", (now, self.ttl_seconds))
+            total = db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total > self.max_bytes:
+                # Walk from least to most recently used, dropping entries until the budget is met
+                stale = []
+                for entry_key, size in db.execute("SELECT key, size FROM responses ORDER BY accessed"):
+                    if total <= self.max_bytes:
+                        break
+                    stale.append((entry_key,))
+                    total -= size
+                db.executemany("DELETE FROM responses WHERE key = ?", stale)
+
+    def clear(self):
+        with self._lock, self._connect() as db:
+            db.execute("DELETE FROM responses")
+        self.hits = 0
+        self.misses = 0
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_llm_cache() -> LLMCache:
+    """
+    Returns the process-wide LLM response cache.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = LLMCache(
+                Path(settings.cache_dir) / "llm_cache.sqlite",
+                ttl_seconds=settings.llm_cache_ttl_seconds,
+                max_bytes=settings.llm_cache_max_bytes,
+            )
+        return _cache
@@ -1,85 +1,361 @@
 
 import os
 import json
+import asyncio
+import threading
+import logging
+import weakref
+import httpx
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from streamlit.runtime.scriptrunner_utils.script_run_context import SCRIPT_RUN_CONTEXT_ATTR_NAME
 from pydantic import BaseModel, ValidationError
-from openai import OpenAI
-from groq import Groq
+from openai import OpenAI, AsyncOpenAI
+from groq import Groq, AsyncGroq
+
+from config import settings
+from llm_cache import LLMCache, get_llm_cache
+from llm_router import Attempt, Route, estimate_tokens, get_router, parse_routes
+from json_stream import JSONObjectStream
+from metrics import get_metrics, span
+
+MODELS = {
+    "openai": "gpt-4o",  # Or gpt-3.5-turbo
+    "groq": "llama-3.3-70b-versatile",
+}
+
+logger = logging.getLogger(__name__)
 
 # --- Configuration ---
-def get_llm_provider():
-    if "general" not in st.secrets or "llm_provider" not in st.secrets["general"]:
-        st.error("LLM provider not configured. Please check .streamlit/secrets.toml")
+# Settings from the environment or .env take precedence; Streamlit secrets are the fallback when running the app.
+def _in_streamlit() -> bool:
+    return get_script_run_ctx() is not None
+
+def _report_error(message: str, raw_response: str = None):
+    """
+    Shows an error on the page when running under Streamlit, and logs it otherwise.
+    """
+    if _in_streamlit():
+        st.error(message)
+        if raw_response is not None:
+            st.write("Raw response:", raw_response)
+    else:
+        logger.error(message if raw_response is None else f"{message}\nRaw response: {raw_response}")
+
+def _config_error(message: str):
+    if _in_streamlit():
+        st.error(message)
         st.stop()
-    return st.secrets["general"]["llm_provider"]
+    raise RuntimeError(message)
+
+def _secret(section: str, key: str):
+    try:
+        return st.secrets[section][key]
+    except (KeyError, FileNotFoundError):
+        return None
+
+def get_llm_provider():
+    provider = settings.llm_provider or _secret("general", "llm_provider")
+    if not provider:
+        _config_error("LLM provider not configured. Set DATA_PIPELINE_LLM_PROVIDER or check .streamlit/secrets.toml")
+    return provider
 
 def get_api_key(provider):
-    if provider not in st.secrets or "api_key" not in st.secrets[provider]:
-        st.error(f"API key for {provider} not configured. Please check .streamlit/secrets.toml")
-        st.stop()
-    return st.secrets[provider]["api_key"]
+    api_key = {"openai": settings.openai_api_key, "groq": settings.groq_api_key}.get(provider) or _secret(provider, "api_key")
+    if not api_key:
+        _config_error(f"API key for {provider} not configured. Set {provider.upper()}_API_KEY or check .streamlit/secrets.toml")
+    return api_key
+
+def get_base_url(provider):
+    """
+    Optional endpoint override, e.g. for an OpenAI-compatible gateway; None keeps the SDK default.
+    """
+    return {"openai": settings.openai_base_url, "groq": settings.groq_base_url}.get(provider)
+
+def get_routes() -> list[Route]:
+    """
+    The provider and model routes to try, in order: llm_routes when set, otherwise the configured provider with its
+    default model. The first route is the primary one, which also keys the response cache.
+    """
+    if settings.llm_routes:
+        routes = parse_routes(settings.llm_routes, MODELS)
+    else:
+        provider = get_llm_provider()
+        routes = [(provider, MODELS.get(provider))]
+    for provider, model in routes:
+        if provider not in MODELS or model is None:
+            _config_error(f"Unsupported LLM route: {provider}:{model}")
+    return [Route(provider, model, get_api_key(provider)) for provider, model in routes]
 
 # --- Client Initialization ---
-def get_client():
-    provider = get_llm_provider()
-    api_key = get_api_key(provider)
+# One client per (provider, api_key, base_url), shared by every session and thread so HTTP connections,
+# keep-alive and TLS sessions are pooled instead of rebuilt per question. Retries are left to the router, which
+# fails over to the next route instead of retrying a struggling one.
+_clients: dict[tuple[str, str, str], OpenAI | Groq] = {}
+_clients_lock = threading.Lock()
+
+# Async clients are bound to the event loop that created them, so they are pooled per loop.
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict]" = weakref.WeakKeyDictionary()
+
+def _http_options() -> dict:
+    return {
+        "limits": httpx.Limits(
+            max_connections=settings.llm_max_connections,
+            max_keepalive_connections=settings.llm_max_keepalive_connections,
+            keepalive_expiry=settings.llm_keepalive_expiry_seconds,
+        ),
+        "timeout": httpx.Timeout(settings.llm_timeout_seconds, connect=settings.llm_connect_timeout_seconds),
+    }
+
+def _http_client() -> httpx.Client:
+    return httpx.Client(**_http_options())
+
+def get_client(provider: str = None):
+    provider = provider or get_llm_provider()
+    key = (provider, get_api_key(provider), get_base_url(provider))
+    
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            options = {"api_key": key[1], "base_url": key[2], "http_client": _http_client(), "max_retries": 0}
+            if provider == "openai":
+                client = OpenAI(**options)
+            elif provider == "groq":
+                client = Groq(**options)
+            else:
+                raise ValueError(f"Unsupported provider: {provider}")
+            _clients[key] = client
+        return client
+
+def get_async_client(provider: str = None):
+    """
+    Returns the pooled async client for the provider on the running event loop.
+    """
+    provider = provider or get_llm_provider()
+    key = (provider, get_api_key(provider), get_base_url(provider))
+    loop = asyncio.get_running_loop()
     
+    with _clients_lock:
+        clients = _async_clients.setdefault(loop, {})
+        client = clients.get(key)
+        if client is None:
+            options = {"api_key": key[1], "base_url": key[2], "http_client": httpx.AsyncClient(**_http_options()), "max_retries": 0}
+            if provider == "openai":
+                client = AsyncOpenAI(**options)
+            elif provider == "groq":
+                client = AsyncGroq(**options)
+            else:
+                raise ValueError(f"Unsupported provider: {provider}")
+            clients[key] = client
+        return client
+
+async def close_async_clients():
+    """
+    Closes the async clients pooled on the running event loop.
+    """
+    with _clients_lock:
+        clients = _async_clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        await client.close()
+
+# --- Core LLM Function ---
+def _record_usage(provider: str, model: str, usage):
+    """
+    Records token usage from a completion's usage object (or the usage dict of a streamed chunk).
+    """
+    if usage is None:
+        return
+    if not isinstance(usage, dict):
+        usage = usage.model_dump()
+    get_metrics().record_tokens(provider, model, usage.get("prompt_tokens"), usage.get("completion_tokens"))
+
+def _complete(provider: str, model: str, messages: list[dict]) -> str:
+    """
+    Runs a single chat completion against the provider and returns the message content.
+    """
     if provider == "openai":
-        return OpenAI(api_key=api_key)
+        # OpenAI supports structured outputs natively with response_format
+        completion = get_client(provider).chat.completions.create(
+            model=model,
+            messages=messages,
+            response_format={"type": "json_object"}
+        )
+        _record_usage(provider, model, completion.usage)
+        return completion.choices[0].message.content
+        
     elif provider == "groq":
-        return Groq(api_key=api_key)
+        # Groq requires JSON mode enforcement via prompt + json_object type
+        completion = get_client(provider).chat.completions.create(
+            model=model,
+            messages=messages,
+            response_format={"type": "json_object"}
+        )
+        _record_usage(provider, model, completion.usage)
+        return completion.choices[0].message.content
+        
     else:
-        raise ValueError(f"Unsupported provider: {provider}")
+        raise ValueError("Provider not configured")
 
-# --- Core LLM Function ---
-def query_llm(system_prompt: str, user_prompt: str, response_model: type[BaseModel] = None):
+def _complete_stream(provider: str, model: str, messages: list[dict], parser: JSONObjectStream, on_field,
+                     attempt: Attempt = None) -> str:
+    """
+    Streams a chat completion, feeding the text to the parser and calling on_field(name, value) for each
+    top-level field as soon as it is complete. Returns the JSON object text.
+    When the stream is one of several hedged attempts, only the attempt that claims the race emits fields, and a
+    losing one stops reading.
+    """
+    if provider not in MODELS:
+        raise ValueError("Provider not configured")
+    
+    options = {}
+    if provider == "openai":
+        options["response_format"] = {"type": "json_object"}
+        # Ask for a final chunk with token usage; Groq reports it unprompted under x_groq
+        options["stream_options"] = {"include_usage": True}
+    # Groq rejects JSON mode on streamed requests; the prompt already asks for a JSON object and the parser
+    # skips anything around it
+    
+    # Read the raw event stream to the end: the SDK's own iterator stops at [DONE] and closes the response
+    # early, which discards the pooled connection after every streamed request
+    with get_client(provider).chat.completions.with_streaming_response.create(
+        model=model, messages=messages, stream=True, **options
+    ) as response:
+        for line in response.iter_lines():
+            if attempt is not None and attempt.cancelled:
+                break
+            if not line.startswith("data:") or line[5:].strip() == "[DONE]":
+                continue
+            event = json.loads(line[5:])
+            if event.get("error"):
+                raise RuntimeError(event["error"].get("message", "Error while streaming the completion"))
+            _record_usage(provider, model, event.get("usage") or (event.get("x_groq") or {}).get("usage"))
+            choices = event.get("choices")
+            delta = choices[0].get("delta", {}).get("content") if choices else None
+            if delta:
+                for name in parser.feed(delta):
+                    if attempt is None or attempt.claim():
+                        on_field(name, parser.fields[name])
+    return parser.object_text or parser.buffer
+
+def _parse(content: str, response_model: type[BaseModel] = None):
+    if response_model:
+        return response_model(**json.loads(content))
+    return content
+
+def query_llm(system_prompt: str, user_prompt: str, response_model: type[BaseModel] = None, use_cache: bool = True,
+              on_field=None):
     """
     Sends a query to the LLM and returns the response.
     If response_model is provided, it attempts to parse the output as JSON matching the model.
+    Completions are served from the local response cache unless use_cache is False.
+    If on_field is provided, the completion is streamed and on_field(name, value) is called for each top-level
+    JSON field as soon as it is complete, before the rest of the response has arrived.
+    Requests go through the router (see get_routes), which hedges, fails over and rate limits them.
     """
-    client = get_client()
-    provider = get_llm_provider()
+    routes = get_routes()
+    provider, model = routes[0].provider, routes[0].model
+    
+    cache = get_llm_cache() if use_cache and settings.llm_cache_enabled else None
+    cache_key = LLMCache.make_key(provider, model, system_prompt, user_prompt, response_model)
+    content = cache.get(cache_key) if cache else None
+    cached = content is not None
     
     messages = [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": user_prompt}
     ]
     
-    try:
-        if provider == "openai":
-            # OpenAI supports structured outputs natively with response_format
-            completion = client.chat.completions.create(
-                model="gpt-4o", # Or gpt-3.5-turbo
-                messages=messages,
-                response_format={"type": "json_object"}
-            )
-            content = completion.choices[0].message.content
-            
-        elif provider == "groq":
-            # Groq requires JSON mode enforcement via prompt + json_object type
-            completion = client.chat.completions.create(
-                model="llama-3.3-70b-versatile",
-                messages=messages,
-                response_format={"type": "json_object"}
-            )
-            content = completion.choices[0].message.content
-            
-        else:
-            raise ValueError("Provider not configured")
+    with span("llm.query", provider=provider, model=model, streamed=on_field is not None, cached=cached) as attributes:
+        winner = routes[0]
+        try:
+            if on_field and not cached:
+                script_context = get_script_run_ctx(suppress_warning=True)
+                
+                def stream(attempt: Attempt) -> str:
+                    # Attempts run on router threads; on_field may write to the page, so give them this session
+                    # for the attempt only
+                    if script_context is not None:
+                        add_script_run_ctx(threading.current_thread(), script_context)
+                    try:
+                        return _complete_stream(attempt.route.provider, attempt.route.model, messages,
+                                                JSONObjectStream(), on_field, attempt)
+                    finally:
+                        # add_script_run_ctx(thread, None) would re-attach the thread's own context; detach it
+                        if script_context is not None:
+                            delattr(threading.current_thread(), SCRIPT_RUN_CONTEXT_ATTR_NAME)
+                
+                with span("llm.request"):
+                    winner, content = get_router().complete(routes, estimate_tokens(messages), stream, streamed=True)
+            elif not cached:
+                with span("llm.request"):
+                    winner, content = get_router().complete(routes, estimate_tokens(messages), lambda attempt: _complete(
+                        attempt.route.provider, attempt.route.model, messages
+                    ))
+            elif on_field:
+                # Replay the cached completion through the same callback
+                parser = JSONObjectStream()
+                for name in parser.feed(content):
+                    on_field(name, parser.fields[name])
 
-        # Parse JSON
-        if response_model:
+            # Parse JSON
             try:
-                data = json.loads(content)
-                return response_model(**data)
+                with span("llm.parse"):
+                    result = _parse(content, response_model)
             except (json.JSONDecodeError, ValidationError) as e:
-                st.error(f"Failed to parse LLM response: {e}")
-                st.write("Raw response:", content)
+                attributes["error"] = f"parse: {e}"
+                _report_error(f"Failed to parse LLM response: {e}", content)
                 return None
-        else:
-            return content
+            
+            # Only completions that parsed cleanly are worth replaying, and the key names the primary route, so a
+            # backup route's answer is not cached under it
+            if cache and not cached and winner == routes[0]:
+                cache.put(cache_key, content)
+            return result
 
-    except Exception as e:
-        st.error(f"LLM API Error: {e}")
-        return None
+        except Exception as e:
+            attributes["error"] = str(e)
+            _report_error(f"LLM API Error: {e}")
+            return None
 
+# --- Async LLM Function ---
+async def _acomplete(provider: str, model: str, messages: list[dict]) -> str:
+    completion = await get_async_client(provider).chat.completions.create(
+        model=model,
+        messages=messages,
+        response_format={"type": "json_object"}
+    )
+    _record_usage(provider, model, completion.usage)
+    return completion.choices[0].message.content
+
+async def aquery_llm(system_prompt: str, user_prompt: str, response_model: type[BaseModel] = None, use_cache: bool = True):
+    """
+    Async counterpart of query_llm, sharing its response cache.
+    Errors are raised rather than reported through Streamlit, so batch callers can attach them to the question
+    that failed. Rate-limited and transient failures are retried with backoff or failed over to the next route,
+    and losing hedged attempts are cancelled.
+    """
+    routes = get_routes()
+    provider, model = routes[0].provider, routes[0].model
+    
+    cache = get_llm_cache() if use_cache and settings.llm_cache_enabled else None
+    cache_key = LLMCache.make_key(provider, model, system_prompt, user_prompt, response_model)
+    content = cache.get(cache_key) if cache else None
+    
+    with span("llm.query", provider=provider, model=model, streamed=False, cached=content is not None):
+        if content is not None:
+            with span("llm.parse"):
+                return _parse(content, response_model)
+        
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+        with span("llm.request"):
+            winner, content = await get_router().acomplete(routes, estimate_tokens(messages), lambda attempt: _acomplete(
+                attempt.route.provider, attempt.route.model, messages
+            ))
+        with span("llm.parse"):
+            result = _parse(content, response_model)
+        if cache and winner == routes[0]:
+            cache.put(cache_key, content)
+        return result
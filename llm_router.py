@@ -0,0 +1,549 @@
+import asyncio
+import contextvars
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from dataclasses import dataclass, field
+
+import groq
+import openai
+
+from config import settings
+from metrics import get_metrics, span
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError,
+    groq.RateLimitError, groq.APIConnectionError, groq.InternalServerError,
+)
+RATE_LIMIT_ERRORS = (openai.RateLimitError, groq.RateLimitError)
+
+# Tokens budgeted for a completion, on top of the prompt, when reserving against a tokens-per-minute limit
+COMPLETION_TOKEN_ESTIMATE = 256
+
+# Routes need this many latency samples before hedging on their own latency instead of llm_hedge_default_seconds
+MIN_LATENCY_SAMPLES = 20
+
+
+@dataclass(frozen=True)
+class Route:
+    provider: str
+    model: str
+    api_key: str = field(default=None, repr=False)
+
+    def __str__(self) -> str:
+        return f"{self.provider}:{self.model}"
+
+class NoRouteAvailable(RuntimeError):
+    """
+    Every route's circuit is open.
+    """
+
+def parse_routes(value: str, default_models: dict[str, str]) -> list[tuple[str, str]]:
+    """
+    Parses "groq:llama-3.3-70b-versatile,openai" into (provider, model) pairs; a provider without a model gets
+    its default one.
+    """
+    routes = []
+    for entry in value.split(","):
+        provider, _, model = entry.strip().partition(":")
+        if provider:
+            routes.append((provider, model or default_models.get(provider)))
+    return routes
+
+def estimate_tokens(messages: list[dict]) -> int:
+    """
+    Rough token count of a request (about four characters per token), for rate limiting before it is sent.
+    """
+    return sum(len(message["content"]) for message in messages) // 4 + COMPLETION_TOKEN_ESTIMATE
+
+def backoff_delay(error: Exception, attempt: int) -> float:
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    try:
+        return min(float(retry_after), settings.llm_backoff_max_seconds)
+    except (TypeError, ValueError):
+        delay = min(settings.llm_backoff_base_seconds * 2 ** attempt, settings.llm_backoff_max_seconds)
+        return delay * random.uniform(0.5, 1.0)
+
+# --- Rate Limiting ---
+class TokenBucket:
+    """
+    Refills at `per_minute` units a minute, holding at most a minute's worth. Reservations may overdraw it; the
+    overdraft is how long the reserving request has to wait.
+    """
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60
+        self.capacity = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def delay(self, amount: float) -> float:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        return max(0.0, (amount - self.level) / self.rate)
+
+    def reserve(self, amount: float) -> float:
+        delay = self.delay(amount)
+        self.level -= amount
+        return delay
+
+class RateLimiter:
+    """
+    Client-side budget for one API key: a requests-per-minute and a tokens-per-minute bucket, either optional,
+    plus a pause set when the provider answers 429. Requests queue locally instead of being rejected upstream.
+    """
+
+    def __init__(self, requests_per_minute: int = None, tokens_per_minute: int = None):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _buckets(self, tokens: int):
+        return [(bucket, amount) for bucket, amount in ((self.requests, 1), (self.tokens, tokens)) if bucket]
+
+    def delay(self, tokens: int) -> float:
+        """
+        Seconds a request of `tokens` would wait if sent now, without reserving anything.
+        """
+        with self._lock:
+            waits = [bucket.delay(amount) for bucket, amount in self._buckets(tokens)]
+            return max(waits + [self.paused_until - time.monotonic(), 0.0])
+
+    def reserve(self, tokens: int) -> float:
+        """
+        Reserves budget for a request and returns how long to wait before sending it.
+        """
+        with self._lock:
+            waits = [bucket.reserve(amount) for bucket, amount in self._buckets(tokens)]
+            return max(waits + [self.paused_until - time.monotonic(), 0.0])
+
+    def pause(self, seconds: float):
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+# --- Circuit Breaking ---
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failures and rejects requests for `reset_seconds`. Then one trial request
+    is let through (half-open): its success closes the circuit, its failure opens it again.
+    """
+
+    def __init__(self, threshold: int, reset_seconds: float):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "open" if time.monotonic() - self.opened_at < self.reset_seconds else "half-open"
+
+    def available(self) -> bool:
+        with self._lock:
+            return self.state == "closed" or (self.state == "half-open" and not self.trial)
+
+    def allow(self) -> str | None:
+        """
+        Like available(), but takes the half-open circuit's single trial. Returns "closed" or "trial" when the
+        request may go, None when it may not.
+        """
+        with self._lock:
+            if self.state == "closed":
+                return "closed"
+            if self.state == "half-open" and not self.trial:
+                self.trial = True
+                return "trial"
+            return None
+
+    def release(self):
+        """
+        Gives back a trial that ended without telling whether the route recovered, so the next request takes it.
+        """
+        with self._lock:
+            self.trial = False
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def failure(self) -> bool:
+        """
+        Records a failure; returns True if it opened the circuit.
+        """
+        with self._lock:
+            self.failures += 1
+            if self.trial or (self.opened_at is None and self.failures >= self.threshold):
+                self.opened_at = time.monotonic()
+                self.trial = False
+                return True
+            return False
+
+class LatencyTracker:
+    """
+    Latencies of a route's most recent successful requests.
+    """
+
+    def __init__(self, window: int = 200):
+        self.samples = deque(maxlen=window)
+
+    def add(self, seconds: float):
+        self.samples.append(seconds)
+
+    def quantile(self, q: float) -> float:
+        if len(self.samples) < MIN_LATENCY_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+# --- Hedged Requests ---
+class Attempt:
+    """
+    One request on one route. Streaming senders call claim() before emitting output; only the first attempt to
+    claim may emit, and the others see `cancelled` and stop reading.
+    """
+
+    def __init__(self, race: "_Race", route: Route, streamed: bool, backup: bool, trial: bool = False):
+        self.race = race
+        self.route = route
+        self.streamed = streamed
+        self.backup = backup
+        self.trial = trial          # Holds its route's half-open trial until success() or failure() settles it
+        self.first_output = None
+
+    def claim(self) -> bool:
+        won = self.race.claim(self)
+        if won and self.first_output is None:
+            self.first_output = time.monotonic()
+        return won
+
+    @property
+    def cancelled(self) -> bool:
+        return self.race.winner not in (None, self)
+
+class _Race:
+    def __init__(self):
+        self.winner = None
+        self._lock = threading.Lock()
+
+    def claim(self, attempt: Attempt) -> bool:
+        with self._lock:
+            if self.winner is None:
+                self.winner = attempt
+            return self.winner is attempt
+
+class _Plan:
+    """
+    Bookkeeping for one routed request: which routes may still be tried and what each try should wait first.
+    """
+
+    def __init__(self, router: "Router", routes: list[Route], tokens: int, streamed: bool):
+        self.router = router
+        self.routes = routes
+        self.tokens = tokens
+        self.streamed = streamed
+        self.race = _Race()
+        self.started = 0
+        self.hedged = False
+        self.failures: dict[Route, list[Exception]] = {}   # Transient errors per route, for backoff before a retry
+        self.excluded: set[Route] = set()                  # Routes that failed with an error retrying will not fix
+        self.errors: list[Exception] = []
+
+    def next_attempt(self, in_flight: list[Attempt]) -> tuple[Attempt, float]:
+        """
+        The next attempt to send and the seconds to wait before sending it, or (None, 0) when no route is left.
+        """
+        if self.started >= settings.llm_max_attempts:
+            return None, 0.0
+        busy = {attempt.route for attempt in in_flight} | self.excluded
+        # Fail over before retrying: routes that already failed this request go last
+        candidates = sorted(self.router.candidates(self.routes, self.tokens), key=lambda route: route in self.failures)
+        for route in candidates:
+            admission = None if route in busy else self.router.breaker(route).allow()
+            if admission:
+                delay = self.router.limiter(route).reserve(self.tokens)
+                if route in self.failures:
+                    errors = self.failures[route]
+                    delay = max(delay, backoff_delay(errors[-1], len(errors) - 1))
+                self.started += 1
+                return Attempt(self.race, route, self.streamed, bool(in_flight), admission == "trial"), delay
+        return None, 0.0
+
+    def failed(self, attempt: Attempt, error: Exception):
+        self.errors.append(error)
+        if isinstance(error, RETRYABLE_ERRORS):
+            self.failures.setdefault(attempt.route, []).append(error)
+        else:
+            self.excluded.add(attempt.route)
+
+    def hedge_timeout(self, in_flight: list[Attempt], sent_at: float) -> float:
+        """
+        Seconds until a backup should be sent for the attempt in flight, or None when no hedge is due. A request
+        is hedged at most once, and never once a stream has started emitting.
+        """
+        if not settings.llm_hedge_enabled or self.hedged or len(self.routes) < 2:
+            return None
+        if len(in_flight) != 1 or self.race.winner is not None:
+            return None
+        return max(0.0, sent_at + self.router.hedge_delay(in_flight[0].route, self.streamed) - time.monotonic())
+
+    def hedge(self, launch) -> bool:
+        self.hedged = True
+        if launch():
+            get_metrics().annotate(hedged=True)
+            return True
+        return False
+
+    def give_up(self) -> Exception:
+        if self.errors:
+            return self.errors[-1]
+        return NoRouteAvailable(f"No LLM route available; circuits open for {', '.join(map(str, self.routes))}")
+
+class Router:
+    """
+    Sends LLM requests along an ordered list of routes (provider and model).
+
+    Each attempt first waits for its API key's client-side rate limit. An attempt that has not answered within
+    its route's p95 latency (llm_hedge_quantile) gets a hedge: a backup on the next route, and whichever answers
+    first wins.
+    Failed attempts fail over to the next route at once, or retry the same route with backoff when it is the
+    only one left. Routes that keep failing are skipped by their circuit breaker until they recover.
+    """
+
+    def __init__(self):
+        self.breakers: dict[Route, CircuitBreaker] = {}
+        self.latencies: dict[tuple[Route, bool], LatencyTracker] = {}
+        self.limiters: dict[tuple[str, str], RateLimiter] = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, route: Route) -> CircuitBreaker:
+        with self._lock:
+            return self.breakers.setdefault(
+                route, CircuitBreaker(settings.llm_breaker_failures, settings.llm_breaker_reset_seconds)
+            )
+
+    def limiter(self, route: Route) -> RateLimiter:
+        with self._lock:
+            key = (route.provider, route.api_key)
+            if key not in self.limiters:
+                self.limiters[key] = RateLimiter(
+                    getattr(settings, f"{route.provider}_requests_per_minute", None),
+                    getattr(settings, f"{route.provider}_tokens_per_minute", None),
+                )
+            return self.limiters[key]
+
+    def latency(self, route: Route, streamed: bool) -> LatencyTracker:
+        with self._lock:
+            return self.latencies.setdefault((route, streamed), LatencyTracker())
+
+    def hedge_delay(self, route: Route, streamed: bool) -> float:
+        quantile = self.latency(route, streamed).quantile(settings.llm_hedge_quantile)
+        delay = settings.llm_hedge_default_seconds if quantile is None else quantile
+        return max(delay, settings.llm_hedge_min_seconds)
+
+    def candidates(self, routes: list[Route], tokens: int) -> list[Route]:
+        """
+        Routes whose circuit is not open: those that can send right away in their configured order, then the
+        rest by how long their rate limit makes them wait.
+        """
+        available = [route for route in routes if self.breaker(route).available()]
+        delays = {route: self.limiter(route).delay(tokens) for route in available}
+        return sorted(available, key=lambda route: (delays[route] > 0, delays[route]))
+
+    def status(self) -> list[dict]:
+        with self._lock:
+            breakers = list(self.breakers.items())
+        return [{"route": str(route), "circuit": breaker.state, "p95_s": self.latency(route, False).quantile(0.95)}
+                for route, breaker in breakers]
+
+    def _succeeded(self, attempt: Attempt, sent_at: float):
+        self.breaker(attempt.route).success()
+        attempt.trial = False
+        # Streams are timed to their first field; a losing stream stops early, so it has no time to record
+        if not attempt.streamed:
+            self.latency(attempt.route, False).add(time.monotonic() - sent_at)
+        elif attempt.first_output is not None:
+            self.latency(attempt.route, True).add(attempt.first_output - sent_at)
+
+    def _failed(self, attempt: Attempt, error: Exception):
+        if isinstance(error, RATE_LIMIT_ERRORS):
+            # A 429 applies to the whole key, so hold back every request on it, not just this one
+            self.limiter(attempt.route).pause(backoff_delay(error, 0))
+        elif isinstance(error, RETRYABLE_ERRORS):
+            attempt.trial = False
+            if self.breaker(attempt.route).failure():
+                logger.warning("Circuit opened for %s after repeated errors: %s", attempt.route, error)
+
+    def _release(self, attempt: Attempt):
+        """
+        Called whenever an attempt ends. A trial that got no verdict (a 429, an error specific to the request, or a
+        losing hedge) is given back; otherwise the circuit would stay half-open with its trial taken for good.
+        """
+        if attempt.trial:
+            attempt.trial = False
+            self.breaker(attempt.route).release()
+
+    # --- Synchronous ---
+    def _start(self, attempt: Attempt, send, delay: float) -> Future:
+        """
+        Runs the attempt on a thread of its own. A losing attempt that was not streamed cannot be stopped and
+        finishes in the background; with a shared worker pool such losers would hold the workers that later
+        backups need, so attempts never wait for a worker.
+        """
+        future = Future()
+        context = contextvars.copy_context()
+
+        def run():
+            try:
+                future.set_result(context.run(self._run, attempt, send, delay))
+            except BaseException as e:
+                future.set_exception(e)
+
+        threading.Thread(target=run, name=f"llm-route-{attempt.route.provider}", daemon=True).start()
+        return future
+
+    def _run(self, attempt: Attempt, send, delay: float):
+        try:
+            time.sleep(delay)
+            if attempt.cancelled:
+                return None
+            sent_at = time.monotonic()
+            with span("llm.attempt", route=str(attempt.route), backup=attempt.backup):
+                try:
+                    content = send(attempt)
+                except Exception as e:
+                    self._failed(attempt, e)
+                    raise
+            self._succeeded(attempt, sent_at)
+            return content
+        finally:
+            self._release(attempt)
+
+    def complete(self, routes: list[Route], tokens: int, send, streamed: bool = False) -> tuple[Route, str]:
+        """
+        Runs send(attempt), one thread per attempt, until one attempt succeeds, hedging and failing over as described
+        above. Returns the winning route and what send returned. Streaming senders pass streamed=True and claim
+        the attempt before emitting anything.
+        """
+        plan = _Plan(self, routes, tokens, streamed)
+        pending: dict = {}
+        sent_at = {}
+
+        def launch() -> bool:
+            attempt, delay = plan.next_attempt(list(pending.values()))
+            if attempt is None:
+                return False
+            future = self._start(attempt, send, delay)
+            pending[future], sent_at[attempt] = attempt, time.monotonic() + delay
+            return True
+
+        launch()
+        while pending:
+            primary = next(iter(pending.values()))
+            done, _ = wait(pending, timeout=plan.hedge_timeout(list(pending.values()), sent_at[primary]),
+                           return_when=FIRST_COMPLETED)
+            if not done:
+                # No answer within the route's usual latency: send a backup on the next route
+                plan.hedge(launch)
+                continue
+            for future in done:
+                attempt = pending.pop(future)
+                try:
+                    content = future.result()
+                except Exception as e:
+                    # A stream that already emitted fields cannot be replaced by another route's answer
+                    if plan.race.winner is attempt:
+                        raise
+                    plan.failed(attempt, e)
+                    continue
+                if plan.race.claim(attempt):
+                    get_metrics().annotate(route=str(attempt.route), attempts=plan.started)
+                    return attempt.route, content
+            if not pending:
+                launch()
+        raise plan.give_up()
+
+    # --- Asynchronous ---
+    async def _arun(self, attempt: Attempt, send, delay: float):
+        await asyncio.sleep(delay)
+        sent_at = time.monotonic()
+        with span("llm.attempt", route=str(attempt.route), backup=attempt.backup):
+            try:
+                content = await send(attempt)
+            except Exception as e:
+                self._failed(attempt, e)
+                raise
+        self._succeeded(attempt, sent_at)
+        return content
+
+    async def acomplete(self, routes: list[Route], tokens: int, send) -> tuple[Route, str]:
+        """
+        Async counterpart of complete(): send(attempt) is a coroutine function, and losing attempts are cancelled.
+        """
+        plan = _Plan(self, routes, tokens, False)
+        pending: dict = {}
+        sent_at = {}
+
+        def launch() -> bool:
+            attempt, delay = plan.next_attempt(list(pending.values()))
+            if attempt is None:
+                return False
+            task = asyncio.ensure_future(self._arun(attempt, send, delay))
+            # A done callback rather than a finally in _arun: a task cancelled before it starts never runs its body
+            task.add_done_callback(lambda _, attempt=attempt: self._release(attempt))
+            pending[task] = attempt
+            sent_at[attempt] = time.monotonic() + delay
+            return True
+
+        launch()
+        try:
+            while pending:
+                primary = next(iter(pending.values()))
+                done, _ = await asyncio.wait(pending, timeout=plan.hedge_timeout(list(pending.values()), sent_at[primary]),
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    plan.hedge(launch)
+                    continue
+                for task in done:
+                    attempt = pending.pop(task)
+                    try:
+                        content = task.result()
+                    except Exception as e:
+                        plan.failed(attempt, e)
+                        continue
+                    if plan.race.claim(attempt):
+                        get_metrics().annotate(route=str(attempt.route), attempts=plan.started)
+                        return attempt.route, content
+                if not pending:
+                    launch()
+            raise plan.give_up()
+        finally:
+            for task in pending:
+                task.cancel()
+
+_router = None
+_router_lock = threading.Lock()
+
+def get_router() -> Router:
+    """
+    Returns the process-wide router, whose circuit breakers, latency history and rate limits are shared by every
+    session.
+    """
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = Router()
+        return _router
@@ -0,0 +1,259 @@
+import bisect
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from config import settings
+
+# Upper bounds of the stage duration histogram, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+# --- Metrics ---
+class Metrics:
+    """
+    Collects timing spans and token usage for the pipeline stages.
+
+    Every finished span is appended to a JSON-lines log, rotated at `log_max_bytes`, and folded into per-stage
+    duration histograms. The aggregates are rendered in the Prometheus text format, rewritten to `prometheus_path` whenever a top-level
+    span ends, so a node_exporter textfile collector or the optional HTTP endpoint can scrape them.
+    """
+
+    def __init__(self, log_path: str, prometheus_path: str, recent: int = 200, log_max_bytes: int = None,
+                 log_backups: int = 2):
+        self.log_path = Path(log_path)
+        self.prometheus_path = Path(prometheus_path)
+        self.log_path.parent.mkdir(parents=True, exist_ok=True)
+        self.prometheus_path.parent.mkdir(parents=True, exist_ok=True)
+        self.log_max_bytes = log_max_bytes
+        self.log_backups = log_backups
+        self.recent = deque(maxlen=recent)
+        self.stages: dict[str, dict] = {}
+        self.tokens: dict[tuple[str, str, str], int] = {}
+        self._lock = threading.Lock()
+        # Serializes log writes only, so file I/O never blocks readers of the aggregates
+        self._log_lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """
+        Times the block as a named stage. Yields the span's attribute dict, which the block may add to; setting
+        "error" in it marks the span failed without raising.
+        Spans opened inside the block, including in threads started with a copied context, become its children.
+        """
+        parent = _current_span.get()
+        record = {
+            "trace_id": parent["trace_id"] if parent else uuid.uuid4().hex[:16],
+            "span_id": uuid.uuid4().hex[:16],
+            "parent_id": parent["span_id"] if parent else None,
+            "name": name,
+            "start": time.time(),
+            "attributes": attributes,
+        }
+        token = _current_span.set(record)
+        start = time.perf_counter()
+        try:
+            yield attributes
+        except BaseException as e:
+            record["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            record["duration"] = time.perf_counter() - start
+            # Failures handled inside the block are reported by setting an "error" attribute
+            if "error" in attributes:
+                record.setdefault("error", attributes.pop("error"))
+            _current_span.reset(token)
+            self._finish(record)
+
+    def annotate(self, **attributes):
+        """
+        Adds attributes to the innermost open span, if any.
+        """
+        record = _current_span.get()
+        if record is not None:
+            record["attributes"].update(attributes)
+
+    def record_tokens(self, provider: str, model: str, prompt_tokens: int, completion_tokens: int):
+        with self._lock:
+            for kind, count in (("prompt", prompt_tokens), ("completion", completion_tokens)):
+                key = (provider, model, kind)
+                self.tokens[key] = self.tokens.get(key, 0) + (count or 0)
+        self.annotate(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+    def _finish(self, record: dict):
+        with self._lock:
+            stage = self.stages.setdefault(record["name"], {
+                "count": 0, "errors": 0, "sum": 0.0, "max": 0.0, "last": 0.0, "buckets": [0] * len(BUCKETS),
+            })
+            stage["count"] += 1
+            stage["errors"] += "error" in record
+            stage["sum"] += record["duration"]
+            stage["max"] = max(stage["max"], record["duration"])
+            stage["last"] = record["duration"]
+            index = bisect.bisect_left(BUCKETS, record["duration"])
+            if index < len(BUCKETS):
+                stage["buckets"][index] += 1
+            self.recent.append(record)
+        self._write_log(json.dumps(record, default=str) + "\n")
+        if record["parent_id"] is None:
+            self.write_prometheus()
+
+    def _write_log(self, line: str):
+        data = line.encode()
+        with self._log_lock:
+            try:
+                size = self.log_path.stat().st_size
+            except FileNotFoundError:
+                size = 0
+            if self.log_max_bytes and size and size + len(data) > self.log_max_bytes:
+                self._rotate_log()
+            with open(self.log_path, "ab") as f:
+                f.write(data)
+
+    def _rotate_log(self):
+        """
+        Shifts spans.jsonl to spans.jsonl.1, spans.jsonl.1 to spans.jsonl.2 and so on, dropping the oldest.
+        """
+        if self.log_backups < 1:
+            self.log_path.unlink(missing_ok=True)
+            return
+        for index in range(self.log_backups - 1, 0, -1):
+            older = self.log_path.with_name(f"{self.log_path.name}.{index}")
+            if older.exists():
+                os.replace(older, self.log_path.with_name(f"{self.log_path.name}.{index + 1}"))
+        os.replace(self.log_path, self.log_path.with_name(f"{self.log_path.name}.1"))
+
+    def summary(self) -> list[dict]:
+        """
+        Per-stage totals, for display.
+        """
+        with self._lock:
+            return [
+                {"stage": name, "count": s["count"], "errors": s["errors"], "avg_s": s["sum"] / s["count"],
+                 "max_s": s["max"], "last_s": s["last"]}
+                for name, s in sorted(self.stages.items())
+            ]
+
+    def last_trace(self) -> list[dict]:
+        """
+        Spans of the most recently finished top-level span, root first, children in start order.
+        """
+        with self._lock:
+            roots = [record for record in self.recent if record["parent_id"] is None]
+            if not roots:
+                return []
+            root = roots[-1]
+            children = [r for r in self.recent if r["trace_id"] == root["trace_id"] and r is not root]
+        return [root] + sorted(children, key=lambda r: r["start"])
+
+    def token_totals(self) -> dict[str, int]:
+        with self._lock:
+            totals = {}
+            for (_, _, kind), count in self.tokens.items():
+                totals[kind] = totals.get(kind, 0) + count
+            return totals
+
+    def prometheus_text(self) -> str:
+        lines = [
+            "# HELP pipeline_stage_seconds Duration of pipeline stages.",
+            "# TYPE pipeline_stage_seconds histogram",
+        ]
+        with self._lock:
+            for name, s in sorted(self.stages.items()):
+                cumulative = 0
+                for bound, count in zip(BUCKETS, s["buckets"]):
+                    cumulative += count
+                    lines.append(f'pipeline_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+                lines.append(f'pipeline_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {s["count"]}')
+                lines.append(f'pipeline_stage_seconds_sum{{stage="{name}"}} {s["sum"]}')
+                lines.append(f'pipeline_stage_seconds_count{{stage="{name}"}} {s["count"]}')
+            lines += [
+                "# HELP pipeline_stage_errors_total Pipeline stages that raised.",
+                "# TYPE pipeline_stage_errors_total counter",
+            ]
+            lines += [f'pipeline_stage_errors_total{{stage="{name}"}} {s["errors"]}'
+                      for name, s in sorted(self.stages.items())]
+            lines += [
+                "# HELP pipeline_llm_tokens_total Tokens reported by the LLM provider.",
+                "# TYPE pipeline_llm_tokens_total counter",
+            ]
+            lines += [f'pipeline_llm_tokens_total{{provider="{provider}",model="{model}",kind="{kind}"}} {count}'
+                      for (provider, model, kind), count in sorted(self.tokens.items())]
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self):
+        # Write then rename so a scraper never reads a half-written file
+        tmp_path = self.prometheus_path.with_suffix(f".{threading.get_ident()}.tmp")
+        tmp_path.write_text(self.prometheus_text())
+        os.replace(tmp_path, self.prometheus_path)
+
+    def reset(self):
+        with self._lock:
+            self.recent.clear()
+            self.stages.clear()
+            self.tokens.clear()
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+def get_metrics() -> Metrics:
+    """
+    Returns the process-wide metrics collector.
+    """
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            metrics_dir = Path(settings.cache_dir) / "metrics"
+            _metrics = Metrics(
+                settings.metrics_log_path or str(metrics_dir / "spans.jsonl"),
+                settings.metrics_prometheus_path or str(metrics_dir / "metrics.prom"),
+                log_max_bytes=settings.metrics_log_max_bytes,
+                log_backups=settings.metrics_log_backups,
+            )
+        return _metrics
+
+def span(name: str, **attributes):
+    """
+    Shorthand for get_metrics().span(...).
+    """
+    return get_metrics().span(name, **attributes)
+
+# --- Prometheus Endpoint ---
+_server = None
+
+def serve_metrics(port: int, host: str = None):
+    """
+    Serves /metrics in the Prometheus text format from a background thread, on `host` (default: the metrics_host
+    setting, loopback only). Safe to call more than once.
+    """
+    global _server
+    with _metrics_lock:
+        if _server is not None:
+            return
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                data = get_metrics().prometheus_text().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        _server = ThreadingHTTPServer((host or settings.metrics_host, port), Handler)
+        _server.daemon_threads = True
+        threading.Thread(target=_server.serve_forever, daemon=True).start()
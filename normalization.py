@@ -0,0 +1,211 @@
+import re
+from dataclasses import asdict, dataclass
+from datetime import datetime
+
+import duckdb
+
+from config import settings
+from dataset_store import TABLE_NAME
+from profiling import get_meta, quote_identifier, set_meta
+
+NORMALIZATION_META_KEY = "normalized_columns"
+
+# Full-match patterns for text that holds another type. The same patterns are checked in Python on the sample and
+# with regexp_full_match over the whole table, so a value the sample missed keeps the column as text.
+# Numbers with leading zeros ("00123") are codes, not numbers, so none of the numeric patterns allow them.
+PATTERNS = {
+    "integer": r"[-+]?(0|[1-9]\d*)",
+    "decimal": r"[-+]?((0|[1-9]\d*)(\.\d*)?|\.\d+)([eE][-+]?\d+)?",
+    "comma_decimal": r"[-+]?([1-9]\d{0,2}(\.\d{3})+|0|[1-9]\d*)(,\d+)?",
+    "thousands": r"[-+]?([1-9]\d{0,2}(,\d{3})+|0|[1-9]\d*)(\.\d+)?",
+    "date": r"\d{4}-\d{2}-\d{2}",
+    "timestamp": r"\d{4}-\d{2}-\d{2}([ T]\d{2}:\d{2}(:\d{2}(\.\d+)?)?)?",
+}
+# Day-first and month-first formats both match "01/02/2024"; a column is only converted when exactly one fits
+DATE_FORMATS = ["%d.%m.%Y", "%d/%m/%Y", "%m/%d/%Y", "%Y/%m/%d", "%d-%m-%Y"]
+# Amounts such as "$1,234.50", "-£5" or "12,50 €" are numbers once their one currency symbol is stripped
+CURRENCY_SYMBOLS = ["$", "€", "£", "¥"]
+TRUE_WORDS = ["true", "yes", "y", "t", "on"]
+FALSE_WORDS = ["false", "no", "n", "f", "off"]
+
+TARGET_TYPES = {
+    "integer": "BIGINT", "decimal": "DOUBLE", "comma_decimal": "DOUBLE", "thousands": "DOUBLE",
+    "date": "DATE", "timestamp": "TIMESTAMP", "boolean": "BOOLEAN",
+}
+
+@dataclass
+class Conversion:
+    column: str
+    kind: str                 # A key of TARGET_TYPES
+    date_format: str = None   # strptime format for non-ISO dates
+    currency: str = None      # Currency symbol stripped from amounts before the numeric conversion
+
+    @property
+    def target_type(self) -> str:
+        return TARGET_TYPES[self.kind]
+
+    def _text(self) -> str:
+        """
+        SQL for the column's trimmed text, with the currency symbol of an amount removed from either end.
+        """
+        value = f"TRIM({quote_identifier(self.column)})"
+        if self.currency:
+            symbol = re.escape(self.currency)
+            value = f"TRIM(regexp_replace({value}, '^([-+]?)\\s*{symbol}|\\s*{symbol}$', '\\1', 'g'))"
+        return value
+
+    def expression(self) -> str:
+        """
+        SQL turning the text column into its native type; blanks and unparseable values become NULL.
+        """
+        value = self._text()
+        if self.kind == "integer":
+            return f"TRY_CAST({value} AS BIGINT)"
+        if self.kind == "decimal":
+            return f"TRY_CAST({value} AS DOUBLE)"
+        if self.kind == "comma_decimal":
+            return f"TRY_CAST(REPLACE(REPLACE({value}, '.', ''), ',', '.') AS DOUBLE)"
+        if self.kind == "thousands":
+            return f"TRY_CAST(REPLACE({value}, ',', '') AS DOUBLE)"
+        if self.kind == "date" and self.date_format:
+            return f"CAST(TRY_STRPTIME({value}, '{self.date_format}') AS DATE)"
+        if self.kind in ("date", "timestamp"):
+            return f"TRY_CAST({value} AS {self.target_type})"
+        true_words = ", ".join(f"'{word}'" for word in TRUE_WORDS)
+        false_words = ", ".join(f"'{word}'" for word in FALSE_WORDS)
+        return f"CASE WHEN lower({value}) IN ({true_words}) THEN true WHEN lower({value}) IN ({false_words}) THEN false END"
+
+    def failures(self) -> str:
+        """
+        SQL counting the non-blank values that would not survive the conversion.
+        """
+        value = f"NULLIF({self._text()}, '')"
+        invalid = f"{self.expression()} IS NULL"
+        if self.kind in PATTERNS and not self.date_format:
+            invalid = f"NOT regexp_full_match({value}, '{PATTERNS[self.kind]}') OR {invalid}"
+        return f"COUNT(*) FILTER (WHERE {value} IS NOT NULL AND ({invalid}))"
+
+# --- Detection ---
+def _matches(kind: str, values: list[str]) -> bool:
+    return all(re.fullmatch(PATTERNS[kind], value) for value in values)
+
+def _strip_currency(value: str, symbol: str) -> str:
+    symbol = re.escape(symbol)
+    return re.sub(rf"^([-+]?)\s*{symbol}|\s*{symbol}$", r"\1", value).strip()
+
+def _classify_number(values: list[str]) -> Conversion:
+    for kind in ("integer", "decimal"):
+        if _matches(kind, values):
+            return Conversion("", kind)
+
+    # "1,234" is a thousand in one locale and a decimal in another; decide only when some value settles it
+    comma_decimal, thousands = _matches("comma_decimal", values), _matches("thousands", values)
+    if comma_decimal and not thousands:
+        return Conversion("", "comma_decimal")
+    if thousands and not comma_decimal:
+        return Conversion("", "thousands")
+    return None
+
+def _date_format(values: list[str]) -> str:
+    fitting = []
+    for date_format in DATE_FORMATS:
+        try:
+            for value in values:
+                datetime.strptime(value, date_format)
+        except ValueError:
+            continue
+        fitting.append(date_format)
+    return fitting[0] if len(fitting) == 1 else None
+
+def classify(values: list[str]) -> Conversion:
+    """
+    Works out what a text column's sample really holds. Returns a Conversion with an empty column name, or None
+    if the values are plain text or ambiguous.
+    """
+    values = [value.strip() for value in values if value is not None and value.strip()]
+    if not values:
+        return None
+    conversion = _classify_number(values)
+    if conversion:
+        return conversion
+
+    # Amounts in a single currency; a column mixing symbols is not one quantity and stays text
+    symbols = {symbol for symbol in CURRENCY_SYMBOLS for value in values if symbol in value}
+    if len(symbols) == 1:
+        symbol = symbols.pop()
+        conversion = _classify_number([_strip_currency(value, symbol) for value in values])
+        if conversion:
+            conversion.currency = symbol
+            return conversion
+
+    for kind in ("date", "timestamp"):
+        if _matches(kind, values):
+            return Conversion("", kind)
+    date_format = _date_format(values)
+    if date_format:
+        return Conversion("", "date", date_format)
+
+    # At least two different words, so a column of "Y" codes stays text
+    words = {value.lower() for value in values}
+    if len(words) >= 2 and words <= set(TRUE_WORDS + FALSE_WORDS):
+        return Conversion("", "boolean")
+    return None
+
+def detect_conversions(con: duckdb.DuckDBPyConnection, table: str = TABLE_NAME,
+                       sample_rows: int = None) -> list[Conversion]:
+    """
+    Classifies every VARCHAR column from a reservoir sample of `sample_rows` rows (default:
+    normalize_sample_rows). Candidates are not yet checked against the rest of the table.
+    """
+    sample_rows = sample_rows or settings.normalize_sample_rows
+    text_columns = [name for name, column_type, *_ in con.execute(f"DESCRIBE {table}").fetchall()
+                    if column_type == "VARCHAR"]
+    if not text_columns:
+        return []
+    rows = con.execute(
+        f"SELECT {', '.join(quote_identifier(name) for name in text_columns)} FROM {table} "
+        f"USING SAMPLE reservoir({sample_rows} ROWS) REPEATABLE (0)"
+    ).fetchall()
+
+    conversions = []
+    for i, name in enumerate(text_columns):
+        conversion = classify([row[i] for row in rows])
+        if conversion:
+            conversion.column = name
+            conversions.append(conversion)
+    return conversions
+
+# --- Materialization ---
+def normalize_types(con: duckdb.DuckDBPyConnection, table: str = TABLE_NAME) -> list[Conversion]:
+    """
+    Rewrites the table once with numeric, date and boolean columns that were loaded as text converted to native
+    types, so queries aggregate them directly instead of casting strings on every run.
+
+    Candidates come from detect_conversions; one scan then checks each against every row, and a column is only
+    converted if no non-blank value would be lost. The applied conversions are stored in the dataset metadata.
+    """
+    conversions = detect_conversions(con, table)
+    if conversions:
+        failures = con.execute(
+            f"SELECT {', '.join(conversion.failures() for conversion in conversions)} FROM {table}"
+        ).fetchone()
+        conversions = [conversion for conversion, failed in zip(conversions, failures) if failed == 0]
+
+    if conversions:
+        by_column = {conversion.column: conversion for conversion in conversions}
+        select = []
+        for name, *_ in con.execute(f"DESCRIBE {table}").fetchall():
+            conversion = by_column.get(name)
+            column = quote_identifier(name)
+            select.append(f"{conversion.expression()} AS {column}" if conversion else column)
+        con.execute(f"CREATE TABLE {table}_normalized AS SELECT {', '.join(select)} FROM {table}")
+        con.execute(f"DROP TABLE {table}")
+        con.execute(f"ALTER TABLE {table}_normalized RENAME TO {table}")
+    set_meta(con, NORMALIZATION_META_KEY, [asdict(conversion) for conversion in conversions])
+    return conversions
+
+def load_conversions(con: duckdb.DuckDBPyConnection) -> list[Conversion]:
+    """
+    The conversions applied when the dataset was loaded.
+    """
+    return [Conversion(**data) for data in get_meta(con, NORMALIZATION_META_KEY) or []]
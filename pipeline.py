@@ -0,0 +1,199 @@
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from config import settings
+from dataset_store import file_fingerprint, get_dataset_store
+from ingestion import append_path, ingest_path
+from llm_engine import close_async_clients
+from metrics import get_metrics, span
+from profiling import load_profile
+from schema_index import load_column_index
+from query_results import EXPORT_FORMATS, export_result
+from text_to_sql import QuestionResult, answer_questions, build_question_prompt, run_sql, sanitize_columns
+
+logger = logging.getLogger("pipeline")
+
+# --- Reports ---
+@dataclass
+class DatasetReport:
+    source: str
+    dataset_id: str = None
+    row_count: int = None
+    ingest_seconds: float = 0.0
+    elapsed: float = 0.0
+    error: str = None
+    appends: list[dict] = field(default_factory=list)
+    questions: list[dict] = field(default_factory=list)
+
+    @property
+    def failed(self) -> bool:
+        return self.error is not None or any(q["error"] for q in self.questions)
+
+def _question_entry(index: int, result: QuestionResult, export_path: Path = None) -> dict:
+    return {
+        "index": index,
+        "question": result.question,
+        "sql_query": result.sql_query,
+        "explanation": result.explanation,
+        "preview_rows": None if result.result_df is None else len(result.result_df),
+        "export": export_path.name if export_path else None,
+        "error": result.error,
+        "elapsed": round(result.elapsed, 3),
+    }
+
+def write_report(report: DatasetReport, out_dir: Path):
+    """
+    Writes report.json for machines and report.md for people next to the exported results.
+    """
+    report.questions.sort(key=lambda q: q["index"])
+    (out_dir / "report.json").write_text(json.dumps(report.__dict__, indent=2, default=str))
+
+    lines = [f"# {Path(report.source).name}", ""]
+    if report.error:
+        lines += [f"**Failed:** {report.error}", ""]
+    else:
+        lines += [f"{report.row_count:,} rows, loaded in {report.ingest_seconds:.1f}s.", ""]
+    for entry in report.appends:
+        merged = "already merged" if entry["skipped"] else f"{entry['inserted']:,} added, {entry['updated']:,} updated"
+        lines += [f"- Merged `{Path(entry['source']).name}`: {merged}", ""]
+    for q in report.questions:
+        lines += [f"## {q['index']}. {q['question']}", ""]
+        if q["sql_query"]:
+            lines += ["```sql", q["sql_query"], "```", ""]
+        if q["error"]:
+            lines += [f"**Error:** {q['error']}", ""]
+        else:
+            lines += [q["explanation"] or "", "", f"Result: `{q['export']}` ({q['elapsed']:.1f}s)", ""]
+    (out_dir / "report.md").write_text("\n".join(lines))
+
+# --- Pipeline ---
+async def run_dataset(source: str, questions: list[str], out_root: Path, fmt: str, use_cache: bool,
+                      ingest_semaphore: asyncio.Semaphore, llm_semaphore: asyncio.Semaphore,
+                      appends: list[str] = (), keys: list[str] = None) -> DatasetReport:
+    """
+    Ingests one file, merges any `appends` into it (upserting by `keys` when given), answers every question
+    against it and exports each full result.
+
+    Ingestion runs in a worker thread under `ingest_semaphore`, while `llm_semaphore` is shared by all datasets,
+    so one dataset's questions are in flight while the next one is still loading.
+    """
+    report = DatasetReport(source=source)
+    start = time.perf_counter()
+    store = get_dataset_store()
+    try:
+        dataset_id = report.dataset_id = file_fingerprint(source)
+        async with ingest_semaphore:
+            logger.info("Loading %s", source)
+            with span("ingest", dataset_id=dataset_id, source=source):
+                await asyncio.to_thread(ingest_path, store, dataset_id, source)
+            for path in appends:
+                logger.info("Merging %s into %s", path, source)
+                with span("ingest.append", dataset_id=dataset_id, source=path):
+                    result = await asyncio.to_thread(append_path, store, dataset_id, path, keys)
+                report.appends.append({"source": path, **result.__dict__})
+        report.ingest_seconds = time.perf_counter() - start
+
+        con = store.connect(dataset_id)
+        with span("profile", dataset_id=dataset_id):
+            profile = await asyncio.to_thread(load_profile, con)
+            column_index = await asyncio.to_thread(load_column_index, con, profile)
+        report.row_count = profile["row_count"]
+        system_prompt = lambda question: build_question_prompt(profile["columns"], question, column_index)
+    except Exception as e:
+        logger.exception("Could not load %s", source)
+        report.error = str(e)
+        report.elapsed = time.perf_counter() - start
+        return report
+
+    out_dir = out_root / f"{Path(source).name.split('.')[0]}-{dataset_id[:8]}"
+    out_dir.mkdir(parents=True, exist_ok=True)
+    indexes = {question: i for i, question in enumerate(questions, 1)}
+    execute = lambda sql_query: sanitize_columns(run_sql(dataset_id, sql_query).to_pandas())
+
+    async for result in answer_questions(questions, system_prompt, execute, use_cache=use_cache,
+                                         semaphore=llm_semaphore):
+        index = indexes[result.question]
+        export_path = None
+        if not result.error:
+            try:
+                # COPY streams the full result to disk; the preview above was only its first page
+                with span("sql.export", dataset_id=dataset_id, format=fmt):
+                    export_path = await asyncio.to_thread(
+                        export_result, store.connect(dataset_id), result.sql_query, fmt, f"q{index:03d}", out_dir
+                    )
+            except Exception as e:
+                result.error = f"Export failed: {e}"
+        logger.info("%s [%d/%d] %s (%.1fs)%s", Path(source).name, index, len(questions), result.question,
+                    result.elapsed, f": {result.error}" if result.error else "")
+        report.questions.append(_question_entry(index, result, export_path))
+
+    report.elapsed = time.perf_counter() - start
+    write_report(report, out_dir)
+    return report
+
+async def run_pipeline(sources: list[str], questions: list[str], out_root: str, fmt: str = "csv",
+                       concurrency: int = None, use_cache: bool = True, appends: list[str] = (),
+                       keys: list[str] = None) -> list[DatasetReport]:
+    """
+    Runs every question against every source, with all datasets processed concurrently.
+    """
+    out_root = Path(out_root)
+    ingest_semaphore = asyncio.Semaphore(settings.dataset_store_max_open)
+    llm_semaphore = asyncio.Semaphore(concurrency or settings.llm_batch_concurrency)
+    try:
+        return await asyncio.gather(*[
+            run_dataset(source, questions, out_root, fmt, use_cache, ingest_semaphore, llm_semaphore, appends, keys)
+            for source in sources
+        ])
+    finally:
+        await close_async_clients()
+        get_metrics().write_prometheus()
+
+# --- CLI ---
+def read_questions(args) -> list[str]:
+    questions = list(args.question or [])
+    for path in args.questions or []:
+        questions += [line.strip() for line in Path(path).read_text().splitlines() if line.strip()]
+    # Duplicates would share one answer, so keep the first occurrence only
+    return list(dict.fromkeys(questions))
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Run text-to-SQL question batches over data files without the Streamlit UI. "
+                    "Configuration is read from DATA_PIPELINE_* environment variables or .env."
+    )
+    parser.add_argument("--data", nargs="+", required=True, help="CSV, Parquet or JSON files to analyse")
+    parser.add_argument("--questions", action="append", help="File with one question per line (repeatable)")
+    parser.add_argument("--question", action="append", help="A single question (repeatable)")
+    parser.add_argument("--out", default="pipeline_output", help="Directory for results and reports")
+    parser.add_argument("--append", action="append", default=[],
+                        help="File with the same columns to merge into the --data dataset (repeatable); "
+                             "files already merged are skipped")
+    parser.add_argument("--key", action="append", help="Key column for --append: upsert instead of appending rows")
+    parser.add_argument("--format", choices=sorted(EXPORT_FORMATS), default="csv", help="Result file format")
+    parser.add_argument("--concurrency", type=int, help="Maximum LLM requests in flight across all datasets")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the LLM response cache")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    questions = read_questions(args)
+    if not questions:
+        parser.error("no questions given; use --question or --questions")
+
+    if args.key and not args.append:
+        parser.error("--key needs --append")
+
+    reports = asyncio.run(run_pipeline(args.data, questions, args.out, args.format, args.concurrency,
+                                       use_cache=not args.no_cache, appends=args.append, keys=args.key))
+    failed = [report for report in reports if report.failed]
+    logger.info("Finished %d dataset(s), %d with failures", len(reports), len(failed))
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+import json
+
+import duckdb
+
+from dataset_store import TABLE_NAME
+
+PROFILE_META_KEY = "profile"
+SAMPLE_ROWS = 100
+SAMPLES_PER_COLUMN = 3
+
+# --- Metadata ---
+def get_meta(con: duckdb.DuckDBPyConnection, key: str):
+    """
+    Reads a JSON value from the dataset's metadata table, or None if it was never stored.
+    """
+    con.execute("CREATE TABLE IF NOT EXISTS _pipeline_meta (key VARCHAR PRIMARY KEY, value VARCHAR)")
+    row = con.execute("SELECT value FROM _pipeline_meta WHERE key = ?", [key]).fetchone()
+    return json.loads(row[0]) if row else None
+
+def set_meta(con: duckdb.DuckDBPyConnection, key: str, value):
+    con.execute("CREATE TABLE IF NOT EXISTS _pipeline_meta (key VARCHAR PRIMARY KEY, value VARCHAR)")
+    con.execute("INSERT OR REPLACE INTO _pipeline_meta VALUES (?, ?)", [key, json.dumps(value, default=str)])
+
+# --- Profiling ---
+def quote_identifier(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+def profile_table(con: duckdb.DuckDBPyConnection, table: str = TABLE_NAME) -> dict:
+    """
+    Computes row count and per-column null count, distinct estimate and min/max in a single scan,
+    plus a few sample values taken from the first rows.
+    """
+    columns = con.execute(f"DESCRIBE {table}").fetchall()
+
+    aggregates = ["COUNT(*)"]
+    for name, *_ in columns:
+        col = quote_identifier(name)
+        aggregates += [
+            f"COUNT(*) - COUNT({col})",
+            f"approx_count_distinct({col})",
+            f"CAST(MIN({col}) AS VARCHAR)",
+            f"CAST(MAX({col}) AS VARCHAR)",
+        ]
+    stats = con.execute(f"SELECT {', '.join(aggregates)} FROM {table}").fetchone()
+
+    head = con.execute(f"SELECT * FROM {table} LIMIT {SAMPLE_ROWS}").fetchall()
+
+    profile = {"row_count": stats[0], "columns": []}
+    for i, (name, column_type, *_) in enumerate(columns):
+        null_count, approx_distinct, min_value, max_value = stats[1 + 4 * i: 5 + 4 * i]
+        samples = []
+        for row in head:
+            value = row[i]
+            if value is not None and str(value) not in samples:
+                samples.append(str(value))
+                if len(samples) == SAMPLES_PER_COLUMN:
+                    break
+        profile["columns"].append({
+            "column_name": name,
+            "column_type": column_type,
+            "null_count": null_count,
+            "approx_distinct": approx_distinct,
+            "min": min_value,
+            "max": max_value,
+            "samples": samples,
+        })
+    return profile
+
+def load_profile(con: duckdb.DuckDBPyConnection, table: str = TABLE_NAME) -> dict:
+    """
+    Returns the profile stored with the dataset, computing and storing it on first use.
+    """
+    profile = get_meta(con, PROFILE_META_KEY)
+    if profile is None:
+        profile = profile_table(con, table)
+        set_meta(con, PROFILE_META_KEY, profile)
+    return profile
+
+def update_profile(con: duckdb.DuckDBPyConnection, added: str, removed: str = None, table: str = TABLE_NAME) -> dict:
+    """
+    Updates the stored profile after rows were appended to the table, scanning only the appended rows (the `added`
+    table) and the stored rows they replaced (`removed`), not the whole table.
+
+    Row and null counts stay exact. Min and max widen to cover the new rows, but are left as bounds when replaced
+    rows held them, and distinct counts are estimated, since neither can be merged exactly without a full scan.
+    Sample values are kept, so prompts built from the profile do not change.
+    """
+    profile = get_meta(con, PROFILE_META_KEY)
+    if profile is None:
+        return load_profile(con, table)
+
+    columns = profile["columns"]
+    aggregates = ["COUNT(*)"]
+    for column in columns:
+        col = quote_identifier(column["column_name"])
+        column_type = column["column_type"]
+        aggregates += [
+            f"COUNT(*) - COUNT({col})",
+            f"approx_count_distinct({col})",
+            f"CAST(LEAST(TRY_CAST(? AS {column_type}), MIN({col})) AS VARCHAR)",
+            f"CAST(GREATEST(TRY_CAST(? AS {column_type}), MAX({col})) AS VARCHAR)",
+        ]
+    parameters = [value for column in columns for value in (column["min"], column["max"])]
+    stats = con.execute(f"SELECT {', '.join(aggregates)} FROM {added}", parameters).fetchone()
+    removed_stats = [0] * (1 + len(columns))
+    if removed:
+        null_counts = [f"COUNT(*) - COUNT({quote_identifier(column['column_name'])})" for column in columns]
+        removed_stats = con.execute(f"SELECT COUNT(*), {', '.join(null_counts)} FROM {removed}").fetchone()
+
+    old_row_count = profile["row_count"]
+    profile["row_count"] = old_row_count + stats[0] - removed_stats[0]
+    for i, column in enumerate(columns):
+        null_count, added_distinct, min_value, max_value = stats[1 + 4 * i: 5 + 4 * i]
+        column["null_count"] += null_count - removed_stats[1 + i]
+        column["min"], column["max"] = min_value, max_value
+        # Assume the new rows bring unseen values at the rate the column already has them: a key column grows
+        # by the number of new rows, a category column barely at all
+        distinct = column["approx_distinct"]
+        if old_row_count:
+            distinct += round(added_distinct * min(1.0, column["approx_distinct"] / old_row_count))
+        column["approx_distinct"] = min(max(distinct, added_distinct), profile["row_count"])
+    set_meta(con, PROFILE_META_KEY, profile)
+    return profile
@@ -0,0 +1,108 @@
+import hashlib
+import re
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import duckdb
+import pandas as pd
+import pyarrow as pa
+
+from config import settings
+from sql_guard import QueryHandle, guarded, limit_rows, strip_sql, subquery
+
+EXPORT_FORMATS = {
+    "csv": "(FORMAT CSV, HEADER)",
+    "parquet": "(FORMAT PARQUET)",
+}
+
+# --- Paginated Results ---
+@dataclass
+class ResultPage:
+    table: pa.Table
+    offset: int              # Row offset of the page's first row in the full result
+    page_size: int
+    has_next: bool
+    truncated: bool = False  # The page was cut short by the memory cap
+    plan: str = None         # EXPLAIN ANALYZE output, when the query was profiled
+    warnings: list[str] = field(default_factory=list)  # Pre-flight warnings about the plan
+
+    @property
+    def next_offset(self) -> int:
+        """
+        Offset the next page starts at; a page cut short by the memory cap moves on by the rows it holds.
+        """
+        return self.offset + self.table.num_rows
+
+    def to_pandas(self) -> pd.DataFrame:
+        return self.table.to_pandas()
+
+def fetch_page(con: duckdb.DuckDBPyConnection, sql_query: str, offset: int = 0, page_size: int = None,
+               max_bytes: int = None, handle: QueryHandle = None) -> ResultPage:
+    """
+    Runs the query server-side with LIMIT/OFFSET and reads up to `page_size` rows from `offset` as Arrow record
+    batches. Reading stops once the page holds `max_bytes`, so an unbounded SELECT * never lands in memory; a
+    page always keeps at least one row so paging by `next_offset` moves forward.
+    The query runs under the execution budget and can be stopped through `handle`.
+    """
+    page_size = page_size or settings.result_page_size
+    max_bytes = max_bytes or settings.result_max_bytes
+
+    batches, size, rows, truncated = [], 0, 0, False
+    with guarded(con, handle):
+        # One extra row tells whether a next page exists without counting the full result
+        reader = con.execute(
+            f"SELECT * FROM {subquery(sql_query)} LIMIT {page_size + 1} OFFSET {offset}"
+        ).to_arrow_reader(settings.result_batch_rows)
+        for batch in reader:
+            if batch.num_rows and size + batch.nbytes > max_bytes:
+                rows_that_fit = int((max_bytes - size) / (batch.nbytes / batch.num_rows))
+                # A row wider than the cap still makes a page of its own, or the pager would never get past it
+                rows_that_fit = max(rows_that_fit, 0 if rows else 1)
+                if rows_that_fit < batch.num_rows:
+                    batches.append(batch.slice(0, rows_that_fit))
+                    truncated = True
+                    break
+            batches.append(batch)
+            size += batch.nbytes
+            rows += batch.num_rows
+
+    table = pa.Table.from_batches(batches, schema=reader.schema)
+    has_next = truncated or table.num_rows > page_size
+    # Only a cut into the page itself counts; dropping the look-ahead row does not
+    truncated = truncated and table.num_rows < page_size
+    return ResultPage(table.slice(0, page_size), offset, page_size, has_next, truncated)
+
+# --- Profiling ---
+def explain_analyze(con: duckdb.DuckDBPyConnection, sql_query: str, handle: QueryHandle = None) -> tuple[str, float]:
+    """
+    Runs the query under EXPLAIN ANALYZE and returns DuckDB's profiled plan, with per-operator row counts and
+    timings, and the total time it reports. The query is capped at `sql_max_rows` and runs under the budget.
+    """
+    with guarded(con, handle):
+        rows = con.execute(f"EXPLAIN ANALYZE {limit_rows(sql_query)}").fetchall()
+    plan = "\n".join(row[-1] for row in rows)
+    total = re.search(r"Total Time: ([\d.]+)s", plan)
+    return plan, float(total.group(1)) if total else None
+
+# --- Export ---
+def export_result(con: duckdb.DuckDBPyConnection, sql_query: str, fmt: str, name: str, out_dir: str = None,
+                  handle: QueryHandle = None) -> Path:
+    """
+    Streams the full result of the query to a CSV or Parquet file with COPY, without materializing it in Python.
+    Without `out_dir` the file goes to the export cache, where exports older than `export_ttl_seconds` are
+    removed first. The export is capped at `sql_max_rows` and runs under the execution budget.
+    """
+    export_dir = Path(out_dir) if out_dir else Path(settings.cache_dir) / "exports"
+    export_dir.mkdir(parents=True, exist_ok=True)
+    if not out_dir:
+        for old in export_dir.iterdir():
+            if time.time() - old.stat().st_mtime > settings.export_ttl_seconds:
+                old.unlink(missing_ok=True)
+
+    digest = hashlib.blake2b(strip_sql(sql_query).encode(), digest_size=8).hexdigest()
+    path = export_dir / f"{name}-{digest}.{fmt}"
+    target = str(path).replace("'", "''")
+    with guarded(con, handle):
+        con.execute(f"COPY ({limit_rows(sql_query)}) TO '{target}' {EXPORT_FORMATS[fmt]}")
+    return path
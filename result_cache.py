@@ -0,0 +1,120 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+from pathlib import Path
+
+import pyarrow as pa
+
+from config import settings
+from query_results import ResultPage
+
+_TOKEN = re.compile(r"""('(?:''|[^'])*'|"(?:""|[^"])*"|--[^\n]*|/\*.*?\*/|\s+|[^'"\s/-]+|[/-])""", re.S)
+
+def normalize_sql(sql_query: str) -> str:
+    """
+    Canonical form of a query for cache keys: comments dropped, whitespace collapsed, trailing semicolons removed
+    and everything outside quoted literals and identifiers lowercased.
+    """
+    parts = []
+    for token in _TOKEN.findall(sql_query):
+        if token[0] in "'\"":
+            parts.append(token)
+        elif token.isspace() or token.startswith("--") or token.startswith("/*"):
+            if parts and parts[-1] != " ":
+                parts.append(" ")
+        else:
+            parts.append(token.lower())
+    return "".join(parts).strip().rstrip(";").strip()
+
+# --- Result Cache ---
+class ResultCache:
+    """
+    Caches result pages on local disk as Arrow IPC files, keyed by dataset content hash and normalized SQL.
+
+    Entries live in one directory per dataset, so a dataset's results can be invalidated at once when it is
+    re-ingested or evicted. Files are evicted least-recently-used first once the cache exceeds `max_bytes`.
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = Path(root) / "results"
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _path(self, dataset_id: str, sql_query: str, offset: int, page_size: int) -> Path:
+        key = json.dumps([normalize_sql(sql_query), offset, page_size, settings.result_max_bytes])
+        return self.root / dataset_id / f"{hashlib.sha256(key.encode()).hexdigest()}.arrow"
+
+    def get(self, dataset_id: str, sql_query: str, offset: int, page_size: int):
+        path = self._path(dataset_id, sql_query, offset, page_size)
+        try:
+            with pa.memory_map(str(path)) as source:
+                table = pa.ipc.open_file(source).read_all()
+            os.utime(path)
+        except (FileNotFoundError, pa.ArrowInvalid):
+            self.misses += 1
+            return None
+        self.hits += 1
+        meta = json.loads(table.schema.metadata[b"result_page"])
+        return ResultPage(table.replace_schema_metadata(None), offset, page_size, meta["has_next"], meta["truncated"])
+
+    def put(self, dataset_id: str, sql_query: str, result_page: ResultPage):
+        path = self._path(dataset_id, sql_query, result_page.offset, result_page.page_size)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        meta = {"has_next": result_page.has_next, "truncated": result_page.truncated}
+        table = result_page.table.replace_schema_metadata({"result_page": json.dumps(meta)})
+
+        # Write then rename so concurrent readers never see a partial file
+        tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+        with pa.OSFile(str(tmp_path), "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def invalidate(self, dataset_id: str):
+        """
+        Drops every cached result of a dataset.
+        """
+        with self._lock:
+            shutil.rmtree(self.root / dataset_id, ignore_errors=True)
+
+    def clear(self):
+        with self._lock:
+            for entry in self.root.iterdir():
+                shutil.rmtree(entry, ignore_errors=True)
+        self.hits = 0
+        self.misses = 0
+
+    def evict(self):
+        with self._lock:
+            files = []
+            for path in self.root.glob("*/*.arrow"):
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _, size, _ in files)
+            for _, size, path in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                path.unlink(missing_ok=True)
+                total -= size
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_result_cache() -> ResultCache:
+    """
+    Returns the process-wide query result cache.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache(settings.cache_dir, max_bytes=settings.result_cache_max_bytes)
+        return _cache
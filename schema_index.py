@@ -0,0 +1,134 @@
+import math
+import re
+from collections import Counter
+
+import duckdb
+
+from config import settings
+from profiling import get_meta, set_meta
+
+INDEX_META_KEY = "column_index"
+
+# BM25 parameters; column names are repeated so a name match outweighs a sample value match
+K1 = 1.2
+B = 0.75
+NAME_WEIGHT = 3
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "each", "for", "from", "give", "have",
+    "how", "i", "in", "is", "it", "list", "many", "me", "much", "my", "of", "on", "or", "per", "show", "than",
+    "that", "the", "their", "there", "this", "to", "was", "we", "were", "what", "when", "where", "which", "who",
+    "with", "you",
+}
+
+# Words a question uses for a column's type rather than its name
+TYPE_TERMS = {
+    "DATE": "date day month year week time when",
+    "TIMESTAMP": "date day month year week time hour when",
+    "TIME": "time hour minute when",
+    "BOOLEAN": "flag true false yes no whether",
+}
+
+_CAMEL = re.compile(r"([a-z])([A-Z])")
+_WORD = re.compile(r"[a-z]+|\d+")
+
+def _stem(token: str) -> str:
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 5 and token.endswith("ed"):
+        return token[:-2]
+    if len(token) > 6 and token.endswith("ing"):
+        return token[:-3]
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+def tokenize(text) -> list[str]:
+    """
+    Splits text into lowercase word and number tokens, breaking snake_case and camelCase apart and folding
+    simple plurals and -ed/-ing endings, so "unitPrices" matches "unit_price" and "returns" matches "is_returned".
+    """
+    words = _WORD.findall(_CAMEL.sub(r"\1 \2", str(text)).lower())
+    return [_stem(word) for word in words if word not in STOPWORDS]
+
+# --- Column Relevance Index ---
+class ColumnIndex:
+    """
+    BM25 index over a table's columns, for picking the columns relevant to a question without an embedding model.
+    Each column is a document made of its name, its type (with words like "month" for date types) and its
+    profiled sample values.
+    """
+
+    def __init__(self, columns: list[str], documents: list[dict[str, int]]):
+        self.columns = columns
+        self.documents = documents
+        self.lengths = [sum(document.values()) for document in documents]
+        self.average_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+        document_frequency = Counter(term for document in documents for term in document)
+        n = len(documents)
+        self.idf = {term: math.log(1 + (n - df + 0.5) / (df + 0.5)) for term, df in document_frequency.items()}
+
+    @classmethod
+    def from_profile(cls, profile: dict) -> "ColumnIndex":
+        columns, documents = [], []
+        for column in profile["columns"]:
+            terms = tokenize(column["column_name"]) * NAME_WEIGHT
+            base_type = column["column_type"].split("(")[0].upper()
+            terms += tokenize(base_type) + tokenize(TYPE_TERMS.get(base_type, ""))
+            for sample in column.get("samples") or []:
+                terms += tokenize(str(sample)[:40])
+            columns.append(column["column_name"])
+            documents.append(dict(Counter(terms)))
+        return cls(columns, documents)
+
+    def to_dict(self) -> dict:
+        return {"columns": self.columns, "documents": self.documents}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ColumnIndex":
+        return cls(data["columns"], data["documents"])
+
+    def scores(self, question: str) -> list[float]:
+        terms = set(tokenize(question))
+        scores = []
+        for document, length in zip(self.documents, self.lengths):
+            score = 0.0
+            for term in terms:
+                tf = document.get(term)
+                if tf:
+                    norm = K1 * (1 - B + B * length / self.average_length)
+                    score += self.idf[term] * tf * (K1 + 1) / (tf + norm)
+            scores.append(score)
+        return scores
+
+    def search(self, question: str, top_n: int) -> list[str]:
+        """
+        Names of up to top_n columns that match the question, most relevant first.
+        """
+        ranked = sorted(zip(self.scores(question), range(len(self.columns))), key=lambda pair: (-pair[0], pair[1]))
+        return [self.columns[i] for score, i in ranked[:top_n] if score > 0]
+
+def load_column_index(con: duckdb.DuckDBPyConnection, profile: dict) -> ColumnIndex:
+    """
+    Returns the column index stored with the dataset, building and storing it when missing or when the profile's
+    columns have changed.
+    """
+    data = get_meta(con, INDEX_META_KEY)
+    if data is None or data["columns"] != [column["column_name"] for column in profile["columns"]]:
+        index = ColumnIndex.from_profile(profile)
+        set_meta(con, INDEX_META_KEY, index.to_dict())
+        return index
+    return ColumnIndex.from_dict(data)
+
+def prune_schema(schema_info: list[dict], index: ColumnIndex, question: str, top_n: int = None) -> list[dict]:
+    """
+    Returns the schema entries of the columns most relevant to the question, in table order.
+    The full schema is returned for tables narrower than `schema_prune_min_columns` and when no column matches.
+    """
+    top_n = top_n or settings.schema_prune_top_n
+    if index is None or len(schema_info) <= max(settings.schema_prune_min_columns, top_n):
+        return schema_info
+    relevant = set(index.search(question, top_n))
+    if not relevant:
+        return schema_info
+    return [column for column in schema_info if column["column_name"] in relevant]
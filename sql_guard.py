@@ -0,0 +1,181 @@
+import json
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+import duckdb
+
+from config import settings
+
+# Operators that compare every row of one input with every row of the other
+QUADRATIC_OPERATORS = {"CROSS_PRODUCT", "NESTED_LOOP_JOIN", "BLOCKWISE_NL_JOIN"}
+
+class SQLRejected(ValueError):
+    """
+    The query failed the pre-flight check and was not run.
+    """
+
+class QueryTimeout(TimeoutError):
+    """
+    The query ran past its wall-clock budget and was interrupted.
+    """
+
+class QueryCancelled(RuntimeError):
+    """
+    The query was cancelled by the user.
+    """
+
+# --- Pre-flight ---
+@dataclass
+class Preflight:
+    estimated_rows: int = None     # Largest intermediate result the planner expects
+    operators: list[str] = field(default_factory=list)
+    warnings: list[str] = field(default_factory=list)
+
+def _walk(node: dict):
+    yield node
+    for child in node.get("children", []):
+        yield from _walk(child)
+
+def _estimate(node: dict, estimates: list[int]) -> int:
+    """
+    Estimated output rows of a plan node, collecting every node's estimate into `estimates`.
+    DuckDB gives no estimate for cross products, so theirs is the product of their inputs'.
+    """
+    children = [_estimate(child, estimates) for child in node.get("children", [])]
+    extra_info = node.get("extra_info") if isinstance(node.get("extra_info"), dict) else {}
+    estimate = str(extra_info.get("Estimated Cardinality", ""))
+    if estimate.isdigit():
+        rows = int(estimate)
+    elif node["name"] == "CROSS_PRODUCT" and children and None not in children:
+        rows = 1
+        for child_rows in children:
+            rows *= child_rows
+    else:
+        rows = None
+    if rows is not None:
+        estimates.append(rows)
+    return rows
+
+def preflight(con: duckdb.DuckDBPyConnection, sql_query: str) -> Preflight:
+    """
+    Plans the query with EXPLAIN, without running it, and checks the plan against the execution budget.
+    Raises SQLRejected for anything other than a single SELECT, or when the planner expects an intermediate
+    result above `sql_reject_estimated_rows`; cross joins and large estimates below that only produce warnings.
+    """
+    statements = con.extract_statements(sql_query)
+    if len(statements) != 1:
+        raise SQLRejected(f"Expected a single SELECT statement, got {len(statements)} statements")
+    if statements[0].type != duckdb.StatementType.SELECT:
+        raise SQLRejected(f"Only SELECT queries may run, not {statements[0].type.name}")
+
+    rows = con.execute(f"EXPLAIN (FORMAT JSON) {sql_query}").fetchall()
+    roots = json.loads(rows[0][1])
+    nodes = [node for root in roots for node in _walk(root)]
+    estimates = []
+    for root in roots:
+        _estimate(root, estimates)
+    result = Preflight(estimated_rows=max(estimates, default=None), operators=[node["name"] for node in nodes])
+
+    if result.estimated_rows and result.estimated_rows > settings.sql_reject_estimated_rows:
+        raise SQLRejected(
+            f"The plan expects about {result.estimated_rows:,} intermediate rows, over the "
+            f"{settings.sql_reject_estimated_rows:,} row budget; is a join condition missing?"
+        )
+    quadratic = sorted(QUADRATIC_OPERATORS.intersection(result.operators))
+    if quadratic:
+        result.warnings.append(f"The plan compares every row pair ({', '.join(quadratic)}); this can be slow.")
+    if result.estimated_rows and result.estimated_rows > settings.sql_warn_estimated_rows:
+        result.warnings.append(f"The plan expects about {result.estimated_rows:,} intermediate rows.")
+    return result
+
+def strip_sql(sql_query: str) -> str:
+    return sql_query.strip().rstrip(";").strip()
+
+def subquery(sql_query: str, alias: str = "result") -> str:
+    """
+    The query as a FROM-clause subquery. The closing parenthesis goes on a line of its own, so a query ending in a
+    -- comment still parses.
+    """
+    return f"(\n{strip_sql(sql_query)}\n) AS {alias}"
+
+def limit_rows(sql_query: str, max_rows: int = None) -> str:
+    """
+    Caps the query at `max_rows` (default: sql_max_rows). A query with a smaller LIMIT of its own is unaffected.
+    """
+    max_rows = max_rows or settings.sql_max_rows
+    return f"SELECT * FROM {subquery(sql_query, 'limited')} LIMIT {max_rows}"
+
+# --- Guarded Execution ---
+class QueryHandle:
+    """
+    Lets another thread stop the queries run under it, e.g. when the user cancels.
+    Used as a context manager, the handle cancels its queries if the block exits with an exception, so an
+    interrupted script never leaves a query running behind it.
+    """
+
+    def __init__(self):
+        self.cancelled = False
+        self._connections = set()
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            connections = list(self._connections)
+        for con in connections:
+            con.interrupt()
+
+    def _attach(self, con):
+        with self._lock:
+            if self.cancelled:
+                return False
+            self._connections.add(con)
+            return True
+
+    def _detach(self, con):
+        with self._lock:
+            self._connections.discard(con)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.cancel()
+
+@contextmanager
+def guarded(con: duckdb.DuckDBPyConnection, handle: QueryHandle = None, timeout: float = None):
+    """
+    Runs the block's queries on `con` under a wall-clock budget (default: sql_timeout_seconds), interrupting the
+    connection when it runs out or when the handle is cancelled. Interrupts surface as QueryTimeout or
+    QueryCancelled; the connection stays usable afterwards.
+    """
+    handle = handle or QueryHandle()
+    timeout = settings.sql_timeout_seconds if timeout is None else timeout
+    if not handle._attach(con):
+        raise QueryCancelled("Query cancelled")
+    timed_out = threading.Event()
+
+    def expire():
+        timed_out.set()
+        con.interrupt()
+
+    timer = None
+    if timeout:
+        timer = threading.Timer(timeout, expire)
+        timer.daemon = True
+        timer.start()
+    try:
+        yield handle
+    except Exception as e:
+        # DuckDB raises InterruptException while executing, and Arrow an OSError while streaming batches
+        if timed_out.is_set():
+            raise QueryTimeout(f"Query stopped after the {timeout:g}s execution budget") from e
+        if handle.cancelled:
+            raise QueryCancelled("Query cancelled") from e
+        raise
+    finally:
+        if timer:
+            timer.cancel()
+        handle._detach(con)
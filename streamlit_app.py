@@ -2,8 +2,29 @@ import streamlit as st
 import pandas as pd
 import duckdb
 import os
-from pydantic import BaseModel
-from llm_engine import query_llm
+import asyncio
+import contextvars
+import time
+from collections import OrderedDict
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, wait
+from llm_engine import close_async_clients, query_llm
+from llm_cache import get_llm_cache
+from llm_router import get_router
+from dataset_store import TABLE_NAME, content_hash, file_fingerprint, get_dataset_store
+from profiling import load_profile
+from schema_index import load_column_index
+from ingestion import UPLOAD_TYPES, LoadProgress, SchemaMismatch, append_buffer, ingest_buffer, ingest_path
+from normalization import load_conversions
+from text_to_sql import SQLQuery, answer_questions, build_question_prompt, run_chart, run_sql, sanitize_columns
+from query_results import export_result
+from result_cache import get_result_cache
+from metrics import get_metrics, serve_metrics, span
+from sql_guard import QueryCancelled, QueryHandle, QueryTimeout, SQLRejected
+from config import settings
+
+if settings.metrics_port:
+    serve_metrics(settings.metrics_port)
 
 # --- Page Config ---
 st.set_page_config(
@@ -19,12 +40,26 @@ if "table_name" not in st.session_state:
     st.session_state.table_name = None
 if "schema_info" not in st.session_state:
     st.session_state.schema_info = None
+if "dataset_id" not in st.session_state:
+    st.session_state.dataset_id = None
+if "upload_hashes" not in st.session_state:
+    st.session_state.upload_hashes = {}
+if "profiles" not in st.session_state:
+    st.session_state.profiles = {}
+if "column_indexes" not in st.session_state:
+    st.session_state.column_indexes = {}
+if "charts" not in st.session_state:
+    st.session_state.charts = OrderedDict()
 
 # --- Sidebar ---
 with st.sidebar:
     st.header("Configuration")
     try:
-        if "general" in st.secrets and "llm_provider" in st.secrets["general"]:
+        if settings.llm_routes:
+            st.success(f"LLM Routes: **{settings.llm_routes}**")
+        elif settings.llm_provider:
+            st.success(f"LLM Provider: **{settings.llm_provider.upper()}**")
+        elif "general" in st.secrets and "llm_provider" in st.secrets["general"]:
             provider = st.secrets["general"]["llm_provider"]
             st.success(f"LLM Provider: **{provider.upper()}**")
         else:
@@ -36,39 +71,99 @@ with st.sidebar:
 
     st.divider()
     st.markdown("###  Dev Tools")
+    llm_cache = get_llm_cache()
+    result_cache = get_result_cache()
+    bypass_llm_cache = st.checkbox("Bypass LLM cache", value=False)
+    profile_sql = st.checkbox("Profile SQL (EXPLAIN ANALYZE)", value=settings.explain_analyze)
+    st.caption(f"LLM cache: {llm_cache.hits} hits / {llm_cache.misses} misses")
+    st.caption(f"Result cache: {result_cache.hits} hits / {result_cache.misses} misses")
+    for route in get_router().status():
+        st.caption(f"Route {route['route']}: circuit {route['circuit']}")
     if st.button("Clear Cache"):
         st.cache_data.clear()
+        llm_cache.clear()
+        result_cache.clear()
         st.rerun()
 
+    # Filled in at the end of the run, so it includes this run's stages
+    performance_panel = st.expander("Performance")
+
 # --- Main App ---
 st.title(" End-to-End Consumer Data Pipeline")
 st.markdown("### Embedded Analytics with DuckDB & Llama 3")
 
 # --- Phase 2: Ingestion ---
+def format_bytes(size: int) -> str:
+    for unit in ["B", "KB", "MB", "GB"]:
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+def describe_progress(progress: LoadProgress) -> str:
+    parts = []
+    if progress.bytes_read is not None:
+        parts.append(f"{format_bytes(progress.bytes_read)} read")
+    if progress.rows_loaded is not None:
+        parts.append(f"{'' if progress.done else '≈'}{progress.rows_loaded:,} rows")
+    parts.append(f"{progress.elapsed:.0f}s elapsed")
+    return ("Loaded: " if progress.done else "Loading... ") + " · ".join(parts)
+
 st.header("1. Data Ingestion")
-uploaded_file = st.file_uploader("Upload a CSV file", type=["csv"])
+uploaded_file = st.file_uploader(
+    "Upload a data file (CSV, Parquet, JSON/NDJSON, gzip/zstd-compressed CSV or JSON)", type=UPLOAD_TYPES
+)
+server_path = None
+if settings.server_data_dir:
+    # Files larger than the worker's memory can't go through the uploader, which buffers them in RAM
+    server_path = st.text_input(f"...or load a large file already on the server, relative to `{settings.server_data_dir}`")
 
+store = get_dataset_store()
+dataset_id = None
 if uploaded_file:
-    # Save to temp file for DuckDB to read directly (Zero-Copy)
-    with open("temp_data.csv", "wb") as f:
-        f.write(uploaded_file.getbuffer())
-    
+    # Hash each upload once; reruns reuse the digest instead of rehashing the buffer
+    if uploaded_file.file_id not in st.session_state.upload_hashes:
+        st.session_state.upload_hashes[uploaded_file.file_id] = content_hash(uploaded_file.getbuffer())
+    dataset_id = st.session_state.upload_hashes[uploaded_file.file_id]
+    # Create the dataset's persistent database straight from the upload buffer
+    load_source = lambda on_progress: ingest_buffer(store, dataset_id, uploaded_file.getbuffer(), uploaded_file.name, on_progress)
+elif server_path:
+    data_dir = Path(settings.server_data_dir).resolve()
+    source_path = (data_dir / server_path).resolve()
+    if not source_path.is_relative_to(data_dir) or not source_path.is_file():
+        st.error(f"No such file under {settings.server_data_dir}: {server_path}")
+    else:
+        dataset_id = file_fingerprint(source_path)
+        # Read in place: no copy of the file is made
+        load_source = lambda on_progress: ingest_path(store, dataset_id, str(source_path), on_progress)
+
+if dataset_id:
     # Load into DuckDB
     try:
-        # Connect to in-memory DuckDB
-        con = duckdb.connect(database=":memory:")
+        if not store.exists(dataset_id):
+            load_progress = st.progress(0.0, text="Loading...")
+            with span("ingest", dataset_id=dataset_id):
+                load_source(lambda progress: load_progress.progress(min(progress.fraction or 0.0, 1.0), text=describe_progress(progress)))
         
-        # Create table from CSV
-        con.execute("CREATE OR REPLACE TABLE analysis_staging AS SELECT * FROM 'temp_data.csv'")
+        # Reuse the dataset's long-lived connection
+        con = store.connect(dataset_id)
         
-        # Get Schema
-        schema_df = con.execute("DESCRIBE analysis_staging").fetchdf()
+        # Get Schema and column statistics (profiled once per dataset, then cached)
+        if dataset_id not in st.session_state.profiles:
+            with span("profile", dataset_id=dataset_id):
+                st.session_state.profiles[dataset_id] = load_profile(con)
+                # Column relevance index for pruning wide schemas, built once per dataset next to the profile
+                st.session_state.column_indexes[dataset_id] = load_column_index(con, st.session_state.profiles[dataset_id])
+        profile = st.session_state.profiles[dataset_id]
+        schema_df = pd.DataFrame(profile["columns"])
         
         # Get Preview
         preview_df = con.execute("SELECT * FROM analysis_staging LIMIT 5").fetchdf()
         
-        st.session_state.table_name = "analysis_staging"
-        st.session_state.schema_info = schema_df.to_dict(orient="records")
+        st.session_state.table_name = TABLE_NAME
+        st.session_state.dataset_id = dataset_id
+        st.session_state.schema_info = profile["columns"]
+        st.session_state.column_index = st.session_state.column_indexes[dataset_id]
         
         col1, col2 = st.columns(2)
         with col1:
@@ -76,70 +171,206 @@ if uploaded_file:
             st.dataframe(preview_df, use_container_width=True)
         with col2:
             st.subheader("Detected Schema")
-            st.dataframe(schema_df[["column_name", "column_type"]], use_container_width=True)
+            st.dataframe(
+                schema_df[["column_name", "column_type", "null_count", "approx_distinct", "min", "max"]],
+                use_container_width=True
+            )
             
-        st.success(f"Successfully loaded {len(con.execute('SELECT * FROM analysis_staging').fetchall())} rows.")
+        st.success(f"Successfully loaded {profile['row_count']:,} rows.")
+        conversions = load_conversions(con)
+        if conversions:
+            st.caption("Converted from text: " + ", ".join(
+                f"`{conversion.column}` → {conversion.target_type}" for conversion in conversions
+            ))
+
+        # Incremental load: merge a newer extract into this dataset instead of re-ingesting the whole file
+        with st.expander("Append or upsert a file into this dataset"):
+            delta_file = st.file_uploader("File with the same columns", type=UPLOAD_TYPES, key="append_file")
+            key_columns = st.multiselect(
+                "Key columns (rows replace stored rows with the same key; leave empty to append every row)",
+                [column["column_name"] for column in profile["columns"]],
+            )
+            if "append_message" in st.session_state:
+                st.info(st.session_state.pop("append_message"))
+            if delta_file and st.button("Merge into dataset"):
+                try:
+                    with span("ingest.append", dataset_id=dataset_id, keys=",".join(key_columns)):
+                        result = append_buffer(store, dataset_id, delta_file.getbuffer(), delta_file.name, key_columns)
+                except (SchemaMismatch, ValueError) as e:
+                    st.error(f"Could not merge {delta_file.name}: {e}")
+                else:
+                    if result.skipped:
+                        st.session_state.append_message = f"{delta_file.name} was already merged into this dataset."
+                    else:
+                        st.session_state.append_message = (
+                            f"Merged {delta_file.name}: {result.inserted:,} rows added, {result.updated:,} updated"
+                            + (f", {result.duplicates:,} duplicate keys dropped" if result.duplicates else "") + "."
+                        )
+                    # The stored profile was updated in place; pick it up on the rerun
+                    st.session_state.profiles.pop(dataset_id, None)
+                    st.session_state.charts.clear()
+                    st.rerun()
         
     except Exception as e:
         st.error(f"Error loading data: {e}")
 
 # --- Phase 3: AI Analysis (Text-to-SQL) ---
-class SQLQuery(BaseModel):
-    sql_query: str
-    explanation: str
+def export_download(dataset_id: str, sql_query: str, fmt: str):
+    """
+    Returns a deferred download callable that streams the full result to disk only when clicked.
+    """
+    return lambda: open(export_result(get_dataset_store().connect(dataset_id), sql_query, fmt, dataset_id), "rb")
+
+def set_page(page_key: str, offsets: list[int]):
+    st.session_state[page_key] = offsets
+
+def set_cancelled(cancel_key: str, cancelled: bool):
+    st.session_state[cancel_key] = cancelled
+
+def wait_for_query(future, status, cancel):
+    """
+    Waits for a query running on the worker thread. Updating the status element gives Streamlit a chance to end
+    this run when the user presses Cancel, and the query is interrupted on the way out.
+    """
+    start = time.perf_counter()
+    while not wait([future], timeout=0.25).done:
+        status.caption(f"Running query... {time.perf_counter() - start:.1f}s")
+    status.empty()
+    cancel.empty()
+    return future.result()
+
+def run_batch(questions: list[str], system_prompt):
+    """
+    Answers the questions concurrently and renders each result as soon as it is ready.
+    """
+    progress = st.progress(0.0, text=f"0 / {len(questions)} questions answered")
+    # Any click ends this run; the handle then interrupts the queries still running
+    st.button("Cancel batch")
+    # Execution happens in worker threads, which cannot read st.session_state
+    dataset_id = st.session_state.dataset_id
+    
+    async def render():
+        done = 0
+        execute = lambda sql_query: sanitize_columns(run_sql(dataset_id, sql_query, explain=profile_sql, handle=batch_handle).to_pandas())
+        # Inside the coroutine, so queries are interrupted before asyncio.run waits for their threads
+        with QueryHandle() as batch_handle:
+            try:
+                async for result in answer_questions(questions, system_prompt, execute, use_cache=not bypass_llm_cache):
+                    done += 1
+                    progress.progress(done / len(questions), text=f"{done} / {len(questions)} questions answered")
+                    with st.expander(f"{'❌' if result.error else '✅'} {result.question} ({result.elapsed:.1f}s)", expanded=False):
+                        if result.explanation:
+                            st.markdown(f"**Plan:** {result.explanation}")
+                        if result.sql_query:
+                            st.code(result.sql_query, language="sql")
+                        if result.error:
+                            st.error(result.error)
+                        else:
+                            st.dataframe(result.result_df, use_container_width=True)
+            finally:
+                await close_async_clients()
+    
+    asyncio.run(render())
 
 if st.session_state.table_name:
     st.divider()
     st.header("2. AI Analysis")
-    user_query = st.text_input("Ask a question about your data:")
+    mode = st.radio("Mode", ["Single question", "Batch"], horizontal=True, label_visibility="collapsed")
     
-    if user_query:
-        with st.spinner("Generating SQL..."):
-            # Construct System Prompt
-            schema_str = "\n".join([f"- {col['column_name']} ({col['column_type']})" for col in st.session_state.schema_info])
-            
-            system_prompt = f"""
-            You are an expert DuckDB SQL analyst.
-            Your task is to convert the user's natural language question into a valid DuckDB SQL query.
-            
-            The table name is: `analysis_staging`
-            
-            Schema:
-            {schema_str}
-            
-            Rules:
-            1. Return a JSON object with `sql_query` and `explanation`.
-            2. Use DuckDB syntax.
-            3. Check the column type in the schema. If the column is a string (VARCHAR) and needs to be treated as a number, use `TRY_CAST(TRIM(REPLACE(column_name, ',', '.')) AS DOUBLE)`. If the column is already numeric (INTEGER, BIGINT, DOUBLE, etc.), use it directly without casting or string manipulation.
-            4. Do NOT include markdown formatting (```sql) in the `sql_query` field.
-            5. CRITICAL: Always alias aggregation functions (e.g. `SELECT COUNT(*) AS review_count ...`). Do NOT return columns with names like `count_star()`.
-            """
+    # Construct System Prompt, per question: wide tables only list the columns relevant to it
+    schema_info, column_index = st.session_state.schema_info, st.session_state.column_index
+    system_prompt = lambda question: build_question_prompt(schema_info, question, column_index)
+    
+    if mode == "Batch":
+        questions_text = st.text_area("Ask several questions, one per line:", height=200)
+        questions = [line.strip() for line in questions_text.splitlines() if line.strip()]
+        if st.button("Run batch", disabled=not questions):
+            run_batch(questions, system_prompt)
+        user_query = None
+    else:
+        user_query = st.text_input("Ask a question about your data:")
+    
+    cancel_key = f"cancelled:{user_query}"
+    if user_query and st.session_state.get(cancel_key):
+        st.info("Query cancelled.")
+        st.button("Run again", on_click=set_cancelled, args=(cancel_key, False))
+    elif user_query:
+        plan_slot = st.empty()
+        sql_slot = st.empty()
+        status_slot = st.empty()
+        cancel_slot = st.empty()
+        dataset_id = st.session_state.dataset_id
+        early_runs = {}
+        
+        # Page cursor per question: the start offsets of the pages visited so far, since a page cut by the
+        # memory cap holds fewer rows than the page size. Only the visible page is ever fetched
+        page_key = f"result_page:{user_query}"
+        offsets = st.session_state.get(page_key, [0])
+        offset = offsets[-1]
+        page_size = st.session_state.get("result_page_size", settings.result_page_size)
+        
+        def on_field(name, value):
+            # Start executing as soon as the streamed sql_query is complete, while the explanation still streams
+            if name == "sql_query" and isinstance(value, str):
+                sql_slot.code(value, language="sql")
+                early_runs[value] = sql_executor.submit(question_context.run, run_sql, dataset_id, value, offset, page_size, profile_sql, query_handle)
+        
+        # The handle exits before the executor, so a cancelled run interrupts its query instead of waiting for it
+        with span("question", question=user_query), st.spinner("Generating SQL..."), \
+                ThreadPoolExecutor(max_workers=1) as sql_executor, QueryHandle() as query_handle:
+            # Early execution runs on the worker thread; give it this question's trace
+            question_context = contextvars.copy_context()
+            cancel_slot.button("Cancel", on_click=set_cancelled, args=(cancel_key, True))
             
             # Call LLM
-            response = query_llm(system_prompt, user_query, SQLQuery)
+            response = query_llm(system_prompt(user_query), user_query, SQLQuery, use_cache=not bypass_llm_cache, on_field=on_field)
+            if not response:
+                cancel_slot.empty()
             
             if response:
-                st.markdown(f"**Plan:** {response.explanation}")
-                st.code(response.sql_query, language="sql")
+                plan_slot.markdown(f"**Plan:** {response.explanation}")
+                sql_slot.code(response.sql_query, language="sql")
                 
                 # Execute SQL
                 try:
-                    # Re-connect to DB (since it is in-memory, we need to ensure persistence or reload. 
-                    # For this simple version, we reload the CSV if connection is lost, but DuckDB in-memory persists in session if we keep the connection object.
-                    # However, Streamlit re-runs the script. We need to re-init the connection or use a persistent file.)
-                    
-                    # FIX: In-memory DB is lost on rerun. We need to reload the CSV every time or use a file-based DB.
-                    # For now, we reload the CSV since it is fast.
-                    con = duckdb.connect(database=":memory:")
-                    con.execute("CREATE OR REPLACE TABLE analysis_staging AS SELECT * FROM 'temp_data.csv'")
-                    
-                    result_df = con.execute(response.sql_query).fetchdf()
-                    
-                    # Sanitize column names to avoid issues with Streamlit/Arrow
-                    result_df.columns = [str(col).replace('(', '_').replace(')', '').replace('*', 'all') for col in result_df.columns]
+                    run = early_runs.get(response.sql_query) or sql_executor.submit(
+                        question_context.run, run_sql, dataset_id, response.sql_query, offset, page_size, profile_sql, query_handle
+                    )
+                    result_page = wait_for_query(run, status_slot, cancel_slot)
+                    result_df = sanitize_columns(result_page.to_pandas())
 
                     st.subheader("Result")
                     st.dataframe(result_df, use_container_width=True)
+                    for warning in result_page.warnings:
+                        st.warning(warning)
+                    if result_page.plan:
+                        with st.expander("Query profile (EXPLAIN ANALYZE)"):
+                            st.code(result_page.plan, language=None)
+                    if result_page.truncated:
+                        st.warning(f"Page cut to {len(result_df):,} rows to stay under the {settings.result_max_bytes // 1024**2} MB result cap; choose a smaller page size to see every row.")
+                    
+                    first_row = offset + 1
+                    nav_prev, nav_info, nav_next, nav_size = st.columns([1, 2, 1, 2])
+                    nav_prev.button("← Previous", disabled=len(offsets) == 1, on_click=set_page, args=(page_key, offsets[:-1]))
+                    nav_info.caption(f"Page {len(offsets)} · rows {first_row:,}–{result_page.next_offset:,}")
+                    nav_next.button("Next →", disabled=not result_page.has_next, on_click=set_page,
+                                    args=(page_key, offsets + [result_page.next_offset]))
+                    page_sizes = sorted({100, 1000, 10000, settings.result_page_size})
+                    nav_size.selectbox(
+                        "Rows per page", page_sizes, index=page_sizes.index(page_size),
+                        key="result_page_size",
+                        on_change=set_page, args=(page_key, [0])
+                    )
+                    
+                    export_csv, export_parquet = st.columns(2)
+                    export_csv.download_button(
+                        "Export full result (CSV)", export_download(dataset_id, response.sql_query, "csv"),
+                        file_name="result.csv", mime="text/csv"
+                    )
+                    export_parquet.download_button(
+                        "Export full result (Parquet)", export_download(dataset_id, response.sql_query, "parquet"),
+                        file_name="result.parquet", mime="application/octet-stream"
+                    )
                     
                     # Simple Visualization Logic
                     if len(result_df) > 0:
@@ -149,16 +380,51 @@ if st.session_state.table_name:
                             value = result_df.iloc[0, 0]
                             st.metric(label=col_name, value=str(value))
                         else:
-                            numeric_cols = result_df.select_dtypes(include=['number']).columns
-                            
-                            if len(numeric_cols) > 0 and len(result_df) < 50:
-                                # If the first column is the same as the numeric column (e.g. single column result),
-                                # don't set it as index, just plot it.
-                                if result_df.columns[0] == numeric_cols[0]:
-                                    st.bar_chart(result_df[numeric_cols[0]])
+                            # Charts cover the full result, not just this page: binning, top-K and downsampling
+                            # run in DuckDB and only the chart's points come back. Computed once per query.
+                            charts = st.session_state.charts
+                            chart_key = (dataset_id, response.sql_query)
+                            if chart_key not in charts:
+                                try:
+                                    run = sql_executor.submit(question_context.run, run_chart, dataset_id, response.sql_query, query_handle)
+                                    charts[chart_key] = wait_for_query(run, status_slot, cancel_slot)
+                                    # Bounded per session: the least recently shown charts are dropped first
+                                    while len(charts) > settings.chart_session_max_entries:
+                                        charts.popitem(last=False)
+                                except (QueryTimeout, duckdb.Error) as e:
+                                    st.warning(f"No chart: {e}")
+                            else:
+                                charts.move_to_end(chart_key)
+                            chart = charts.get(chart_key)
+                            if chart is not None:
+                                if chart.kind == "line":
+                                    st.line_chart(chart.data)
                                 else:
-                                    st.bar_chart(result_df.set_index(result_df.columns[0])[numeric_cols[0]])
+                                    st.bar_chart(chart.data)
+                                if chart.note:
+                                    st.caption(chart.note)
                             
+                except (SQLRejected, QueryTimeout) as e:
+                    st.error(f"Query not run to completion: {e}")
+                except QueryCancelled:
+                    st.info("Query cancelled.")
                 except Exception as e:
                     st.error(f"SQL Execution Error: {e}")
                     st.error("The generated SQL was invalid. Please try rephrasing.")
+
+# --- Performance Panel ---
+with performance_panel:
+    metrics = get_metrics()
+    summary = metrics.summary()
+    if summary:
+        st.dataframe(pd.DataFrame(summary).set_index("stage").round(3), use_container_width=True)
+        tokens = metrics.token_totals()
+        st.caption(f"LLM tokens: {tokens.get('prompt', 0):,} prompt / {tokens.get('completion', 0):,} completion")
+        last_trace = metrics.last_trace()
+        if last_trace:
+            st.markdown(f"**Last: {last_trace[0]['name']}** ({last_trace[0]['duration']:.2f}s)")
+            for record in last_trace[1:]:
+                st.caption(f"{record['name']}: {record['duration']:.3f}s" + (" · error" if "error" in record else ""))
+    else:
+        st.caption("No stages timed yet.")
+    st.caption(f"Spans: `{metrics.log_path}` · Prometheus: `{metrics.prometheus_path}`")
@@ -0,0 +1,17 @@
+import pytest
+
+import llm_router
+from config import settings
+
+@pytest.fixture(autouse=True)
+def fresh_router():
+    """
+    Every test starts with fresh circuit breakers, latency history and rate limits.
+    """
+    llm_router._router = None
+    yield
+    llm_router._router = None
+
+@pytest.fixture
+def no_llm_cache(monkeypatch):
+    monkeypatch.setattr(settings, "llm_cache_enabled", False)
@@ -0,0 +1,75 @@
+import duckdb
+import numpy as np
+import pytest
+
+from charts import chart_data, lttb
+
+@pytest.fixture
+def con():
+    con = duckdb.connect()
+    con.execute(
+        "CREATE TABLE analysis_staging AS SELECT range AS id, sin(range / 500.0) * 100 AS value, "
+        "TIMESTAMP '2024-01-01' + INTERVAL (range) MINUTE AS ts, 'city_' || (range % 120) AS city "
+        "FROM range(100000)"
+    )
+    return con
+
+def test_temporal_with_number_is_a_downsampled_line(con):
+    chart = chart_data(con, "SELECT ts, value FROM analysis_staging", max_points=500)
+    assert chart.kind == "line"
+    assert 3 <= len(chart.data) <= 500
+    assert "M4 + LTTB" in chart.note
+    # The downsampled series keeps both ends and stays in x order
+    assert chart.data.index.is_monotonic_increasing
+    assert chart.data.index[0] == np.datetime64("2024-01-01T00:00")
+    assert chart.data.index[-1] == np.datetime64("2024-01-01") + np.timedelta64(99999, "m")
+
+def test_two_numbers_are_a_line_of_the_second_over_the_first(con):
+    chart = chart_data(con, "SELECT id, value FROM analysis_staging", max_points=300)
+    assert chart.kind == "line"
+    assert len(chart.data) <= 300
+    assert list(chart.data.columns) == ["value"]
+    # M4 keeps each bin's extremes, so the series' peaks survive downsampling
+    assert chart.data["value"].max() == pytest.approx(100, abs=0.01)
+    assert chart.data["value"].min() == pytest.approx(-100, abs=0.01)
+
+def test_small_results_are_not_downsampled(con):
+    chart = chart_data(con, "SELECT id, value FROM analysis_staging WHERE id < 100", max_points=500)
+    assert (chart.kind, len(chart.data), chart.note) == ("line", 100, None)
+
+def test_temporal_alone_counts_rows_per_calendar_bucket(con):
+    chart = chart_data(con, "SELECT ts FROM analysis_staging", max_points=100)
+    assert chart.kind == "bar"
+    assert len(chart.data) <= 100
+    assert chart.note == "Rows per day"
+    assert chart.data["rows"].sum() == 100000
+
+@pytest.mark.parametrize("sql_query, column", [
+    ("SELECT city, value FROM analysis_staging", "value"),
+    ("SELECT city FROM analysis_staging", "rows"),
+])
+def test_text_column_is_top_k_bars(con, sql_query, column):
+    chart = chart_data(con, sql_query, top_k=10)
+    assert chart.kind == "bar"
+    assert len(chart.data) == 10
+    assert list(chart.data.columns) == [column]
+    assert chart.data[column].is_monotonic_decreasing
+    assert chart.note == "Top 10 of 120 city values"
+
+def test_one_number_is_a_histogram(con):
+    chart = chart_data(con, "SELECT value FROM analysis_staging", bins=20)
+    assert chart.kind == "histogram"
+    assert len(chart.data) == 20
+    assert chart.data["rows"].sum() == 100000
+
+def test_empty_result_has_no_chart(con):
+    assert chart_data(con, "SELECT value FROM analysis_staging WHERE id < 0") is None
+
+def test_lttb_keeps_threshold_points_including_the_ends():
+    x = np.arange(10000, dtype=float)
+    y = np.sin(x / 100)
+    indices = lttb(x, y, 250)
+    assert len(indices) == 250
+    assert indices[0] == 0 and indices[-1] == 9999
+    assert np.all(np.diff(indices) > 0)
+    assert len(lttb(x[:100], y[:100], 250)) == 100
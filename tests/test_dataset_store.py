@@ -0,0 +1,51 @@
+import pytest
+
+from config import settings
+from dataset_store import TABLE_NAME, DatasetStore
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "cache_dir", str(tmp_path))
+    return DatasetStore(str(tmp_path), max_bytes=1024**3, max_open=1)
+
+def _build(rows: int):
+    return lambda con: con.execute(f"CREATE TABLE {TABLE_NAME} AS SELECT range AS id FROM range({rows})")
+
+def test_eviction_skips_datasets_with_live_cursors(store):
+    store.create("old", _build(1000))
+    cursor = store.connect("old")
+
+    # Over budget, but the old dataset is in use: it stays, and its cursor keeps working
+    store.max_bytes = 0
+    store.create("new", _build(10))
+    assert store.exists("old")
+    assert cursor.execute(f"SELECT COUNT(*) FROM {TABLE_NAME}").fetchone()[0] == 1000
+
+    # Once the cursor is released the next eviction removes it
+    del cursor
+    store.evict(keep="new")
+    assert not store.exists("old")
+    assert store.exists("new")
+
+def test_drop_refuses_datasets_in_use(store):
+    store.create("d", _build(10))
+    cursor = store.connect("d")
+    assert store.in_use("d")
+    assert not store.drop("d")
+    assert cursor.execute(f"SELECT COUNT(*) FROM {TABLE_NAME}").fetchone()[0] == 10
+
+    del cursor
+    assert not store.in_use("d")
+    assert store.drop("d")
+    assert not store.exists("d")
+    with pytest.raises(KeyError):
+        store.connect("d")
+
+def test_cursors_outlive_their_connection_leaving_the_lru(store):
+    store.create("a", _build(5))
+    store.create("b", _build(7))
+    cursor = store.connect("a")
+    # max_open is 1: opening b pushes a's connection out of the LRU without closing it
+    store.connect("b")
+    assert cursor.execute(f"SELECT COUNT(*) FROM {TABLE_NAME}").fetchone()[0] == 5
+    assert store.in_use("a")
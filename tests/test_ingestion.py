@@ -0,0 +1,42 @@
+import pytest
+
+from config import settings
+from dataset_store import TABLE_NAME, DatasetStore
+from ingestion import append_buffer, ingest_buffer
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "cache_dir", str(tmp_path))
+    # Every file counts as large, so loads run in large-file mode
+    monkeypatch.setattr(settings, "large_file_threshold_bytes", 0)
+    return DatasetStore(str(tmp_path), max_bytes=1024**3, max_open=4)
+
+def _csv(rows) -> bytes:
+    return ("id,value\n" + "".join(f"{i},{value}\n" for i, value in rows)).encode()
+
+def test_large_append_keeps_insertion_order_for_later_queries(store):
+    ingest_buffer(store, "d", _csv((i, i) for i in range(100)), "base.csv")
+    append_buffer(store, "d", _csv((i, -i) for i in range(100, 200)), "delta.csv")
+    con = store.connect("d")
+    assert con.execute("SELECT current_setting('preserve_insertion_order')").fetchone()[0] is True
+    assert con.execute(f"SELECT COUNT(*) FROM {TABLE_NAME}").fetchone()[0] == 200
+
+def test_upsert_keeps_last_row_per_key_in_file_order(store):
+    ingest_buffer(store, "d", _csv((i, 0) for i in range(10)), "base.csv")
+    delta = [(i % 10, n) for n, i in enumerate(range(5000))]
+    result = append_buffer(store, "d", _csv(delta), "delta.csv", keys=["id"])
+    assert (result.inserted, result.updated) == (0, 10)
+    values = dict(store.connect("d").execute(f"SELECT id, value FROM {TABLE_NAME}").fetchall())
+    assert values == {i: 4990 + i for i in range(10)}
+
+def test_append_converts_delta_that_sniffs_as_numbers(store):
+    # Comma decimals with dots for thousands: stored as DOUBLE through a load-time conversion
+    ingest_buffer(store, "d", _csv((i, f'"{i}.000,5"') for i in range(1, 50)), "base.csv")
+    assert store.connect("d").execute(
+        f"SELECT typeof(value) FROM {TABLE_NAME} LIMIT 1"
+    ).fetchone()[0] == "DOUBLE"
+
+    # Without the conversion this delta reads as the decimals 1.234 and 2.5
+    append_buffer(store, "d", _csv([(100, "1.234"), (101, "2.500")]), "delta.csv")
+    values = dict(store.connect("d").execute(f"SELECT id, value FROM {TABLE_NAME} WHERE id >= 100").fetchall())
+    assert values == {100: 1234.0, 101: 2500.0}
@@ -0,0 +1,85 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import llm_engine
+from config import settings
+
+CONTENT = json.dumps({"answer": 42})
+
+class _MockServer(ThreadingHTTPServer):
+    """
+    Minimal OpenAI-compatible chat completions endpoint that counts accepted TCP connections.
+    """
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.requests = 0
+        self.connections = 0
+        self.lock = threading.Lock()
+        super().__init__(("127.0.0.1", 0), _Handler)
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        with self.server.lock:
+            self.server.connections += 1
+        super().setup()
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with self.server.lock:
+            self.server.requests += 1
+        time.sleep(self.server.delay)
+        body = json.dumps({
+            "id": "chatcmpl-test", "object": "chat.completion", "created": int(time.time()), "model": request["model"],
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": CONTENT}}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+@pytest.fixture
+def mock_openai(request, monkeypatch):
+    """
+    Points llm_engine at a local mock server, with a fresh API key so the test gets its own pooled client.
+    """
+    server = _MockServer(getattr(request, "param", 0.0))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setenv("OPENAI_BASE_URL", f"http://127.0.0.1:{server.server_port}/v1")
+    monkeypatch.setattr(llm_engine, "get_llm_provider", lambda: "openai")
+    monkeypatch.setattr(llm_engine, "get_api_key", lambda provider: f"test-key-{server.server_port}")
+    monkeypatch.setattr(settings, "llm_cache_enabled", False)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def test_sequential_queries_reuse_one_connection(mock_openai):
+    for i in range(5):
+        assert llm_engine.query_llm("You are a test.", f"question {i}") == CONTENT
+    assert mock_openai.requests == 5
+    assert mock_openai.connections == 1
+
+@pytest.mark.parametrize("mock_openai", [0.05], indirect=True)
+def test_concurrent_queries_stay_within_pool_limit(mock_openai, monkeypatch):
+    monkeypatch.setattr(settings, "llm_max_connections", 4)
+    monkeypatch.setattr(settings, "llm_max_keepalive_connections", 4)
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        responses = list(executor.map(lambda i: llm_engine.query_llm("You are a test.", f"question {i}"), range(48)))
+    assert responses == [CONTENT] * 48
+    assert mock_openai.requests == 48
+    assert 1 < mock_openai.connections <= 4, mock_openai.connections
@@ -0,0 +1,154 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import llm_cache
+import llm_engine
+from benchmarks.mock_llm_server import MockLLMServer, use_mock_provider
+from config import settings
+from llm_cache import LLMCache
+from llm_engine import aquery_llm, close_async_clients, query_llm
+from llm_router import get_router
+from text_to_sql import SQLQuery
+
+@pytest.fixture
+def routing(monkeypatch, no_llm_cache):
+    """
+    Two mock providers behind the router: openai as the primary route, groq as the backup. Circuits open on the
+    first transient error and go half-open after 0.2s.
+    """
+    monkeypatch.setattr(settings, "llm_breaker_failures", 1)
+    monkeypatch.setattr(settings, "llm_breaker_reset_seconds", 0.2)
+    monkeypatch.setattr(settings, "llm_backoff_base_seconds", 0.01)
+    with MockLLMServer(first_token_seconds=0.01, retry_after=0.1) as primary, \
+            MockLLMServer(first_token_seconds=0.01) as backup, \
+            use_mock_provider(primary, "openai"), use_mock_provider(backup, "groq"):
+        monkeypatch.setattr(settings, "llm_routes", "openai:gpt-4o,groq:llama-3.3-70b-versatile")
+        yield primary, backup
+
+def _breaker():
+    return next(breaker for route, breaker in get_router().breakers.items() if route.provider == "openai")
+
+def _open_primary(primary):
+    primary.server_error_rate = 1.0
+    assert query_llm("You are a test.", "outage", SQLQuery) is not None
+    assert _breaker().state == "open"
+    primary.server_error_rate = 0.0
+    time.sleep(0.3)
+    assert _breaker().state == "half-open"
+
+def test_rate_limited_trial_releases_the_circuit(routing):
+    primary, backup = routing
+    _open_primary(primary)
+    primary.error_rate = 1.0
+    assert query_llm("You are a test.", "trial gets a 429", SQLQuery) is not None
+    primary.error_rate = 0.0
+    assert not _breaker().trial
+
+    # Once the Retry-After pause is over, the next trial reaches the recovered primary and closes the circuit
+    time.sleep(0.3)
+    requests = primary.requests
+    assert query_llm("You are a test.", "recovered", SQLQuery) is not None
+    assert primary.requests == requests + 1
+    assert _breaker().state == "closed"
+
+def test_single_route_recovers_after_rate_limited_trial(routing, monkeypatch):
+    primary, backup = routing
+    monkeypatch.setattr(settings, "llm_routes", "openai:gpt-4o")
+    monkeypatch.setattr(settings, "llm_max_attempts", 1)
+    primary.server_error_rate = 1.0
+    assert query_llm("You are a test.", "outage", SQLQuery) is None
+    primary.server_error_rate, primary.error_rate = 0.0, 1.0
+    time.sleep(0.3)
+    assert query_llm("You are a test.", "trial gets a 429", SQLQuery) is None
+    primary.error_rate = 0.0
+    time.sleep(0.3)
+    assert query_llm("You are a test.", "recovered", SQLQuery) is not None
+    assert _breaker().state == "closed"
+
+def test_losing_hedged_trial_releases_the_circuit(routing, monkeypatch):
+    primary, backup = routing
+    monkeypatch.setattr(settings, "llm_hedge_default_seconds", 0.05)
+    monkeypatch.setattr(settings, "llm_hedge_min_seconds", 0.05)
+    _open_primary(primary)
+
+    # The slow primary's trial loses to the backup and is cancelled
+    primary.first_token_seconds = 1.0
+
+    async def ask():
+        try:
+            return await aquery_llm("You are a test.", "hedged", SQLQuery)
+        finally:
+            await close_async_clients()
+
+    assert asyncio.run(ask()) is not None
+    assert backup.requests >= 1
+    assert not _breaker().trial
+    assert _breaker().available()
+
+def test_slow_losers_do_not_delay_concurrent_backups(routing, monkeypatch):
+    primary, backup = routing
+    monkeypatch.setattr(settings, "llm_hedge_default_seconds", 0.1)
+    monkeypatch.setattr(settings, "llm_hedge_min_seconds", 0.1)
+    # Every primary attempt outlives its hedge and keeps running after the backup has answered
+    primary.first_token_seconds = 3.0
+
+    def ask(i):
+        start = time.perf_counter()
+        assert query_llm("You are a test.", f"question {i}", SQLQuery) is not None
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=48) as executor:
+        latencies = sorted(executor.map(ask, range(48)))
+    assert latencies[len(latencies) // 2] < 1.0
+    assert backup.requests >= 48
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_backup_answers_are_not_cached_for_the_primary(routing, monkeypatch, tmp_path, use_async):
+    primary, backup = routing
+    monkeypatch.setattr(settings, "llm_cache_enabled", True)
+    monkeypatch.setattr(llm_cache, "_cache", LLMCache(tmp_path / "llm_cache.sqlite", ttl_seconds=60, max_bytes=2**20))
+
+    def ask():
+        if not use_async:
+            return query_llm("You are a test.", "cached?", SQLQuery)
+
+        async def run():
+            try:
+                return await aquery_llm("You are a test.", "cached?", SQLQuery)
+            finally:
+                await close_async_clients()
+        return asyncio.run(run())
+
+    primary.server_error_rate = 1.0
+    assert ask() is not None
+    assert backup.requests == 1
+    primary.server_error_rate = 0.0
+    time.sleep(0.3)
+
+    # The backup's answer was not stored under the primary's key: the recovered primary is asked, and its answer
+    # is then served from the cache
+    requests = primary.requests
+    assert ask() is not None
+    assert primary.requests == requests + 1
+    assert ask() is not None
+    assert primary.requests == requests + 1
+
+def test_streamed_attempts_detach_the_session_context(routing, monkeypatch):
+    session = object()
+    monkeypatch.setattr(llm_engine, "get_script_run_ctx", lambda suppress_warning=False: session)
+    monkeypatch.setattr(llm_engine, "add_script_run_ctx",
+                        lambda thread, ctx: setattr(thread, llm_engine.SCRIPT_RUN_CONTEXT_ATTR_NAME, ctx))
+    threads = []
+
+    def on_field(name, value):
+        thread = threading.current_thread()
+        assert getattr(thread, llm_engine.SCRIPT_RUN_CONTEXT_ATTR_NAME) is session
+        threads.append(thread)
+
+    assert query_llm("You are a test.", "streamed", SQLQuery, on_field=on_field) is not None
+    assert threads
+    assert not any(hasattr(thread, llm_engine.SCRIPT_RUN_CONTEXT_ATTR_NAME) for thread in threads)
@@ -0,0 +1,109 @@
+import contextvars
+import json
+import threading
+import urllib.request
+
+import pytest
+
+import metrics
+from metrics import Metrics
+
+@pytest.fixture
+def collector(tmp_path):
+    return Metrics(tmp_path / "spans.jsonl", tmp_path / "metrics.prom")
+
+def _logged(collector):
+    return [json.loads(line) for line in collector.log_path.read_text().splitlines()]
+
+def test_spans_nest_and_are_logged(collector):
+    with collector.span("question", question="q") as attributes:
+        with collector.span("llm.query"):
+            pass
+        with pytest.raises(ValueError), collector.span("sql.execute"):
+            raise ValueError("bad")
+        attributes["rows"] = 3
+
+    child, failed, root = _logged(collector)
+    assert [child["name"], failed["name"], root["name"]] == ["llm.query", "sql.execute", "question"]
+    assert root["parent_id"] is None and root["attributes"] == {"question": "q", "rows": 3}
+    assert child["parent_id"] == failed["parent_id"] == root["span_id"]
+    assert child["trace_id"] == root["trace_id"]
+    assert failed["error"] == "ValueError: bad"
+    assert [span["name"] for span in collector.last_trace()] == ["question", "llm.query", "sql.execute"]
+
+def test_error_attribute_marks_span_failed(collector):
+    with collector.span("llm.query") as attributes:
+        attributes["error"] = "parse: bad json"
+    record, = _logged(collector)
+    assert record["error"] == "parse: bad json"
+    assert "error" not in record["attributes"]
+    assert collector.summary()[0]["errors"] == 1
+
+def test_spans_in_copied_context_threads_are_children(collector):
+    with collector.span("question"):
+        context = contextvars.copy_context()
+
+        def attempt():
+            with collector.span("llm.attempt"):
+                collector.annotate(route="openai:gpt-4o")
+
+        thread = threading.Thread(target=context.run, args=(attempt,))
+        thread.start()
+        thread.join()
+
+    attempt, root = _logged(collector)
+    assert attempt["parent_id"] == root["span_id"]
+    assert attempt["attributes"] == {"route": "openai:gpt-4o"}
+
+def test_annotate_targets_innermost_open_span(collector):
+    collector.annotate(ignored=True)
+    with collector.span("outer"):
+        with collector.span("inner"):
+            collector.annotate(attempts=2)
+        collector.annotate(route="groq")
+    inner, outer = _logged(collector)
+    assert inner["attributes"] == {"attempts": 2}
+    assert outer["attributes"] == {"route": "groq"}
+
+def test_prometheus_text(collector):
+    for _ in range(2):
+        with collector.span("sql.execute"):
+            pass
+    collector.record_tokens("openai", "gpt-4o", 10, 5)
+
+    text = collector.prometheus_text()
+    assert 'pipeline_stage_seconds_bucket{stage="sql.execute",le="0.005"} 2' in text
+    assert 'pipeline_stage_seconds_bucket{stage="sql.execute",le="+Inf"} 2' in text
+    assert 'pipeline_stage_seconds_count{stage="sql.execute"} 2' in text
+    assert 'pipeline_stage_errors_total{stage="sql.execute"} 0' in text
+    assert 'pipeline_llm_tokens_total{provider="openai",model="gpt-4o",kind="prompt"} 10' in text
+    assert 'pipeline_llm_tokens_total{provider="openai",model="gpt-4o",kind="completion"} 5' in text
+    # Top-level spans rewrite the textfile
+    assert collector.prometheus_path.read_text().startswith("# HELP pipeline_stage_seconds")
+
+def test_span_log_is_rotated(tmp_path):
+    collector = Metrics(tmp_path / "spans.jsonl", tmp_path / "metrics.prom", log_max_bytes=2000, log_backups=2)
+    for i in range(100):
+        with collector.span("question", i=i):
+            pass
+
+    logs = sorted(path.name for path in tmp_path.glob("spans.jsonl*"))
+    assert logs == ["spans.jsonl", "spans.jsonl.1", "spans.jsonl.2"]
+    assert all((tmp_path / name).stat().st_size <= 2000 for name in logs)
+    # The newest spans are in the live log, and no line is split across files
+    assert _logged(collector)[-1]["attributes"] == {"i": 99}
+    rotated = [json.loads(line) for line in (tmp_path / "spans.jsonl.1").read_text().splitlines()]
+    assert rotated[-1]["attributes"]["i"] == _logged(collector)[0]["attributes"]["i"] - 1
+
+def test_serve_metrics_listens_on_loopback(monkeypatch, collector):
+    monkeypatch.setattr(metrics, "_server", None)
+    monkeypatch.setattr(metrics, "_metrics", collector)
+    metrics.serve_metrics(0)
+    server = metrics._server
+    try:
+        assert server.server_address[0] == "127.0.0.1"
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.server_address[1]}/metrics") as response:
+            assert b"pipeline_stage_seconds" in response.read()
+    finally:
+        server.shutdown()
+        server.server_close()
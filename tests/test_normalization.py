@@ -0,0 +1,101 @@
+import datetime
+
+import duckdb
+import pytest
+
+from config import settings
+from dataset_store import TABLE_NAME
+from normalization import classify, detect_conversions, load_conversions, normalize_types
+
+@pytest.fixture
+def con():
+    return duckdb.connect()
+
+def _table(con, columns: dict[str, list]):
+    """
+    Creates the staging table with every column as VARCHAR, as a CSV of text would load.
+    """
+    names = list(columns)
+    rows = list(zip(*columns.values()))
+    con.execute(f"CREATE TABLE {TABLE_NAME} ({', '.join(f'{name} VARCHAR' for name in names)})")
+    con.executemany(f"INSERT INTO {TABLE_NAME} VALUES ({', '.join('?' for _ in names)})", rows)
+
+def _types(con) -> dict[str, str]:
+    return {name: column_type for name, column_type, *_ in con.execute(f"DESCRIBE {TABLE_NAME}").fetchall()}
+
+@pytest.mark.parametrize("values, kind, date_format", [
+    (["2024-01-31", "2024-02-29", ""], "date", None),
+    (["31.01.2024", "29.02.2024"], "date", "%d.%m.%Y"),
+    (["31/01/2024", "01/02/2024"], "date", "%d/%m/%Y"),
+    (["2024-01-31 12:00", "2024-02-01T08:30:15"], "timestamp", None),
+])
+def test_classify_dates(values, kind, date_format):
+    conversion = classify(values)
+    assert (conversion.kind, conversion.date_format) == (kind, date_format)
+
+def test_ambiguous_dates_stay_text():
+    # Day-first and month-first both fit
+    assert classify(["01/02/2024", "03/04/2024"]) is None
+
+@pytest.mark.parametrize("values, kind", [
+    (["1", "-20", "+300"], "integer"),
+    (["1.5", "2", ".25", "1e3"], "decimal"),
+    (["1,5", "1.234,56", "0,25"], "comma_decimal"),
+    (["1,234.56", "12,345", "7"], "thousands"),
+    (["yes", "No", "y"], "boolean"),
+])
+def test_classify_numbers_and_booleans(values, kind):
+    assert classify(values).kind == kind
+
+@pytest.mark.parametrize("values", [
+    ["1,234", "5,678"],       # A thousand or a decimal, depending on the locale
+    ["00123", "00456"],       # Codes, not numbers
+    ["Y", "Y", " y"],         # A single word
+    ["abc", "1"],
+])
+def test_classify_leaves_text_alone(values):
+    assert classify(values) is None
+
+@pytest.mark.parametrize("values, kind, currency", [
+    (["$1,234.50", "-$5", "$ 0.99"], "thousands", "$"),
+    (["12,50 €", "1.234,00 €", "3 €"], "comma_decimal", "€"),
+    (["£10", "£20"], "integer", "£"),
+])
+def test_classify_currency(values, kind, currency):
+    conversion = classify(values)
+    assert (conversion.kind, conversion.currency) == (kind, currency)
+
+def test_mixed_currencies_stay_text():
+    assert classify(["$5", "€5"]) is None
+
+def test_normalize_types_materializes_native_columns(con):
+    _table(con, {
+        "amount": ["1.234,5", "2,25", "", None],
+        "price": ["$1,000.00", "-$2.50", "$3", "$4"],
+        "day": ["31.01.2024", "01.02.2024", "29.02.2024", "01.03.2024"],
+        "active": ["yes", "no", "Yes", ""],
+        "code": ["007", "010", "123", "999"],
+    })
+    conversions = normalize_types(con)
+
+    assert {conversion.column for conversion in conversions} == {"amount", "price", "day", "active"}
+    assert _types(con) == {"amount": "DOUBLE", "price": "DOUBLE", "day": "DATE", "active": "BOOLEAN", "code": "VARCHAR"}
+    assert con.execute(f"SELECT * FROM {TABLE_NAME}").fetchall() == [
+        (1234.5, 1000.0, datetime.date(2024, 1, 31), True, "007"),
+        (2.25, -2.5, datetime.date(2024, 2, 1), False, "010"),
+        (None, 3.0, datetime.date(2024, 2, 29), True, "123"),
+        (None, 4.0, datetime.date(2024, 3, 1), None, "999"),
+    ]
+    assert load_conversions(con) == conversions
+
+def test_values_the_sample_missed_keep_the_column_as_text(con, monkeypatch):
+    monkeypatch.setattr(settings, "normalize_sample_rows", 10)
+    _table(con, {"value": [str(i) for i in range(1000)] + ["n/a"], "other": [str(i) for i in range(1001)]})
+    # The sample only sees numbers, so both columns are candidates...
+    assert [conversion.column for conversion in detect_conversions(con)] == ["value", "other"]
+
+    # ...but the full-table check finds the value that would be lost, and that column stays text
+    conversions = normalize_types(con)
+    assert [conversion.column for conversion in conversions] == ["other"]
+    assert _types(con) == {"value": "VARCHAR", "other": "BIGINT"}
+    assert con.execute(f"SELECT COUNT(*) FROM {TABLE_NAME} WHERE value = 'n/a'").fetchone()[0] == 1
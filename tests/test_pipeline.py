@@ -0,0 +1,75 @@
+import json
+
+import pytest
+
+import dataset_store
+import metrics
+import result_cache
+from benchmarks.mock_llm_server import MockLLMServer, use_mock_provider
+from config import settings
+from pipeline import main
+
+GROUPS_SQL = "SELECT grp, COUNT(*) AS n FROM analysis_staging GROUP BY grp ORDER BY grp"
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch, no_llm_cache):
+    """
+    A fresh cache directory with its own dataset store, result cache and metrics, and a data file of 30 rows in
+    three groups.
+    """
+    monkeypatch.setattr(settings, "cache_dir", str(tmp_path / "cache"))
+    monkeypatch.setattr(settings, "llm_routes", None)
+    monkeypatch.setattr(dataset_store, "_store", None)
+    monkeypatch.setattr(result_cache, "_cache", None)
+    monkeypatch.setattr(metrics, "_metrics", None)
+    data = tmp_path / "sales.csv"
+    data.write_text("id,grp\n" + "".join(f"{i},{'abc'[i % 3]}\n" for i in range(30)))
+    return tmp_path, data
+
+def _run(mock, *argv) -> int:
+    with mock, use_mock_provider(mock, "openai"):
+        return main(list(argv))
+
+def _report(out):
+    report_dir, = out.iterdir()
+    return report_dir, json.loads((report_dir / "report.json").read_text())
+
+def test_main_answers_questions_and_exports_results(workspace):
+    tmp_path, data = workspace
+    questions = tmp_path / "questions.txt"
+    questions.write_text("Rows per group?\n\nHow many rows per group?\nRows per group?\n")
+    delta = tmp_path / "delta.csv"
+    delta.write_text("id,grp\n0,d\n100,d\n")
+    out = tmp_path / "out"
+
+    mock = MockLLMServer(content={"sql_query": GROUPS_SQL, "explanation": "Counts rows per group."})
+    assert _run(mock, "--data", str(data), "--questions", str(questions), "--question", "Group sizes?",
+                "--append", str(delta), "--key", "id", "--out", str(out), "--no-cache") == 0
+    assert mock.requests == 3
+
+    report_dir, report = _report(out)
+    assert report["source"] == str(data)
+    assert report["row_count"] == 31
+    assert report["error"] is None
+    assert [(entry["inserted"], entry["updated"]) for entry in report["appends"]] == [(1, 1)]
+    # --question first, then the file's questions without blanks and repeats
+    assert [q["question"] for q in report["questions"]] == ["Group sizes?", "Rows per group?", "How many rows per group?"]
+    for index, q in enumerate(report["questions"], 1):
+        assert (q["index"], q["sql_query"], q["preview_rows"], q["error"]) == (index, GROUPS_SQL, 4, None)
+        export = report_dir / q["export"]
+        assert export.name.startswith(f"q{index:03d}-") and export.suffix == ".csv"
+        assert export.read_text().splitlines() == ["grp,n", "a,9", "b,10", "c,10", "d,2"]
+    assert "## 1. Group sizes?" in (report_dir / "report.md").read_text()
+
+def test_main_reports_failed_questions(workspace):
+    tmp_path, data = workspace
+    out = tmp_path / "out"
+    mock = MockLLMServer(content={"sql_query": "SELECT missing_column FROM analysis_staging", "explanation": ""})
+    assert _run(mock, "--data", str(data), "--question", "Broken?", "--format", "parquet", "--out", str(out),
+                "--no-cache") == 1
+
+    report_dir, report = _report(out)
+    q, = report["questions"]
+    assert q["export"] is None
+    assert "missing_column" in q["error"]
+    assert not list(report_dir.glob("*.parquet"))
@@ -0,0 +1,45 @@
+import duckdb
+import pytest
+
+from charts import chart_data
+from query_results import export_result, fetch_page
+
+@pytest.fixture
+def con():
+    con = duckdb.connect()
+    con.execute("CREATE TABLE analysis_staging AS SELECT range AS id, range % 3 AS grp FROM range(10)")
+    return con
+
+def test_fetch_page_accepts_trailing_line_comment(con):
+    page = fetch_page(con, "select * from analysis_staging -- trailing comment", page_size=4)
+    assert page.table.num_rows == 4
+    assert page.has_next
+
+def test_export_and_chart_accept_trailing_line_comment(con, tmp_path):
+    sql = "SELECT grp, COUNT(*) AS n FROM analysis_staging GROUP BY grp -- rows per group"
+    path = export_result(con, sql, "csv", "groups", out_dir=str(tmp_path))
+    assert path.read_text().count("\n") == 4
+    chart = chart_data(con, sql)
+    assert chart.kind == "line"
+
+def test_truncated_page_resumes_at_next_offset(con):
+    sql = "SELECT id, repeat('x', 1000) AS payload FROM range(100) t(id) ORDER BY id"
+    first = fetch_page(con, sql, page_size=50, max_bytes=10_000)
+    assert first.truncated and first.has_next
+    assert 0 < first.table.num_rows < 50
+
+    seen, offset, has_next = [], 0, True
+    while has_next:
+        page = fetch_page(con, sql, offset, page_size=50, max_bytes=10_000)
+        seen += page.table.column("id").to_pylist()
+        offset, has_next = page.next_offset, page.has_next
+    assert seen == list(range(100))
+
+def test_row_wider_than_cap_makes_its_own_page(con):
+    sql = "SELECT id, repeat('x', 100000) AS payload FROM range(3) t(id) ORDER BY id"
+    pages, offset, has_next = [], 0, True
+    while has_next and len(pages) < 10:
+        page = fetch_page(con, sql, offset, page_size=10, max_bytes=1_000)
+        pages.append(page.table.column("id").to_pylist())
+        offset, has_next = page.next_offset, page.has_next
+    assert pages == [[0], [1], [2]]
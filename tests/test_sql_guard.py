@@ -0,0 +1,82 @@
+import threading
+import time
+
+import duckdb
+import pytest
+
+import dataset_store
+import result_cache
+import text_to_sql
+from config import settings
+from dataset_store import TABLE_NAME, DatasetStore
+from sql_guard import QueryCancelled, QueryHandle, QueryTimeout, SQLRejected, guarded, preflight
+from text_to_sql import run_sql
+
+# Large enough to run for minutes unless interrupted
+SLOW_QUERY = "SELECT SUM(a.range * b.range) FROM range(1000000) a, range(1000000) b"
+
+@pytest.fixture
+def con():
+    con = duckdb.connect()
+    con.execute("CREATE TABLE analysis_staging AS SELECT range AS id FROM range(1000)")
+    return con
+
+def test_preflight_rejects_plans_over_the_row_budget(con, monkeypatch):
+    monkeypatch.setattr(settings, "sql_reject_estimated_rows", 100_000)
+    with pytest.raises(SQLRejected, match="1,000,000 intermediate rows"):
+        preflight(con, "SELECT * FROM analysis_staging a, analysis_staging b")
+
+def test_preflight_warns_below_the_row_budget(con, monkeypatch):
+    monkeypatch.setattr(settings, "sql_warn_estimated_rows", 100_000)
+    check = preflight(con, "SELECT * FROM analysis_staging a, analysis_staging b")
+    assert check.estimated_rows == 1_000_000
+    assert len(check.warnings) == 2
+    assert preflight(con, "SELECT * FROM analysis_staging").warnings == []
+
+@pytest.mark.parametrize("sql_query", ["DROP TABLE analysis_staging", "SELECT 1; SELECT 2"])
+def test_preflight_rejects_anything_but_a_single_select(con, sql_query):
+    with pytest.raises(SQLRejected):
+        preflight(con, sql_query)
+
+def test_timeout_interrupts_the_query(con):
+    start = time.perf_counter()
+    with pytest.raises(QueryTimeout), guarded(con, timeout=0.2):
+        con.execute(SLOW_QUERY).fetchall()
+    assert time.perf_counter() - start < 5
+    # The connection is still usable
+    assert con.execute("SELECT COUNT(*) FROM analysis_staging").fetchone()[0] == 1000
+
+def test_cancel_interrupts_the_query(con):
+    handle = QueryHandle()
+    threading.Timer(0.2, handle.cancel).start()
+    start = time.perf_counter()
+    with pytest.raises(QueryCancelled), guarded(con, handle, timeout=0):
+        con.execute(SLOW_QUERY).fetchall()
+    assert time.perf_counter() - start < 5
+
+    # Further queries under a cancelled handle do not start
+    with pytest.raises(QueryCancelled), guarded(con, handle):
+        pytest.fail("the block ran")
+
+def test_run_sql_plans_under_the_handle(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "cache_dir", str(tmp_path))
+    store = DatasetStore(str(tmp_path), max_bytes=1024**3, max_open=4)
+    monkeypatch.setattr(dataset_store, "_store", store)
+    monkeypatch.setattr(result_cache, "_cache", None)
+    store.create("d", lambda con: con.execute(f"CREATE TABLE {TABLE_NAME} AS SELECT range AS id FROM range(10)"))
+
+    # EXPLAIN runs on a connection the handle can interrupt
+    handle, attached = QueryHandle(), []
+
+    def spy(con, sql_query):
+        attached.append(con in handle._connections)
+        return preflight(con, sql_query)
+
+    monkeypatch.setattr(text_to_sql, "preflight", spy)
+    assert run_sql("d", f"SELECT * FROM {TABLE_NAME}", handle=handle).table.num_rows == 10
+    assert attached == [True]
+
+    handle.cancel()
+    with pytest.raises(QueryCancelled):
+        run_sql("d", f"SELECT * FROM {TABLE_NAME}", handle=handle)
+    assert attached == [True]
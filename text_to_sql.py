@@ -0,0 +1,160 @@
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import AsyncIterator, Callable
+
+import pandas as pd
+from pydantic import BaseModel
+
+from charts import ChartData, chart_data
+from config import settings
+from dataset_store import TABLE_NAME, get_dataset_store
+from llm_engine import aquery_llm
+from metrics import span
+from query_results import ResultPage, explain_analyze, fetch_page
+from result_cache import get_result_cache
+from schema_index import ColumnIndex, prune_schema
+from sql_guard import QueryHandle, guarded, preflight
+
+# --- Models ---
+class SQLQuery(BaseModel):
+    sql_query: str
+    explanation: str
+
+@dataclass
+class QuestionResult:
+    question: str
+    sql_query: str = None
+    explanation: str = None
+    result_df: pd.DataFrame = None
+    error: str = None
+    elapsed: float = 0.0
+
+# --- Prompt Construction ---
+def build_system_prompt(schema_info: list[dict], total_columns: int = None) -> str:
+    schema_str = "\n".join([
+        f"- {col['column_name']} ({col['column_type']})"
+        + (f", e.g. {', '.join(repr(v[:40]) for v in col['samples'])}" if col.get("samples") else "")
+        for col in schema_info
+    ])
+    if total_columns and total_columns > len(schema_info):
+        schema_str = f"(The {len(schema_info)} of {total_columns} columns most relevant to the question)\n" + schema_str
+
+    return f"""
+            You are an expert DuckDB SQL analyst.
+            Your task is to convert the user's natural language question into a valid DuckDB SQL query.
+
+            The table name is: `{TABLE_NAME}`
+
+            Schema:
+            {schema_str}
+
+            Rules:
+            1. Return a JSON object with `sql_query` and `explanation`.
+            2. Use DuckDB syntax.
+            3. Check the column type in the schema. Numbers, dates and booleans stored as text were converted to native types when the data was loaded, so use numeric (INTEGER, BIGINT, DOUBLE, etc.), DATE, TIMESTAMP and BOOLEAN columns directly without casting or string manipulation. Only if a string (VARCHAR) column must still be treated as a number, use `TRY_CAST(TRIM(REPLACE(column_name, ',', '.')) AS DOUBLE)`.
+            4. Do NOT include markdown formatting (```sql) in the `sql_query` field.
+            5. CRITICAL: Always alias aggregation functions (e.g. `SELECT COUNT(*) AS review_count ...`). Do NOT return columns with names like `count_star()`.
+            """
+
+def build_question_prompt(schema_info: list[dict], question: str, index: ColumnIndex = None) -> str:
+    """
+    System prompt for one question. On wide tables only the columns the index finds relevant are listed.
+    """
+    return build_system_prompt(prune_schema(schema_info, index, question), total_columns=len(schema_info))
+
+def sanitize_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Sanitizes column names to avoid issues with Streamlit/Arrow.
+    """
+    df.columns = [str(col).replace('(', '_').replace(')', '').replace('*', 'all') for col in df.columns]
+    return df
+
+# --- Execution ---
+def run_sql(dataset_id: str, sql_query: str, offset: int = 0, page_size: int = None, explain: bool = None,
+            handle: QueryHandle = None) -> ResultPage:
+    """
+    Returns the page of the query's result starting at row `offset`, from the result cache when possible.
+
+    The query is planned first and rejected with SQLRejected if it is not a single SELECT or its plan is over
+    budget; plan warnings are returned on the page. Execution is bounded by sql_timeout_seconds and can be
+    cancelled through `handle`. With explain (default: the explain_analyze setting) the query is also profiled
+    with EXPLAIN ANALYZE.
+    """
+    page_size = page_size or settings.result_page_size
+    explain = settings.explain_analyze if explain is None else explain
+    result_cache = get_result_cache()
+    # The dataset stays loaded in the store, so no CSV reload is needed
+    con = get_dataset_store().connect(dataset_id)
+    # Planning can be slow too, so it runs under the same budget and handle as the query
+    with span("sql.preflight", dataset_id=dataset_id) as attributes, guarded(con, handle):
+        check = preflight(con, sql_query)
+        attributes.update(estimated_rows=check.estimated_rows, warnings=check.warnings)
+    with span("sql.execute", dataset_id=dataset_id, offset=offset, page_size=page_size) as attributes:
+        result_page = result_cache.get(dataset_id, sql_query, offset, page_size)
+        attributes["cached"] = result_page is not None
+        if result_page is None:
+            result_page = fetch_page(con, sql_query, offset, page_size, handle=handle)
+            result_cache.put(dataset_id, sql_query, result_page)
+        attributes["rows"] = result_page.table.num_rows
+    result_page.warnings = check.warnings
+    if explain:
+        with span("sql.explain_analyze", dataset_id=dataset_id) as attributes:
+            result_page.plan, attributes["duckdb_total_seconds"] = explain_analyze(con, sql_query, handle)
+            attributes["plan"] = result_page.plan
+    return result_page
+
+def run_chart(dataset_id: str, sql_query: str, handle: QueryHandle = None) -> ChartData:
+    """
+    Chart data for the query's full result, aggregated and downsampled in DuckDB rather than from a fetched page.
+    """
+    con = get_dataset_store().connect(dataset_id)
+    with span("sql.chart", dataset_id=dataset_id) as attributes:
+        chart = chart_data(con, sql_query, handle)
+        attributes.update(kind=chart.kind if chart else None, points=len(chart.data) if chart else 0)
+    return chart
+
+# --- Batch Text-to-SQL ---
+async def answer_question(question: str, system_prompt: str | Callable[[str], str],
+                          execute_sql: Callable[[str], pd.DataFrame], use_cache: bool = True) -> QuestionResult:
+    """
+    Generates SQL for one question and runs it. execute_sql is called in a worker thread.
+    system_prompt may be a function of the question, e.g. to prune the schema per question.
+    Failures are recorded on the result rather than raised.
+    """
+    result = QuestionResult(question=question)
+    start = time.perf_counter()
+    with span("question", question=question) as attributes:
+        try:
+            prompt = system_prompt(question) if callable(system_prompt) else system_prompt
+            response = await aquery_llm(prompt, question, SQLQuery, use_cache=use_cache)
+            result.sql_query = response.sql_query
+            result.explanation = response.explanation
+            result.result_df = await asyncio.to_thread(execute_sql, response.sql_query)
+        except Exception as e:
+            result.error = attributes["error"] = str(e)
+    result.elapsed = time.perf_counter() - start
+    return result
+
+async def answer_questions(questions: list[str], system_prompt: str | Callable[[str], str],
+                           execute_sql: Callable[[str], pd.DataFrame],
+                           concurrency: int = None, use_cache: bool = True,
+                           semaphore: asyncio.Semaphore = None) -> AsyncIterator[QuestionResult]:
+    """
+    Answers many questions concurrently, at most `concurrency` at a time, yielding each result as soon as it is ready.
+    Pass a shared semaphore instead to bound several batches running at once.
+    The caller owns the event loop and closes its pooled clients with close_async_clients().
+    """
+    semaphore = semaphore or asyncio.Semaphore(concurrency or settings.llm_batch_concurrency)
+
+    async def run(question):
+        async with semaphore:
+            return await answer_question(question, system_prompt, execute_sql, use_cache)
+
+    tasks = [asyncio.create_task(run(question)) for question in questions]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()